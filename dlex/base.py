@@ -5,6 +5,7 @@ from typing import List
 
 from dlex import ModelReport, Params, logger
 from dlex.utils import set_seed
+from dlex.utils.early_termination import SuccessiveHalving
 
 
 class FrameworkBackend:
@@ -12,7 +13,8 @@ class FrameworkBackend:
             self,
             params: Params = None,
             training_idx: int = None,
-            report_queue: Queue = None):
+            report_queue: Queue = None,
+            early_termination: SuccessiveHalving = None):
         self.params = params
         self.configs = params.configs
         self.args = params.configs.args
@@ -23,6 +25,7 @@ class FrameworkBackend:
         params.training_idx = training_idx
         self.report = report
         self.report_queue = report_queue
+        self.early_termination = early_termination
 
         self.set_seed()
 
@@ -35,9 +38,10 @@ class FrameworkBackend:
         raise NotImplemented
 
     def update_report(self):
+        """Save the changes of the report and send them to the launcher"""
+        update = self.report.save()
         if self.report_queue:
-            # self.report_queue.put(self.report)
-            self.report.save()
+            self.report_queue.put((self.training_idx, update))
 
     def set_seed(self):
         set_seed(self.params.random_seed)
\ No newline at end of file
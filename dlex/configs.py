@@ -1,16 +1,22 @@
 """Reading model configurations"""
 import argparse
-import itertools
+import glob
+import keyword
+import math
 import os
+import random
 import re
 import tempfile
 from collections import OrderedDict, defaultdict
+from collections.abc import Sequence
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Tuple, Any, Union
+from functools import lru_cache
+from typing import List, Tuple, Any, Union, Dict
 
 import yaml
 from dlex.utils.logging import set_log_dir, logger
+from dlex.utils.run_registry import get_config_key
 
 DEFAULT_TMP_PATH = os.path.expanduser(os.path.join("~", "tmp"))
 DEFAULT_DATASET_PATH = os.path.expanduser(os.path.join("~", "tmp", "datasets"))
@@ -37,6 +43,28 @@ class ModuleConfigs:
     def get_output_dir():
         return os.getenv("DLEX_OUTPUT_DIR", "outputs")
 
+    @staticmethod
+    def get_registry_path():
+        return os.getenv("DLEX_REGISTRY_PATH", os.path.join(ModuleConfigs.get_checkpoint_dir(), "registry"))
+
+    @staticmethod
+    def get_experiment_store_path():
+        return os.getenv("DLEX_EXPERIMENT_STORE", os.path.join(ModuleConfigs.get_log_dir(), "experiments.db"))
+
+    @staticmethod
+    def get_worker_address():
+        return os.getenv("DLEX_WORKER_ADDRESS", os.path.join(ModuleConfigs.get_tmp_path(), "workers.sock"))
+
+
+_warned_params = set()
+
+
+def _warn_unset_param(name: str):
+    # warned once, since unset params are often read in hot loops (eg. `collate_fn`)
+    if name not in _warned_params:
+        _warned_params.add(name)
+        logger.warning("Access to unset param %s", name)
+
 
 class AttrDict(dict):
     _variables = None
@@ -79,7 +107,7 @@ class AttrDict(dict):
         self._overridden_params = overridden_params
 
     def __getattr__(self, item: str):
-        logger.warning("Access to unset param %s", item)
+        _warn_unset_param(item)
         return None
 
     def set(self, prop: Union[str, list], value):
@@ -141,7 +169,93 @@ class AttrDict(dict):
         return self.__dict__
 
     def __setstate__(self, d):
-        self.__dict__.update(d)
+        # attributes are the items, which are unpickled before the state. Copying them with `update` would drop
+        # `_variables` and `_overridden_params`, which are hidden from `keys`.
+        self.__dict__ = self
+
+
+class CompiledConfig(dict):
+    """Read-only configuration, created by `compile_config`.
+
+    Keys are stored in slots of a class generated for each set of keys, so reading a key as an attribute does not
+    go through `__getattr__`. Reading a key that is not set returns None and logs a warning the first time.
+    """
+    __slots__ = ("_name",)
+
+    def __init__(self, name: str, items: dict):
+        super().__init__(items)
+        object.__setattr__(self, "_name", name)
+        for key in type(self).__slots__:
+            object.__setattr__(self, key, items[key])
+
+    def __getattr__(self, item: str):
+        if item.startswith("__"):
+            raise AttributeError(item)
+        if item in self:  # key which cannot be a slot
+            return self[item]
+        _warn_unset_param(f"{self._name}.{item}")
+        return None
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"Config {self._name} is read-only. Use `replace` to change {key}.")
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError(f"Config {self._name} is read-only.")
+
+    __setitem__ = __delitem__ = update = setdefault = pop = popitem = clear = _read_only
+
+    def __reduce__(self):
+        return _make_compiled_config, (self._name, dict(self))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def to_dict(self, level=1):
+        return {
+            key: val.to_dict(level=level - 1) if isinstance(val, CompiledConfig) and level > 1 else val
+            for key, val in self.items()}
+
+    def replace(self, **changes) -> 'CompiledConfig':
+        """Return a copy of the config with some keys changed or added"""
+        return compile_config({**self, **changes}, self._name)
+
+
+@lru_cache(maxsize=None)
+def _get_compiled_config_cls(keys: Tuple[str]) -> type:
+    reserved = set(dir(CompiledConfig))
+    slots = tuple(
+        key for key in keys
+        if isinstance(key, str) and key.isidentifier() and not keyword.iskeyword(key) and
+        not key.startswith("_") and key not in reserved)
+    return type(CompiledConfig.__name__, (CompiledConfig,), dict(__slots__=slots, __module__=__name__))
+
+
+def _make_compiled_config(name: str, items: dict) -> CompiledConfig:
+    return _get_compiled_config_cls(tuple(items))(name, items)
+
+
+def compile_config(config: dict, name: str = "", defaults: dict = None) -> CompiledConfig:
+    """Compile a configuration (and its nested dictionaries) into read-only objects with fast attribute access.
+    Compiled configs can be pickled.
+
+    :param config:
+    :param name: name of the configuration, used in warnings
+    :param defaults: values of the keys which are not set, possibly nested
+    """
+    items = {}
+    for key, val in config.items():
+        if key in ['_variables', '_overridden_params']:
+            continue
+        if isinstance(val, dict):
+            val = compile_config(val, f"{name}.{key}", (defaults or {}).get(key))
+        items[key] = val
+    for key, val in (defaults or {}).items():
+        if key not in items:
+            items[key] = compile_config(val, f"{name}.{key}") if isinstance(val, dict) else val
+    return _make_compiled_config(name, items)
 
 
 @dataclass
@@ -158,8 +272,17 @@ class TrainConfig:
     """
     :param num_epochs: Number of epochs
     :type num_epochs: int
-    :param batch_size: Batch size
+    :param batch_size: Batch size. Use `auto` to pick the size with the best throughput (see `batch_size_search`)
     :type batch_size: int
+    :param batch_size_search: Options of the batch size search: max_batch_size, max_memory (fraction of device memory),
+        num_steps, use_cache
+    :type batch_size_search: dict
+    :param oom_recovery: On CUDA out of memory, split batches into micro-batches with gradient accumulation instead of
+        exiting. The number of micro-batches is doubled on each failure and halved again after
+        `oom_recovery_steps` steps without failure.
+    :type oom_recovery: bool
+    :param oom_recovery_steps: Number of successful steps before trying larger micro-batches again
+    :type oom_recovery_steps: int
     :param optimizer:
     :type optimizer: OptimizerConfig
     :param lr_scheduler (dict):
@@ -172,29 +295,62 @@ class TrainConfig:
     :param save_every: Time interval for saving model. Use s, m, h for number of seconds, minutes, hours. Use e for number of epochs.
             Examples: 100s, 30m, 2h, 1e
     :type save_every: str
+    :param keep_checkpoints: Number of checkpoints to keep besides `latest` and `best`. Keep all if not set.
+    :type keep_checkpoints: int
+    :param async_checkpoint: Write checkpoints on a background thread. Training only waits for the copy to host memory.
+    :type async_checkpoint: bool
     :param log_every: Time interval for logging to file
     :type log_every: str
+    :param async_evaluation: Evaluate on a background thread while training continues. Weights are snapshot to host
+        memory at each evaluation and loaded into a copy of the model on the same device. Results, best model
+        selection and early stopping are processed when the evaluation finishes. Training waits if the previous
+        evaluation has not finished.
+    :type async_evaluation: bool
+    :param timing_every: Number of steps between two records of time spent in each part of a training step
+        (data loading, forward, backward, optimizer, checkpoint, evaluation) and throughput.
+        Records are written to tensorboard and `timing_<training_idx>.jsonl` in the log folder. Set to 0 to disable.
+    :type timing_every: int
+    :param summary_interval: Minimum number of seconds between two per-step values of a scalar (eg. loss) written to
+        tensorboard. Set to 0 to write every step.
+    :type summary_interval: float
+    :param profile: Configs of torch.profiler (wait, warmup, active, repeat, activities, record_shapes, profile_memory,
+        with_stack, with_flops, epoch, evaluation). Traces and operator tables are exported to `profile` in the log folder.
+    :type profile: dict
     :param early_stop: Number of epochs to stop of results are not improving
     :type early_stop: int
     :param select_model: One of [best, last]
+    :param ema_decay_rate: If set, keep an exponential moving average of the weights, which is used for evaluation
+    :type ema_decay_rate: float
+    :param ema_update_every: Number of training steps between two updates of the moving average
+    :type ema_update_every: int
     """
     optimizer: OptimizerConfig
     num_epochs: int = None
     num_workers: int = None
     batch_size: int = None
+    batch_size_search: dict = None
+    oom_recovery: bool = True
+    oom_recovery_steps: int = 100
     lr_scheduler: dict = None
     train_set: str = "train"
     valid_set: str = None
     max_grad_norm: float = 5.0
     save_every: str = "1e"
+    keep_checkpoints: int = None
+    async_checkpoint: bool = True
     log_every: str = None
     eval_every: str = "1e"
+    async_evaluation: bool = False
+    timing_every: int = 100
+    summary_interval: float = 1.
+    profile: dict = None
     cross_validation: int = None
     early_stop: int = None
     select_model: str = "best"
     show_report: bool = False
     show_progress: bool = False
     ema_decay_rate: float = None
+    ema_update_every: int = 1
 
 
 @dataclass
@@ -202,13 +358,18 @@ class TestConfig:
     """
     :param batch_size:
     :type batch_size: int
-    :param metrics: List of metrics for evaluation.
+    :param metrics: List of metrics for evaluation. Precision, recall and F1 are binary scores of class 1 by default,
+        and can be averaged over classes with a suffix (eg. f1_macro, precision_micro).
     :type metrics: list
+    :param output_samples: Number of samples formatted as strings at each evaluation (the first ones of each set),
+        which are written to `outputs_<mode>.json` and shown with `--output_test_samples`. Use -1 for all samples.
+    :type output_samples: int
     """
     batch_size: int = None
     metrics: List[str] = field(default_factory=lambda: ["acc"])
     log_every: str = "5s"
     output: str = None
+    output_samples: int = 100
     test_sets: List[str] = None
 
 
@@ -222,6 +383,11 @@ class Params(AttrDict):
     test: TestConfig
     gpu: List[int] = None
     training_idx = None
+    # hash of the configurations, which names the checkpoint folder of the run
+    config_key: str = None
+    # set by the launcher: hash of the run in the run registry and checkpoint to resume the run from
+    run_key: str = None
+    resume_tag: str = None
 
     def __init__(
             self,
@@ -243,6 +409,9 @@ class Params(AttrDict):
         test = TestConfig(**test_attr_dict.to_dict()) if "test" in yaml_configs else TestConfig()
 
         super().__init__(yaml_configs, _variables=_variables, _overridden_params=_overridden_params)
+        for key in ["model", "dataset"]:
+            if isinstance(self.get(key), dict):
+                self[key] = compile_config(self[key], key)
 
         self.train = train
         self.test = test
@@ -252,6 +421,8 @@ class Params(AttrDict):
 
         # self.tag = ",".join(sorted([f"{name}={str(val)}" for name, val in _variables.items()])) if _variables else None
         self.tag = str(self.training_idx)
+        # computed before the configs are changed by the run (eg. folds of cross validation)
+        self.config_key = get_config_key(self)
 
     @property
     def args(self):
@@ -268,6 +439,10 @@ class Params(AttrDict):
             path = os.path.join(path, self.env_name)
             if self.tag:
                 path = os.path.join(path, self.tag)
+        # checkpoints saved before they were named by config key are still found
+        if self.config_key and (
+                os.path.exists(os.path.join(path, self.config_key)) or not glob.glob(os.path.join(path, "*.pt"))):
+            path = os.path.join(path, self.config_key)
         return path
 
 
@@ -327,6 +502,115 @@ def str2bool(val):
         raise argparse.ArgumentTypeError('Boolean value expected.')
 
 
+def _get_primes(n: int) -> List[int]:
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if all(candidate % p for p in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def _radical_inverse(index: int, base: int) -> float:
+    result, fraction = 0., 1.
+    while index > 0:
+        fraction /= base
+        result += fraction * (index % base)
+        index //= base
+    return result
+
+
+class SweepGrid(Sequence):
+    """Combinations of the values of variables, in the order of `itertools.product`. A combination is computed
+    from its index when it is accessed, so the grid is never expanded in memory.
+
+    :param variable_values: list of values of each variable
+    :param indices: indices in the full grid of the combinations of this grid. Default: all combinations
+    """
+
+    def __init__(self, variable_values: List[List[Any]], indices: Sequence = None):
+        self.variable_values = variable_values
+        self.size = math.prod(len(vals) for vals in variable_values)
+        self.indices = range(self.size) if indices is None else indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return SweepGrid(self.variable_values, self.indices[i])
+        index = self.indices[i]
+        values = []
+        for vals in reversed(self.variable_values):
+            index, pos = divmod(index, len(vals))
+            values.append(vals[pos])
+        return tuple(reversed(values))
+
+    def sample(self, num_samples: int, method: str = "random", seed: int = 0) -> 'SweepGrid':
+        """Select a subset of the combinations
+
+        :param num_samples:
+        :param method:
+            - random: combinations drawn uniformly without replacement
+            - quasi_random: combinations of a Halton sequence, which covers the values of every variable more
+              evenly than random sampling. Duplicated combinations are skipped.
+        :param seed: seed of the random sampling, or offset in the Halton sequence. With the same seed, the same
+            combinations are selected at each launch.
+        :return: grid of the selected combinations, in the order they are drawn
+        """
+        if num_samples >= len(self):
+            return self
+        if method == "random":
+            positions = random.Random(seed).sample(range(len(self)), num_samples)
+        elif method == "quasi_random":
+            bases = _get_primes(len(self.variable_values))
+            # position of each combination of the full grid in this grid
+            is_full = self.indices == range(self.size)
+            index_positions = None if is_full else {index: pos for pos, index in enumerate(self.indices)}
+            positions, seen = [], set()
+            k = seed or 0
+            while len(positions) < num_samples and k < 100 * self.size:
+                k += 1
+                index = 0
+                for vals, base in zip(self.variable_values, bases):
+                    index = index * len(vals) + int(_radical_inverse(k, base) * len(vals))
+                pos = index if is_full else index_positions.get(index)
+                if pos is not None and pos not in seen:
+                    seen.add(pos)
+                    positions.append(pos)
+        else:
+            raise ValueError("%s is not a valid sampling method" % method)
+        return SweepGrid(self.variable_values, [self.indices[pos] for pos in positions])
+
+
+class ParamsList(Sequence):
+    """Params of the combinations of a sweep grid. Params are created each time they are accessed.
+
+    :param configs:
+    :param env_name:
+    :param variable_names:
+    :param grid:
+    :param overridden_params: params of the environment
+    """
+
+    def __init__(self, configs, env_name: str, variable_names: List[str], grid: SweepGrid, overridden_params: dict):
+        self.configs = configs
+        self.env_name = env_name
+        self.variable_names = variable_names
+        self.grid = grid
+        self.overridden_params = overridden_params
+
+    def __len__(self):
+        return len(self.grid)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        variables = OrderedDict(zip(self.variable_names, self.grid[i]))
+        return self.configs.create_params(self.env_name, variables, self.overridden_params)
+
+
 @dataclass
 class Environment:
     name: str
@@ -336,11 +620,14 @@ class Environment:
     # variables
     variable_names: List[str] = None
     variable_values: List[List[Any]] = None
-    variables_list: List[Tuple[Any]] = None
+    variables_list: Sequence = None  # SweepGrid, or list of tuples of variable values
 
-    configs_list: List[Params] = None
+    configs_list: Sequence = None  # ParamsList, or list of Params
     report: Any = None
     desc: str = None
+    resources: Dict[str, Any] = None
+    priority: int = 0
+    early_termination: Dict[str, Any] = None
 
 
 class Configs:
@@ -493,6 +780,11 @@ class Configs:
 
         parser.add_argument('--show-progress', action="store_true",
                             help="show progress bar")
+        if self.mode in ["train", "test"]:
+            parser.add_argument(
+                '--worker-pool', nargs='?', const="", default=None, metavar='ADDRESS', dest='worker_pool',
+                help="run on the worker pool started with `python -m dlex.worker start` (default address: "
+                     "$DLEX_WORKER_ADDRESS or workers.sock in the tmp folder)")
 
         if self.mode == "train":
             parser.add_argument(
@@ -501,6 +793,12 @@ class Configs:
             parser.add_argument(
                 '-p, --num-processes', type=int, default=0, metavar='N', dest='num_processes',
                 help="number of training processes running at a time")
+            parser.add_argument(
+                '--max-retries', type=int, default=1, dest='max_retries',
+                help="number of times a failed training process is started again")
+            parser.add_argument(
+                '--rerun', action='store_true',
+                help="train again runs found as finished in the run registry")
             parser.add_argument(
                 '--save-all', action='store_true',
                 help='save every epoch')
@@ -603,10 +901,6 @@ class Configs:
                 if env_name not in self.env_names:
                     continue
 
-                # Unfold params for every variable combination
-                configs_list = []  # there are multiple configs if variables are chosen from lists
-
-                variables_list = []
                 variable_names = list(env_prop['variables'].keys()) if 'variables' in env_prop else []
                 variable_values = list(env_prop['variables'].values()) if 'variables' in env_prop else []
                 overridden_params = env_prop['params'] if 'params' in env_prop else dict()
@@ -621,14 +915,13 @@ class Configs:
 
                 variable_values = [val if isinstance(val, list) else [val] for val in variable_values]
 
-                for variable_values_combination in itertools.product(*variable_values):
-                    variables = OrderedDict()
-                    for name, val in zip(variable_names, variable_values_combination):
-                        variables[name] = val
-                    params = self.create_params(env_name, variables, overridden_params)
-
-                    variables_list.append(tuple([variables[name] for name in variable_names]))
-                    configs_list.append(params)
+                # params are created for every variable combination when they are accessed
+                variables_list = SweepGrid(variable_values)
+                sampling = env_prop.get('sampling')
+                if sampling:
+                    variables_list = variables_list.sample(
+                        sampling['num_samples'], sampling.get('method', "random"), sampling.get('seed', 0))
+                configs_list = ParamsList(self, env_name, variable_names, variables_list, overridden_params)
 
                 report = {}
 
@@ -657,7 +950,10 @@ class Configs:
                     variable_values=variable_values,
                     variables_list=variables_list,
                     configs_list=configs_list,
-                    report=report
+                    report=report,
+                    resources=env_prop.get('resources'),
+                    priority=env_prop.get('priority', 0),
+                    early_termination=env_prop.get('early_termination')
                 ))
         else:
             params = self.create_params("default")
@@ -4,9 +4,8 @@ import shutil
 from collections import namedtuple
 from typing import Tuple, List, Union
 
-import sklearn.metrics as metrics
-
 from dlex.configs import ModuleConfigs, Params
+from dlex.utils.metrics import Metric, get_metric, AVERAGES
 # from dlex.torch import BatchItem
 from dlex.utils.logging import logger
 from dlex.utils.utils import maybe_download, maybe_unzip, prompt
@@ -146,14 +145,19 @@ class DatasetBuilder:
         :param output_path:
         :return:
         """
+        import sklearn.metrics as metrics
+        # precision, recall and f1 may be given with their average (eg. f1_macro)
+        name, _, average = metric.rpartition("_")
+        if name not in ["precision", "recall", "f1"] or average not in AVERAGES:
+            name, average = metric, "binary"
         if metric == "acc":
             return float(metrics.accuracy_score(ref, pred)) * 100
-        elif metric == "precision":
-            return float(metrics.average_precision_score(ref, pred))
-        elif metric == "recall":
-            pass
-        elif metric == "f1":
-            return float(metrics.f1_score(ref, pred)) * 100
+        elif name == "precision":
+            return float(metrics.precision_score(ref, pred, average=average)) * 100
+        elif name == "recall":
+            return float(metrics.recall_score(ref, pred, average=average)) * 100
+        elif name == "f1":
+            return float(metrics.f1_score(ref, pred, average=average)) * 100
         elif metric == "err":
             ret = self.evaluate(pred, ref, "acc", output_path)
             return 100 - ret
@@ -162,6 +166,18 @@ class DatasetBuilder:
         else:
             raise ValueError(f"Metric {metric} is not defined")
 
+    def get_metric(self, metric: str) -> Metric:
+        """Get an accumulator to compute a metric batch by batch during evaluation
+
+        :param metric:
+        :return: an accumulator, or None if the metric can only be computed by `evaluate` from all predictions
+        """
+        name, _, average = metric.rpartition("_")
+        if metric in ["acc", "err", "precision", "recall", "f1", "mse"] or \
+                (name in ["precision", "recall", "f1"] and average in AVERAGES):
+            return get_metric(metric)
+        return None
+
     @staticmethod
     def is_better_result(metric: str, best_result: float, new_result: float) -> bool:
         """Compare new result with previous best result
@@ -174,9 +190,10 @@ class DatasetBuilder:
         :type new_result: float
         :return: True if the new result is better with this metric.
         """
-        if metric in ["wer", "loss", "err"]:  # the lower the better
+        if metric in ["wer", "loss", "err", "mse"]:  # the lower the better
             return new_result < best_result
-        elif metric in ["acc", "bleu", "f1"]:
+        elif metric in ["acc", "bleu", "chrf", "f1", "precision", "recall"] or \
+                metric.rpartition("_")[0] in ["f1", "precision", "recall"]:
             return new_result > best_result
         else:
             raise Exception("Result comparison is not defined: %s" % metric)
@@ -2,18 +2,26 @@ import abc
 import os
 
 from dlex.datasets.builder import DatasetBuilder
+from dlex.utils.metrics import BLEU, ChrF
 
 
 class NLPDatasetBuilder(DatasetBuilder):
     @abc.abstractmethod
     def evaluate(self, y_pred, y_ref, metric: str, output_path: str) -> float:
         if metric == "bleu":
-            import nltk
-            score = nltk.translate.bleu_score.corpus_bleu([[ref] for ref in y_ref], y_pred)
-            return score
+            bleu = BLEU()
+            bleu.update(y_pred, y_ref)
+            return bleu.compute()
         else:
             return super().evaluate(y_pred, y_ref, metric)
 
+    def get_metric(self, metric: str):
+        if metric == "bleu":
+            return BLEU()
+        if metric == "chrf":
+            return ChrF()
+        return super().get_metric(metric)
+
     def format_output(self, y_pred, batch_item) -> (str, str, str):
         return super().format_output(y_pred, batch_item)
 
@@ -13,6 +13,7 @@ from dlex.datasets.torch import Dataset
 from dlex.torch import Batch
 from dlex.torch import BatchItem
 from dlex.torch.utils.ops_utils import maybe_cuda
+from dlex.utils.metrics import BLEU
 
 
 class PytorchSeq2SeqDataset(Dataset):
@@ -110,19 +111,46 @@ class PytorchTranslationDataset(PytorchSeq2SeqDataset):
     def input_size(self):
         return len(self.src_vocab)
 
+    def get_metric(self, metric: str):
+        if metric == "bleu":
+            return BLEU()
+        return None
+
     def evaluate(self, y_pred, y_ref, metric: str, output_path: str):
         if metric == "bleu":
-            # use official evaluation script
-            # assert len(y_pred) == len(self.data)
-            ret = []
-            for pred, data in zip(y_pred, self.data):
-                ret.append(' '.join(self.vocab.decode_idx_list(pred)))
+            # computed on token ids, predictions are only decoded when results are written to file
+            bleu = BLEU()
+            bleu.update(y_pred, y_ref)
+            return bleu.compute()
 
-            f_name = output_path + '.json'
+    def write_results_to_file(
+            self,
+            all_predictions: List[List[int]],
+            sample_ids: List,
+            output_path: str,
+            output_tag: str,
+            format: str = None) -> str:
+        """Decode predictions and write them to file
+
+        :param all_predictions: predicted token ids
+        :param sample_ids:
+        :param output_path: path without extension
+        :param output_tag:
+        :param format: `text` (one sentence per line) or `json` (default)
+        :return: path of the results file
+        """
+        delimiter = ' ' if self.params.dataset.unit in [None, "word"] else ''
+        sentences = (
+            delimiter.join(self.vocab.decode_idx_list(pred, stop_at=self.vocab.eos_token_idx))
+            for pred in all_predictions)
+        if format == "text":
+            f_name = "%s_%s.txt" % (output_path, output_tag)
             with open(f_name, 'w') as f:
-                json.dump(ret, f, indent=2)
-                logger.debug("Results saved to %s" % f_name)
-
-            import nltk
-            score = nltk.translate.bleu_score.corpus_bleu([[ref] for ref in y_ref], y_pred)
-            return score
+                for sentence in sentences:
+                    f.write(sentence + '\n')
+        else:
+            f_name = "%s_%s.json" % (output_path, output_tag)
+            with open(f_name, 'w') as f:
+                json.dump(list(sentences), f, indent=2)
+        logger.debug("Results saved to %s" % f_name)
+        return f_name
@@ -0,0 +1,265 @@
+"""Datasets prepared and loaded once by the launcher, then shared by training processes"""
+import atexit
+import copy
+import dataclasses
+import hashlib
+import importlib
+import json
+import numbers
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from dlex.configs import ModuleConfigs, Params
+from dlex.utils.logging import logger
+
+
+def get_dataset_key(params: Params) -> str:
+    """Hash of the dataset configuration. Runs with the same key load the same data."""
+    content = json.dumps(params.dataset.to_dict(level=100), sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+class SharedRecords(Sequence):
+    """Read-only list of records whose fields are stored in memory-mapped files.
+
+    Pages of the files are shared by all processes reading them. Each process has its own order of the records, so
+    shuffling does not write to the shared data.
+
+    :param path: folder of the files created by `share_records`
+    :param index: order of the records. Default: order of the files
+    """
+
+    def __init__(self, path: str, index: np.ndarray = None):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.record_cls = _load_class(self.meta['record_cls'])
+        self.columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in self.meta['fields']}
+        self.offsets = {
+            name: np.load(os.path.join(path, f"{name}.offsets.npy"), mmap_mode='r')
+            for name, field in self.meta['fields'].items() if field['kind'] == "sequence"}
+        self._index = np.arange(self.meta['length']) if index is None else index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.view(self._index[i])
+        i = self._index[i]
+        values = {name: self._get_value(name, i) for name in self.meta['fields']}
+        if self.record_cls is dict:
+            return values
+        return self.record_cls(**values)
+
+    def _get_value(self, name: str, i: int):
+        field = self.meta['fields'][name]
+        if field['kind'] == "sequence":
+            val = self.columns[name][self.offsets[name][i]:self.offsets[name][i + 1]]
+        else:
+            val = self.columns[name][i]
+        if field['python']:
+            return val.tolist()
+        if field['kind'] == "scalar":
+            return val
+        # copied so that the record can be modified
+        return np.array(val)
+
+    def view(self, index: np.ndarray = None) -> 'SharedRecords':
+        """Records with another order, without copying the data"""
+        records = copy.copy(self)
+        records._index = self._index.copy() if index is None else index
+        return records
+
+    def shuffle(self):
+        np.random.shuffle(self._index)
+
+    def __getstate__(self):
+        return dict(path=self.path, index=self._index)
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['index'])
+
+
+def _get_class_name(cls) -> str:
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def _load_class(name: str):
+    if name == "builtins.dict":
+        return dict
+    module_name, class_name = name.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _is_number(val) -> bool:
+    return isinstance(val, (numbers.Number, np.number)) and not isinstance(val, complex)
+
+
+def _to_column(values: List[Any]):
+    """Convert the values of a field to an array
+
+    :return: (array, offsets, meta), or None if the values cannot be stored in an array
+    """
+    first = values[0]
+    if all(_is_number(val) for val in values):
+        return np.array(values), None, dict(kind="scalar", python=not isinstance(first, np.number))
+    if isinstance(first, np.ndarray) and first.dtype.kind in "biuf" and \
+            all(isinstance(val, np.ndarray) and val.shape == first.shape for val in values):
+        return np.stack(values), None, dict(kind="array", python=False)
+    is_list = isinstance(first, list)
+    if all(isinstance(val, list if is_list else np.ndarray) for val in values):
+        if not is_list and any(val.ndim != 1 or val.dtype.kind not in "biuf" for val in values):
+            return None
+        if is_list and not all(_is_number(v) for val in values for v in val):
+            return None
+        lengths = np.array([len(val) for val in values], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        flat = np.concatenate([np.asarray(val) for val in values]) if offsets[-1] else np.zeros(0)
+        return flat, offsets, dict(kind="sequence", python=is_list)
+    return None
+
+
+def share_records(records, path: str) -> SharedRecords:
+    """Store a list of records in memory-mapped files.
+
+    Records must be dictionaries (or dataclass instances) with the same fields. Each field must hold numbers,
+    numeric arrays of the same shape or lists of numbers.
+
+    :param records:
+    :param path: folder where the files are created
+    :return: the shared records, or None if the records cannot be stored
+    """
+    if not isinstance(records, list) or not records:
+        return None
+    record_cls = type(records[0])
+    if record_cls is dict:
+        names = list(records[0].keys())
+        if any(type(r) is not dict or list(r.keys()) != names for r in records):
+            return None
+        get_values = dict.__getitem__
+    elif dataclasses.is_dataclass(record_cls):
+        names = [f.name for f in dataclasses.fields(record_cls)]
+        if any(type(r) is not record_cls for r in records):
+            return None
+        get_values = getattr
+    else:
+        return None
+
+    columns = {}
+    for name in names:
+        column = _to_column([get_values(r, name) for r in records])
+        if column is None:
+            return None
+        columns[name] = column
+
+    os.makedirs(path, exist_ok=True)
+    fields = {}
+    for name, (values, offsets, meta) in columns.items():
+        np.save(os.path.join(path, f"{name}.npy"), values)
+        if offsets is not None:
+            np.save(os.path.join(path, f"{name}.offsets.npy"), offsets)
+        fields[name] = meta
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(dict(length=len(records), record_cls=_get_class_name(record_cls), fields=fields), f)
+    return SharedRecords(path)
+
+
+class SharedDatasets:
+    """Datasets prepared and loaded by the launcher, once for each distinct dataset configuration.
+
+    Records that can be stored in arrays are moved to memory-mapped files (see `share_records`). Other datasets are
+    kept in the launcher and inherited by the forked training processes.
+    """
+
+    def __init__(self):
+        self._builders: Dict[str, Any] = {}
+        self._datasets: Dict[tuple, Any] = {}
+        self._path = None
+
+    def load(
+            self,
+            params: Params,
+            splits: List[str],
+            prepare: bool = True,
+            download: bool = False,
+            preprocess: bool = False):
+        """Prepare the dataset of a run and load its splits
+
+        :param params:
+        :param splits: names of the splits to load
+        :param prepare: if False, the dataset is loaded without being prepared
+        :param download:
+        :param preprocess:
+        """
+        from dlex.utils.model_utils import get_dataset
+
+        key = get_dataset_key(params)
+        if key not in self._builders:
+            builder = get_dataset(params)
+            if builder is None:
+                return
+            if prepare:
+                builder.prepare(download=download, preprocess=preprocess)
+            self._builders[key] = builder
+
+        builder = self._builders[key]
+        for split in splits:
+            if (key, split) in self._datasets:
+                continue
+            dataset = builder.get_pytorch_wrapper(split)
+            records = share_records(dataset.data, os.path.join(self.path, key, split))
+            if records is not None:
+                dataset._data = records
+            self._datasets[key, split] = dataset
+            logger.info(
+                "Dataset %s (%s) loaded%s.", split, key[:8], " in shared memory" if records is not None else "")
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            os.makedirs(ModuleConfigs.get_tmp_path(), exist_ok=True)
+            self._path = tempfile.mkdtemp(prefix="shared_datasets_", dir=ModuleConfigs.get_tmp_path())
+            atexit.register(self.close)
+        return self._path
+
+    def is_loaded(self, params: Params) -> bool:
+        return get_dataset_key(params) in self._builders
+
+    def get_builder(self, params: Params):
+        """:return: a copy of the prepared dataset builder of a run, or None if it is not loaded"""
+        builder = self._builders.get(get_dataset_key(params))
+        if builder is None:
+            return None
+        builder = copy.copy(builder)
+        builder.params = params
+        return builder
+
+    def get_datasets(self, builder) -> Dict[str, Any]:
+        """:return: copies of the loaded splits of a builder returned by `get_builder`, by split name"""
+        key = get_dataset_key(builder.params)
+        datasets = {}
+        for (dataset_key, split), dataset in self._datasets.items():
+            if dataset_key != key:
+                continue
+            dataset = copy.copy(dataset)
+            dataset.params = builder.params
+            dataset._builder = builder
+            if isinstance(dataset._data, SharedRecords):
+                dataset._data = dataset._data.view()
+            datasets[split] = dataset
+        return datasets
+
+    def close(self):
+        """Remove the memory-mapped files"""
+        if self._path is not None:
+            shutil.rmtree(self._path, ignore_errors=True)
+            self._path = None
+
+
+shared_datasets = SharedDatasets()
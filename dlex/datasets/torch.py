@@ -7,6 +7,10 @@ from torch.utils.data import Dataset as PytorchDataset
 from torch.utils.data.dataloader import default_collate, DataLoader
 
 
+def _defining_class(obj, name: str) -> type:
+    return next(cls for cls in type(obj).__mro__ if name in cls.__dict__)
+
+
 class Dataset(PytorchDataset):
     """Load data from pre-processed files and prepare batch for training
 
@@ -52,7 +56,10 @@ class Dataset(PytorchDataset):
         return self._data
 
     def shuffle(self):
-        random.shuffle(self.data)
+        if hasattr(self.data, "shuffle"):  # eg. records shared by training processes
+            self.data.shuffle()
+        else:
+            random.shuffle(self.data)
 
     @property
     def processed_data_dir(self) -> str:
@@ -70,6 +77,19 @@ class Dataset(PytorchDataset):
     def evaluate(self, y_pred, y_ref, metric: str, output_path: str):
         return self.builder.evaluate(y_pred, y_ref, metric, output_path)
 
+    def get_metric(self, metric: str):
+        """Get an accumulator to compute a metric batch by batch during evaluation
+
+        :param metric:
+        :return: an accumulator, or None if the metric must be computed by `evaluate` from all predictions
+        """
+        # datasets and builders which override `evaluate` but not `get_metric` keep their own implementation
+        for obj in [self, self.builder]:
+            evaluate_cls, get_metric_cls = _defining_class(obj, "evaluate"), _defining_class(obj, "get_metric")
+            if evaluate_cls is not get_metric_cls and issubclass(evaluate_cls, get_metric_cls):
+                return None
+        return self.builder.get_metric(metric)
+
     def format_output(self, y_pred, batch_input) -> (str, str, str):
         return self.builder.format_output(y_pred, batch_input)
 
@@ -3,14 +3,15 @@
 import os
 from typing import List, Dict, Callable
 
-import nltk
 import numpy as np
 from tqdm import tqdm
 
 from dlex.configs import Params
 from dlex.datasets.builder import DatasetBuilder
 from dlex.datasets.nlp.utils import Vocab
+from dlex.utils.edit_distance import corpus_edit_distance, SUBSTITUTIONS, INSERTIONS, DELETIONS, REF_LENGTH
 from dlex.utils.logging import logger, beautify
+from dlex.utils.metrics import WordErrorRate
 from .utils import read_htk, wav2htk, audio2wav
 
 
@@ -198,8 +199,13 @@ class VoiceDataset(DatasetBuilder):
 
     def evaluate(self, pred, ref, metric: str, output_path):
         if metric == "wer":
-            score, length = 0, 0
-            for p, r in zip(pred, ref):
-                score += nltk.edit_distance(p, r)
-                length += len(r)
-            return score / length
+            counts = corpus_edit_distance(pred, ref).sum(0)
+            logger.debug(
+                "WER: %d substitutions, %d insertions, %d deletions, %d reference words",
+                *counts[[SUBSTITUTIONS, INSERTIONS, DELETIONS, REF_LENGTH]])
+            return float(counts[[SUBSTITUTIONS, INSERTIONS, DELETIONS]].sum() / counts[REF_LENGTH])
+
+    def get_metric(self, metric: str):
+        if metric == "wer":
+            return WordErrorRate()
+        return None
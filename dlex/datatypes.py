@@ -1,3 +1,4 @@
+import copy
 import os
 import pickle
 import time
@@ -5,7 +6,6 @@ from collections import defaultdict
 from datetime import datetime
 from typing import Dict, List, Union
 
-import numpy as np
 from dlex.utils import logger, table2str
 
 
@@ -79,16 +79,47 @@ class ModelReport:
     param_details: str = None
     summary_writer = None
     training_progress: TrainingProgress = None
+    timing: Dict[str, float] = None
+    terminated_epoch: int = None
+    cached: bool = False  # results are loaded from the run registry
+
+    # fields sent to the launcher and written to the event log when they change
+    update_fields = [
+        "results", "epoch_results", "current_test_results", "valid_results", "test_results", "epoch_losses",
+        "status", "num_params", "num_trainable_params", "param_details", "timing", "current_epoch",
+        "terminated_epoch"]
 
     def __init__(self, training_idx):
         self.training_idx = training_idx
+        self._current_epoch = 0
+        self._last_update = None
 
     def add_epoch_results(self, results):
         self.current_test_results = results
 
     @property
     def current_epoch(self) -> int:
-        return self.training_progress.current_epoch
+        if self.training_progress is not None:
+            return self.training_progress.current_epoch
+        return self._current_epoch
+
+    def get_update(self) -> dict:
+        """Fields changed since the previous update. The first update also contains the params."""
+        state = {name: copy.deepcopy(getattr(self, name)) for name in self.update_fields}
+        update = {
+            name: val for name, val in state.items()
+            if self._last_update is None or pickle.dumps(val) != pickle.dumps(self._last_update[name])}
+        if self._last_update is None:
+            update['params'] = self.params
+        self._last_update = state
+        return update
+
+    def apply_update(self, update: dict):
+        for name, val in update.items():
+            if name == "current_epoch":
+                self._current_epoch = val
+            else:
+                setattr(self, name, val)
 
     def get_current_test_results(self):
         key = max(self.test_results.keys())
@@ -103,7 +134,13 @@ class ModelReport:
         return self.params.train.num_epochs
 
     def finish(self):
-        self.status = "finished"
+        if self.status != "terminated":
+            self.status = "finished"
+
+    def terminate(self, epoch: int):
+        """Mark the run as stopped by early termination at an epoch"""
+        self.status = "terminated"
+        self.terminated_epoch = epoch
 
     @property
     def metrics(self) -> List[str]:
@@ -124,8 +161,12 @@ class ModelReport:
             return "-"
 
         dataset = self.test_sets[0]
-        res = [r[dataset][metric] for r in self.results]
-        if type(res) == float:
+        if isinstance(self.results, dict):
+            res = self.results.get(dataset, {}).get(metric)
+        else:
+            res = [r[dataset][metric] for r in self.results]
+        import numpy as np
+        if isinstance(res, (float, int)):
             return "%.2f" % res
         elif type(res) == list and len(res) > 0:  # cross validation
             if full:
@@ -139,6 +180,8 @@ class ModelReport:
     def get_status_text(self):
         if self.status == "finished":
             status = "done"
+        elif self.status == "terminated":
+            status = f"terminated ({self.terminated_epoch}/{self.num_epochs})"
         elif self.params.train.cross_validation is not None:
             dataset = self.test_sets[0]
             current_fold = len(self.results)
@@ -149,6 +192,8 @@ class ModelReport:
         else:
             pbar = get_progress_bar(10, (self.current_epoch - 1) / self.num_epochs)
             status = f"{pbar} {self.current_epoch - 1}/{self.num_epochs}"
+        if self.cached:
+            status += " (cached)"
         return status
 
     def set_model_summary(
@@ -156,6 +201,7 @@ class ModelReport:
             variable_names: List[str],
             variable_shapes: List[List[int]],
             variable_trainable: List[bool]):
+        import numpy as np
         parameter_details = [["Name", "Shape", "Trainable"]]
         num_params = 0
         num_trainable_params = 0
@@ -178,19 +224,48 @@ class ModelReport:
         self.num_params = num_params
         self.num_trainable_params = num_trainable_params
 
-    def save(self):
-        path = os.path.join(self.params.log_dir, f"report_{self.training_idx}.pkl")
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_last_update', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._last_update = None
+
+    @staticmethod
+    def get_event_log_path(log_dir, training_idx) -> str:
+        return os.path.join(log_dir, f"report_{training_idx}.events")
+
+    def save(self) -> dict:
+        """Append the fields changed since the last save to the event log of the report
+
+        :return: the update
+        """
+        update = self.get_update()
+        path = self.get_event_log_path(self.params.log_dir, self.training_idx)
+        with open(path, "ab") as f:
+            pickle.dump(update, f)
         logger.debug(f"Report saved to {path}")
-        with open(path, "wb") as f:
-            pickle.dump(self, f)
+        return update
 
     @classmethod
     def load(cls, log_dir, training_idx):
-        path = os.path.join(log_dir, f"report_{training_idx}.pkl")
+        """Replay the event log of a report"""
+        path = cls.get_event_log_path(log_dir, training_idx)
         if not os.path.exists(path):
             return None
+        report = cls(training_idx)
         with open(path, "rb") as f:
-            return pickle.load(f)
+            while True:
+                try:
+                    update = pickle.load(f)
+                except EOFError:
+                    break
+                except pickle.UnpicklingError:  # incomplete record being written
+                    break
+                report.apply_update(update)
+        return report
 
     @property
     def valid_set(self) -> str:
@@ -12,8 +12,7 @@ from dlex.utils import logger, table2str, logging
 from .configs import Configs, Environment
 
 
-manager = multiprocessing.Manager()
-report_queue = manager.Queue()
+report_queue = None
 
 
 def launch_evaluating(backend: str, params, configs, report=None):
@@ -114,9 +113,11 @@ def write_report(reports: Dict[str, Dict[Tuple, ModelReport]], configs):
 
 
 def main():
+    global report_queue
     configs = Configs(mode="test")
     args = configs.args
     manager = multiprocessing.Manager()
+    report_queue = manager.Queue()
     all_reports = manager.dict()
 
     envs = [e for e in configs.environments if e.name in configs.env_names]
@@ -126,6 +127,16 @@ def main():
         for variable_values, params in zip(env.variables_list, env.configs_list):
             all_reports[env.name][variable_values] = None
 
+    if args.worker_pool is not None:
+        from dlex.worker import WorkerClient, FAILED
+        client = WorkerClient(args.worker_pool)
+        jobs = ((env.name, "test", params, 0) for env in envs for params in env.configs_list)
+        for status, env_name, result in client.run(jobs):
+            if status == FAILED:
+                logger.error("Evaluation of %s failed: %s", env_name, result)
+        client.close()
+        return
+
     gpu = args.gpu or get_unused_gpus(args)
     for env in envs:
         for variable_values, params in zip(env.variables_list, env.configs_list):
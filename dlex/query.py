@@ -0,0 +1,55 @@
+"""Find the best runs recorded in the experiment store
+
+    python -m dlex.query valid.bleu -n 10 --where model.attention.type=bahdanau
+"""
+import argparse
+import os
+from datetime import datetime
+
+from dlex.configs import ModuleConfigs
+from dlex.utils.experiment_store import ExperimentStore
+from dlex.utils.utils import table2str
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the best runs recorded in the experiment store")
+    parser.add_argument(
+        "metric", metavar="SPLIT.METRIC",
+        help="metric used to rank the runs, eg. valid.bleu, test.acc or train.loss")
+    parser.add_argument("-n", "--top", type=int, default=10, dest="top", help="number of runs")
+    parser.add_argument(
+        "-w", "--where", nargs='+', default=[], metavar="KEY=VALUE", dest="where",
+        help="values of params, eg. model.attention.type=bahdanau")
+    parser.add_argument("--lowest", action="store_true", help="rank by the lowest value (eg. for a loss)")
+    parser.add_argument("--since", default=None, metavar="YYYY-MM-DD", help="only runs started since this date")
+    parser.add_argument("-c", "--config", default=None, dest="config", help="only runs of a configuration file")
+    parser.add_argument("--show", nargs='+', default=[], metavar="KEY", help="params displayed for each run")
+    parser.add_argument(
+        "--db", default=None,
+        help="path of the experiment store. Default: $DLEX_EXPERIMENT_STORE or experiments.db in the log folder")
+    args = parser.parse_args(argv)
+
+    if '.' not in args.metric:
+        parser.error("metric must be given as SPLIT.METRIC")
+    split, metric = args.metric.split('.', 1)
+    where = dict(s.split('=', 1) for s in args.where)
+    config_name = os.path.splitext(os.path.basename(args.config))[0] if args.config else None
+    since = datetime.strptime(args.since, "%Y-%m-%d").timestamp() if args.since else None
+
+    store = ExperimentStore(args.db or ModuleConfigs.get_experiment_store_path())
+    runs = store.query(
+        split, metric, where=where, lowest=args.lowest, limit=args.top, since=since, config_name=config_name)
+
+    data = [[args.metric, "epoch", "config", "env", "idx", "variables", *args.show, "status", "started at", "log dir"]]
+    for run in runs:
+        run_params = store.get_params(run['run_id']) if args.show else {}
+        data.append([
+            "%.4f" % run['value'], run['epoch'], os.path.basename(run['config_path'] or ""), run['env_name'],
+            run['training_idx'], run['variables'], *[run_params.get(name, "") for name in args.show], run['status'],
+            datetime.fromtimestamp(run['started_at']).strftime('%Y-%m-%d %H:%M'), run['log_dir']])
+    store.close()
+    print(table2str(data) if runs else "No runs found.")
+
+
+if __name__ == "__main__":
+    main()
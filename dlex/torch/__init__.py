@@ -1,3 +1,10 @@
 from .datatypes import Batch, BatchItem
 from .models import BaseModel
-from .backend import PytorchBackend
\ No newline at end of file
+
+
+def __getattr__(name):
+    # the backend (and the training loop dependencies) is only imported when training or evaluating
+    if name == "PytorchBackend":
+        from .backend import PytorchBackend
+        return PytorchBackend
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
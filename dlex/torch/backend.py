@@ -1,7 +1,9 @@
 """Train a model."""
+import gc
 import os
 import random
 import sys
+import time
 import traceback
 from collections import namedtuple, defaultdict
 from datetime import datetime
@@ -10,15 +12,20 @@ from typing import Callable, Dict
 import torch
 from dlex import FrameworkBackend, TrainingProgress
 from dlex.configs import Configs, Params
+from dlex.datasets.shared import shared_datasets
 from dlex.datasets.torch import Dataset
 from dlex.datatypes import ModelReport
+from dlex.torch import Batch
+from dlex.torch.evaluator import AsyncEvaluator
 from dlex.torch.models.base import BaseModel, ModelWrapper
-from dlex.torch.utils.model_utils import get_model
-from dlex.utils import check_interval_passed, Datasets
+from dlex.torch.utils.batch_size import find_batch_size
+from dlex.torch.utils.instrumentation import StepTimer, get_num_tokens, get_profiler
+from dlex.torch.utils.model_utils import get_model, is_out_of_memory
+from dlex.torch.utils.summary import AsyncSummaryWriter
+from dlex.utils import Datasets
 from dlex.utils.logging import logger, epoch_info_logger, log_result, json_dumps, \
     log_outputs
 from dlex.utils.model_utils import get_dataset
-from torch.utils.tensorboard import SummaryWriter
 from tqdm import tqdm
 
 DEBUG_NUM_ITERATIONS = 5
@@ -29,8 +36,59 @@ EvaluationResults = namedtuple("EvaluationResults", "results outputs")
 
 
 class PytorchBackend(FrameworkBackend):
-    def __init__(self, params: Params, training_idx: int = 0, report_queue=None):
-        super().__init__(params, training_idx, report_queue)
+    def __init__(self, params: Params, training_idx: int = 0, report_queue=None, early_termination=None):
+        super().__init__(params, training_idx, report_queue, early_termination)
+        self._training_profiled = False
+        self._evaluation_profiled = False
+        self._num_micro_batches = 1
+        self._num_steps_without_oom = 0
+
+    def get_profiler(self, mode: str, name: str, epoch: int = None):
+        """
+        Profiler for a training epoch or an evaluation, configured by `train.profile`. Only the first training epoch
+        (or `train.profile.epoch`) and the first evaluation (if `train.profile.evaluation` is not False) are profiled.
+        :param mode: train or eval
+        :param name:
+        :param epoch: current epoch
+        """
+        cfg = self.params.train.profile
+        if cfg and mode == "train" and not self._training_profiled and cfg.get('epoch', epoch) == epoch:
+            self._training_profiled = True
+        elif cfg and mode == "eval" and cfg.get('evaluation', True) and not self._evaluation_profiled:
+            self._evaluation_profiled = True
+        else:
+            cfg = None
+        return get_profiler(cfg, os.path.join(self.params.log_dir, "profile"), f"{mode}_{self.training_idx}_{name}")
+
+    def training_step(self, model: ModelWrapper, batch) -> float:
+        """
+        Run a training step. If the device runs out of memory and `train.oom_recovery` is set, the step is retried
+        with the batch split into twice as many micro-batches, until the batch cannot be split further. The number of
+        micro-batches is kept for the following steps and reduced again after `train.oom_recovery_steps` steps.
+        """
+        cfg = self.params.train
+        if self._num_micro_batches > 1 and self._num_steps_without_oom >= cfg.oom_recovery_steps:
+            self._num_micro_batches //= 2
+            self._num_steps_without_oom = 0
+        while True:
+            try:
+                loss = model.training_step(batch, self._num_micro_batches)
+                self._num_steps_without_oom += 1
+                return loss
+            except RuntimeError as e:
+                if not cfg.oom_recovery or not is_out_of_memory(e) or not isinstance(batch, Batch) or \
+                        self._num_micro_batches * 2 > len(batch):
+                    raise
+            # memory held by the failed step is released once the exception is cleared
+            for optimizer in model.optimizers:
+                optimizer.zero_grad(set_to_none=not cfg.optimizer.get('flatten'))
+            gc.collect()
+            torch.cuda.empty_cache()
+            self._num_micro_batches *= 2
+            self._num_steps_without_oom = 0
+            logger.warning(
+                "Out of memory with %d samples per step. Retrying with %d micro-batches.",
+                len(batch), self._num_micro_batches)
 
     def run_cross_validation_training(self) -> ModelReport:
         report = self.report
@@ -40,10 +98,11 @@ class PytorchBackend(FrameworkBackend):
             # Reset random seed so the same order is returned after shuffling dataset
             self.set_seed()
 
-            summary_writer = SummaryWriter(
-                os.path.join(self.configs.log_dir, "runs", str(self.training_idx), str(i + 1)))
-            self.params.dataset.cv_current_fold = i + 1
-            self.params.dataset.cv_num_folds = train_cfg.cross_validation
+            summary_writer = AsyncSummaryWriter(
+                os.path.join(self.configs.log_dir, "runs", str(self.training_idx), str(i + 1)),
+                scalar_interval=train_cfg.summary_interval)
+            self.params.dataset = self.params.dataset.replace(
+                cv_current_fold=i + 1, cv_num_folds=train_cfg.cross_validation)
             self.update_report()
 
             model, datasets = self.load_model("train")
@@ -54,12 +113,14 @@ class PytorchBackend(FrameworkBackend):
                 tqdm_position=self.training_idx)
             report.results.append(results)
             self.update_report()
+            model.checkpoint_writer.close()
             summary_writer.close()
 
         logger.info(f"Training finished.")
         for metric in report.metrics:
-            logger.info(f"Results ({metric}): {report.get_result_text()}")
+            logger.info(f"Results ({metric}): {report.get_result_text(metric)}")
         report.finish()
+        self.update_report()
         return report
 
     def run_train(self) -> ModelReport:
@@ -70,14 +131,18 @@ class PytorchBackend(FrameworkBackend):
         if self.params.train.cross_validation:
             return self.run_cross_validation_training()
         else:
-            summary_writer = SummaryWriter(os.path.join(self.params.log_dir, "runs", str(self.training_idx)))
+            summary_writer = AsyncSummaryWriter(
+                os.path.join(self.params.log_dir, "runs", str(self.training_idx)),
+                scalar_interval=self.params.train.summary_interval)
             model, datasets = self.load_model("train")
             res = self.train(
                 model, datasets, summary_writer,
                 tqdm_position=self.training_idx,
                 on_epoch_finished=self.update_report)
+            model.checkpoint_writer.close()
             report.results = res
             report.finish()
+            self.update_report()
             summary_writer.close()
 
             return report
@@ -117,17 +182,20 @@ class PytorchBackend(FrameworkBackend):
                 params.train.batch_size = DEBUG_BATCH_SIZE
                 params.test.batch_size = DEBUG_BATCH_SIZE
 
-        # Init dataset
-        dataset_builder = get_dataset(params)
-        assert dataset_builder, "Dataset not found."
-        if not args.no_prepare:
-            dataset_builder.prepare(download=args.download, preprocess=args.preprocess)
+        # Init dataset (prepared and loaded by the launcher if it is shared by several runs)
+        dataset_builder = shared_datasets.get_builder(params)
+        if dataset_builder is None:
+            dataset_builder = get_dataset(params)
+            assert dataset_builder, "Dataset not found."
+            if not args.no_prepare:
+                dataset_builder.prepare(download=args.download, preprocess=args.preprocess)
 
         datasets = Datasets(
             "pytorch", dataset_builder,
             train_set=params.train.train_set,
             valid_set=params.train.valid_set,
-            test_sets=params.test.test_sets)
+            test_sets=params.test.test_sets,
+            loaded=shared_datasets.get_datasets(dataset_builder))
 
         # Init model
         model_cls = get_model(params)
@@ -155,10 +223,14 @@ class PytorchBackend(FrameworkBackend):
 
         # Load checkpoint or initialize new training
         if args.load:
-            self.configs.training_id = model.load_checkpoint(args.load)
+            self.configs.training_id = model.load_checkpoint(args.load, load_optimizers=mode == "train")
             logger.info("Loaded checkpoint: %s", args.load)
             if mode == "train":
                 logger.info("EPOCH: %f", model.global_step / len(datasets.train_set))
+        elif mode == "train" and params.resume_tag:
+            model.load_checkpoint(params.resume_tag, load_optimizers=True)
+            logger.info("Resumed from checkpoint: %s", params.resume_tag)
+            logger.info("EPOCH: %f", model.global_step / len(datasets.train_set))
 
         return model, datasets
 
@@ -166,16 +238,21 @@ class PytorchBackend(FrameworkBackend):
             self,
             select_model: str,
             model,
-            datasets) -> bool:
+            datasets,
+            num_losses: int = None,
+            state: dict = None) -> bool:
         """
 
         :param select_model:
+        :param num_losses: number of epoch losses recorded when the model was evaluated. Default: all
+        :param state: evaluated training state, saved as the best checkpoint. Default: current state
         :return: whether the results are updated
         """
         report = self.report
         valid_results = report.get_current_valid_results()
         test_results = report.get_current_test_results()
-        loss = report.epoch_losses[-1]
+        epoch_losses = report.epoch_losses[:num_losses]
+        loss = epoch_losses[-1]
         updated = False
         if select_model == "last":
             report.current_test_results = test_results
@@ -183,14 +260,14 @@ class PytorchBackend(FrameworkBackend):
         elif select_model == "best":
             if not datasets.valid_set:
                 # there's no valid set, report test result with lowest loss
-                if loss <= min(report.epoch_losses):
+                if loss <= min(epoch_losses):
                     dataset = report.test_sets[0]
                     report.current_test_results = test_results
                     logger.info("Result updated (lowest loss reached: %.4f) - %s" % (
                         loss,
                         ", ".join(["%s: %.2f" % (metric, res) for metric, res in report.current_test_results[dataset].items()])
                     ))
-                    model.save_checkpoint("best")
+                    model.save_checkpoint("best", state)
                     updated = True
             else:
                 for metric in report.metrics:
@@ -216,11 +293,143 @@ class PytorchBackend(FrameworkBackend):
                             # log_outputs("valid", params, valid_outputs)
         return updated
 
+    def evaluate_all(self, model, datasets: Datasets, tqdm_desc="", tqdm_position=None):
+        """Evaluate on all test sets and the valid set
+
+        :return: tuple containing:
+            test_rets: evaluation results of each test set
+            valid_ret: evaluation results of the valid set, or None if there's no valid set
+        """
+        def _evaluate(dataset):
+            return self.evaluate(
+                model, dataset,
+                output_path=os.path.join(self.params.log_dir, "results"),
+                output_tag="latest",
+                tqdm_desc=tqdm_desc,
+                tqdm_position=tqdm_position)
+
+        test_rets = {name: _evaluate(dataset) for name, dataset in datasets.test_sets.items()}
+        valid_ret = _evaluate(datasets.valid_set) if datasets.valid_set else None
+        return test_rets, valid_ret
+
+    def record_evaluation(
+            self,
+            model,
+            datasets: Datasets,
+            summary_writer: AsyncSummaryWriter,
+            current_epoch: int,
+            log_dict: dict,
+            test_rets: Dict[str, EvaluationResults],
+            valid_ret: EvaluationResults,
+            num_losses: int = None,
+            state: dict = None) -> bool:
+        """Log and record results of an evaluation, which may have run in the background
+
+        :param current_epoch: epoch at which the model was evaluated
+        :param num_losses: number of epoch losses recorded when the model was evaluated. Default: all
+        :param state: evaluated training state. Default: current state
+        :return: whether training should stop early
+        """
+        report = self.report
+        args = self.configs.args
+        params = self.params
+
+        # Test sets
+        test_results = {}
+        test_outputs = None
+        for name, ret in test_rets.items():
+            log_result(name, params, ret.results, datasets.builder.is_better_result)
+            test_results[name] = ret.results['result']
+            test_outputs = ret.outputs
+            log_outputs("test", params, test_outputs)
+            log_dict['test_result'] = ret.results['result']
+            for metric in ret.results['result']:
+                summary_writer.add_scalar(f"{name}_{metric}", ret.results['result'][metric], current_epoch)
+        report.test_results[current_epoch] = test_results
+
+        # Valid set
+        valid_result = None
+        valid_outputs = None
+        if valid_ret is not None:
+            log_result("valid", params, valid_ret.results, datasets.builder.is_better_result)
+            valid_outputs = valid_ret.outputs
+            log_outputs("valid", params, valid_outputs)
+            log_dict['valid_result'] = valid_ret.results['result']
+            for metric in valid_ret.results['result']:
+                summary_writer.add_scalar(
+                    f"valid_{metric}",
+                    valid_ret.results['result'][metric], current_epoch)
+            valid_result = valid_ret.results['result']
+        report.valid_results[current_epoch] = valid_result
+
+        # results for reporting
+        if self.record_results(params.train.select_model, model, datasets, num_losses, state):
+            self.update_report()
+
+        # no outputs are kept if `test.output_samples` is 0
+        outputs = (test_outputs if datasets.test_sets else valid_outputs) or []
+        if args.output_test_samples and outputs:
+            logger.info("Random samples")
+            for output in random.sample(outputs, min(5, len(outputs))):
+                logger.info(str(output))
+
+        epoch_info_logger.info(json_dumps(log_dict))
+        log_msgs = [
+            "time: %s" % log_dict['total_time'].split('.')[0],
+            "loss: %.4f" % log_dict['loss']
+        ]
+
+        for metric in report.metrics:
+            if datasets.valid_set:
+                log_msgs.append(f"dev ({metric}): %.2f" % (
+                    log_dict['valid_result'][metric],
+                    # valid_best_result[metric]['result'][metric]
+                ))
+            if datasets.test_sets:
+                log_msgs.append(f"test ({metric}): %.2f" % (
+                    log_dict['test_result'][metric],
+                    # test_best_result[metric]['result'][metric],
+                ))
+        logger.info(f"session {report.training_idx} - epoch {current_epoch}: " + " - ".join(log_msgs))
+
+        # Successive halving, on valid results (or results of the first test set)
+        if self.early_termination is not None:
+            result = valid_result if valid_result is not None else next(iter(test_results.values()), None)
+            metric = self.early_termination.metric or report.metrics[0]
+            if result is not None and self.early_termination.should_stop(
+                    self.training_idx, current_epoch, metric, result[metric], datasets.builder.is_better_result):
+                logger.info("Terminated at epoch %s (successive halving)", current_epoch)
+                report.terminate(current_epoch)
+                return True
+
+        # Early stopping
+        if params.train.early_stop:
+            ne = params.train.early_stop.num_epochs
+            min_diff = params.train.early_stop.min_diff or 0.
+            if datasets.valid_set is not None:
+                last_results = report.epoch_valid_results
+                if len(last_results) > ne:
+                    if all(
+                            max([r[metric] for r in last_results[-ne:]]) <=
+                            max([r[metric] for r in last_results[:-ne]])
+                            for metric in report.metrics):
+                        logger.info("Early stop at epoch %s", current_epoch)
+                        return True
+            else:
+                losses = report.epoch_losses[:num_losses]
+                if len(losses) > ne:
+                    diff = min(losses[:-ne]) - min(losses[-ne:])
+                    logger.debug("Last %d epochs decrease: %.4f", ne, diff)
+                    if diff <= min_diff:
+                        logger.info("Early stop at epoch %s", current_epoch)
+                        return True
+        return False
+
     def train(
             self,
             model,
             datasets: Datasets,
-            summary_writer: SummaryWriter,
+            summary_writer: AsyncSummaryWriter,
             tqdm_desc="",
             tqdm_position=None,
             on_epoch_finished: Callable[[], None] = None) -> Dict[str, Dict[str, float]]:
@@ -238,6 +447,11 @@ class PytorchBackend(FrameworkBackend):
         train_cfg = self.params.train
         params = self.params
 
+        if train_cfg.batch_size == "auto":
+            num_gpus = len(params.gpu) if params.gpu else 1
+            train_cfg.batch_size = max(
+                find_batch_size(model, datasets.train_set, **(train_cfg.batch_size_search or {})) // num_gpus, 1)
+
         epoch = model.global_step // len(datasets.train_set)
         num_samples = model.global_step % len(datasets.train_set)
 
@@ -249,6 +463,16 @@ class PytorchBackend(FrameworkBackend):
         report.current_test_results = {name: {} for name in datasets.test_sets.keys()}
         report.training_progress = training_progress
 
+        model.timer = StepTimer(
+            log_path=os.path.join(params.log_dir, f"timing_{self.training_idx}.jsonl"),
+            summary_writer=summary_writer,
+            report=report,
+            aggregate_every=train_cfg.timing_every,
+            enabled=bool(train_cfg.timing_every))
+
+        evaluator = AsyncEvaluator(lambda eval_model: self.evaluate_all(
+            eval_model, datasets, tqdm_desc=tqdm_desc + "Evaluation")) if train_cfg.async_evaluation else None
+
         # num_samples = 0
         for current_epoch in range(epoch + 1, train_cfg.num_epochs + 1):
             training_progress.new_epoch(current_epoch)
@@ -256,99 +480,47 @@ class PytorchBackend(FrameworkBackend):
             log_dict['total_time'], loss = self.train_epoch(
                 current_epoch, model, datasets, report, num_samples,
                 training_progress=training_progress,
+                summary_writer=summary_writer,
                 tqdm_desc=tqdm_desc + f"Epoch {current_epoch}",
                 tqdm_position=tqdm_position)
             report.epoch_losses.append(loss)
             summary_writer.add_scalar(f"loss", loss, current_epoch)
+            if model.checkpoint_writer.last_write_time is not None:
+                summary_writer.add_scalar(
+                    "checkpoint_write_time", model.checkpoint_writer.last_write_time, current_epoch)
             log_dict['loss'] = loss
             num_samples = 0
 
-            def _evaluate(name, dataset):
-                # Evaluate model
-                ret = self.evaluate(
-                    model, dataset,
-                    output_path=os.path.join(params.log_dir, "results"),
-                    output_tag="latest",
-                    tqdm_desc=tqdm_desc + f"Epoch {current_epoch}",
-                    tqdm_position=None if tqdm_position is None else tqdm_position)
-                best_result = log_result(name, params, ret.results, datasets.builder.is_better_result)
-                return ret.results, best_result, ret.outputs
-
+            stop = False
             if training_progress.should_eval() or current_epoch == train_cfg.num_epochs:
-                # Evaluate test sets
-                test_results = {}
-                for name, dataset in datasets.test_sets.items():
-                    test_result, test_best_result, test_outputs = _evaluate(name, dataset)
-                    test_results[name] = test_result['result']
-                    log_outputs("test", params, test_outputs)
-                    log_dict['test_result'] = test_result['result']
-                    for metric in test_result['result']:
-                        summary_writer.add_scalar(f"{name}_{metric}", test_result['result'][metric], current_epoch)
-                report.test_results[current_epoch] = test_results
-
-                # Evaluate valid set
-                valid_result = None
-                if datasets.valid_set:
-                    valid_result, valid_best_result, valid_outputs = _evaluate("valid", datasets.valid_set)
-                    log_outputs("valid", params, valid_outputs)
-                    log_dict['valid_result'] = valid_result['result']
-                    for metric in valid_result['result']:
-                        summary_writer.add_scalar(
-                            f"valid_{metric}",
-                            valid_result['result'][metric], current_epoch)
-                    valid_result = valid_result['result']
-                report.valid_results[current_epoch] = valid_result
-
-                # results for reporting
-                if self.record_results(train_cfg.select_model, model, datasets):
-                    report.save()
-
-                if args.output_test_samples:
-                    logger.info("Random samples")
-                    for output in random.choices(test_outputs if datasets.test_sets else valid_outputs, k=5):
-                        logger.info(str(output))
-
-                epoch_info_logger.info(json_dumps(log_dict))
-                log_msgs = [
-                    "time: %s" % log_dict['total_time'].split('.')[0],
-                    "loss: %.4f" % log_dict['loss']
-                ]
+                if evaluator is not None:
+                    evaluator.submit(model, (current_epoch, log_dict, len(report.epoch_losses)))
+                else:
+                    eval_start_time = time.perf_counter()
+                    test_rets, valid_ret = self.evaluate_all(
+                        model, datasets,
+                        tqdm_desc=tqdm_desc + f"Epoch {current_epoch}",
+                        tqdm_position=tqdm_position)
+                    model.timer.add("evaluation", time.perf_counter() - eval_start_time)
+                    stop = self.record_evaluation(
+                        model, datasets, summary_writer, current_epoch, log_dict, test_rets, valid_ret)
+            if evaluator is not None:
+                for (epoch_evaluated, epoch_log_dict, num_losses), state, (test_rets, valid_ret) in evaluator.poll():
+                    stop = self.record_evaluation(
+                        model, datasets, summary_writer, epoch_evaluated, epoch_log_dict, test_rets, valid_ret,
+                        num_losses, state) or stop
+            if stop:
+                break
 
-                for metric in report.metrics:
-                    if datasets.valid_set:
-                        log_msgs.append(f"dev ({metric}): %.2f" % (
-                            log_dict['valid_result'][metric],
-                            # valid_best_result[metric]['result'][metric]
-                        ))
-                    if datasets.test_sets:
-                        log_msgs.append(f"test ({metric}): %.2f" % (
-                            log_dict['test_result'][metric],
-                            # test_best_result[metric]['result'][metric],
-                        ))
-                logger.info(f"session {report.training_idx} - epoch {current_epoch}: " + " - ".join(log_msgs))
-
-                # Early stopping
-                if params.train.early_stop:
-                    ne = params.train.early_stop.num_epochs
-                    min_diff = params.train.early_stop.min_diff or 0.
-                    if datasets.valid_set is not None:
-                        last_results = report.epoch_valid_results
-                        if len(last_results) > ne:
-                            if all(
-                                    max([r[metric] for r in last_results[-ne:]]) <=
-                                    max([r[metric] for r in last_results[:-ne]])
-                                    for metric in report.metrics):
-                                logger.info("Early stop at epoch %s", current_epoch)
-                                break
-                    else:
-                        losses = report.epoch_losses
-                        if len(losses) > ne:
-                            diff = min(losses[:-ne]) - min(losses[-ne:])
-                            logger.debug("Last %d epochs decrease: %.4f", ne, diff)
-                            if diff <= min_diff:
-                                logger.info("Early stop at epoch %s", current_epoch)
-                                break
+            if on_epoch_finished:
+                on_epoch_finished()
 
+        if evaluator is not None:
+            for (epoch_evaluated, epoch_log_dict, num_losses), state, (test_rets, valid_ret) in evaluator.wait():
+                self.record_evaluation(
+                    model, datasets, summary_writer, epoch_evaluated, epoch_log_dict, test_rets, valid_ret,
+                    num_losses, state)
+            evaluator.close()
             if on_epoch_finished:
                 on_epoch_finished()
 
@@ -362,6 +534,7 @@ class PytorchBackend(FrameworkBackend):
             report: ModelReport,
             num_samples=0,
             training_progress: TrainingProgress = None,
+            summary_writer: AsyncSummaryWriter = None,
             tqdm_desc="Epoch {current_epoch}",
             tqdm_position=None):
         """Train."""
@@ -389,7 +562,8 @@ class PytorchBackend(FrameworkBackend):
                 desc=tqdm_desc.format(current_epoch=current_epoch),
                 total=training_progress.num_samples, leave=False,
                 position=tqdm_position,
-                disable=not args.show_progress) as t:
+                disable=not args.show_progress) as t, \
+                self.get_profiler("train", f"epoch{current_epoch}", current_epoch) as profiler:
             t.update(num_samples)
             batch_size_checkpoints = sorted(batch_sizes.keys())
             for start, end in zip(batch_size_checkpoints, batch_size_checkpoints[1:] + [100]):
@@ -402,51 +576,52 @@ class PytorchBackend(FrameworkBackend):
                     end=end * len(datasets.train_set) // 100
                 )
 
-                for epoch_step, batch in enumerate(data_train):
-                    loss = model.training_step(batch)
-                    metrics = model.get_metrics()
+                for epoch_step, batch in enumerate(model.timer.iterate(data_train)):
+                    if batch is None or len(batch) == 0:
+                        logger.error("Batch size 0")
+                        continue
                     try:
-                        if batch is None or len(batch) == 0:
-                            raise Exception("Batch size 0")
-                        # loss = model.training_step(batch)
-                        # metrics = model.get_metrics()
-                        # clean
-                        torch.cuda.empty_cache()
+                        loss = self.training_step(model, batch)
                     except RuntimeError as e:
+                        # out of memory even with the smallest micro-batches: the state is saved to resume from
+                        if not is_out_of_memory(e):
+                            raise
                         torch.cuda.empty_cache()
                         logger.error(str(e))
                         logger.info("Saving model before exiting...")
                         model.save_checkpoint("latest")
+                        model.wait_for_checkpoints()
                         sys.exit(2)
-                    except Exception as e:
-                        logger.error(str(e))
-                        continue
-                    else:
-                        t.set_postfix(
-                            # loss="%.4f" % loss,
-                            loss="%.4f" % model.epoch_loss,
-                            # lr=mean(model.learning_rates())
-                            **{metric: "%.2f" % val for metric, val in metrics.items()},
-                            # **(report.current_results or {})
-                        )
+                    metrics = model.get_metrics()
+                    t.set_postfix(
+                        # loss="%.4f" % loss,
+                        loss="%.4f" % model.epoch_loss,
+                        # lr=mean(model.learning_rates())
+                        **{metric: "%.2f" % val for metric, val in metrics.items()},
+                        # **(report.current_results or {})
+                    )
 
                     # if args.debug and epoch_step > DEBUG_NUM_ITERATIONS:
                     #    break
                     t.update(len(batch))
                     training_progress.update(len(batch))
+                    num_samples += len(batch)
 
                     model.current_epoch = current_epoch
                     model.global_step = (current_epoch - 1) * len(datasets.train_set) + num_samples
+                    model.timer.step(len(batch), get_num_tokens(batch), model.global_step)
+                    profiler.step()
 
-                    if report.summary_writer is not None:
-                        report.summary_writer.add_scalar("loss", loss, model.global_step)
+                    if summary_writer is not None:
+                        summary_writer.add_scalar("loss", loss, model.global_step, throttle=True)
 
                     # Save model
                     if training_progress.should_save():
-                        if args.save_all:
-                            model.save_checkpoint("epoch-%02d" % current_epoch)
-                        else:
-                            model.save_checkpoint("latest")
+                        with model.timer.time("checkpoint"):
+                            if args.save_all:
+                                model.save_checkpoint("epoch-%02d" % current_epoch)
+                            else:
+                                model.save_checkpoint("latest")
 
                     # Log
                     if training_progress.should_log():
@@ -459,6 +634,7 @@ class PytorchBackend(FrameworkBackend):
                     if args.debug:
                         input("Press any key to continue...")
                 model.end_training_epoch()
+        model.timer.flush(model.global_step)
         # model.save_checkpoint("epoch-latest")
         end_time = datetime.now()
         return str(end_time - start_time), model.epoch_loss
@@ -486,8 +662,8 @@ class PytorchBackend(FrameworkBackend):
 
         model.module.eval()
         torch.cuda.empty_cache()
-        last_log = 0
-        with torch.no_grad():
+        num_output_samples = params.test.output_samples
+        with torch.no_grad(), model.average_parameters():
             data_iter = dataset.get_iter(
                 batch_size=params.test.batch_size or params.train.batch_size)
 
@@ -496,12 +672,17 @@ class PytorchBackend(FrameworkBackend):
             results = {metric: 0. for metric in params.test.metrics}
             outputs = []
             all_preds, all_refs, sample_ids, extra_all = [], [], [], []
+            # metrics are accumulated batch by batch when the dataset supports it
+            accumulators = {metric: dataset.get_metric(metric) for metric in params.test.metrics}
+            keep_preds = any(acc is None for acc in accumulators.values()) or bool(params.test.output and output_path)
+            keep_refs = any(acc is None for acc in accumulators.values())
             with tqdm(
                     total=len(dataset),
                     desc=tqdm_desc,
                     leave=False,
                     position=tqdm_position,
-                    disable=not self.configs.args.show_progress) as t:
+                    disable=not self.configs.args.show_progress) as t, \
+                    self.get_profiler("eval", output_tag or "") as profiler:
                 for batch in data_iter:
                     # noinspection PyBroadException
                     try:
@@ -510,10 +691,15 @@ class PytorchBackend(FrameworkBackend):
 
                         inference_outputs = model.infer(batch)
                         pred, ref, *others = inference_outputs
-                        all_preds += pred
-                        all_refs += ref
-                        if batch.ids:
-                            sample_ids += batch.ids
+                        for accumulator in accumulators.values():
+                            if accumulator is not None:
+                                accumulator.update(pred, ref)
+                        if keep_preds:
+                            all_preds += pred
+                            if batch.ids:
+                                sample_ids += batch.ids
+                        if keep_refs:
+                            all_refs += ref
 
                         t.update(len(batch))
                         # for metric in params.test.metrics:
@@ -525,31 +711,28 @@ class PytorchBackend(FrameworkBackend):
                         #     acc[metric] += _acc
                         #     total[metric] += _total
 
-                        for i, predicted in enumerate(pred):
-                            str_input, str_ground_truth, str_predicted = dataset.format_output(
-                                predicted, batch.item(i))
-                            outputs.append(dict(
-                                input=str_input,
-                                reference=str_ground_truth,
-                                hypothesis=str_predicted))
-
-                            is_passed, last_log = check_interval_passed(last_log, params.test.log_every)
-                            if is_passed:
-                                pass
-                                # logger.debug(
-                                #     "sample %d\n\t[inp] %s\n\t[ref] %s\n\t[hyp] %s",
-                                #     len(outputs),
-                                #     str(outputs[-1]['input']),
-                                #     str(outputs[-1]['reference']),
-                                #     str(outputs[-1]['hypothesis']))
+                        # only the first samples are formatted (for logs and output files)
+                        num_outputs = len(pred) if num_output_samples < 0 else \
+                            min(len(pred), num_output_samples - len(outputs))
+                        if num_outputs > 0:
+                            for predicted, item in zip(pred, batch.get_items(num_outputs)):
+                                str_input, str_ground_truth, str_predicted = dataset.format_output(predicted, item)
+                                outputs.append(dict(
+                                    input=str_input,
+                                    reference=str_ground_truth,
+                                    hypothesis=str_predicted))
 
                         if report.summary_writer is not None:
                             model.write_summary(report.summary_writer, batch, (pred, others))
                     except Exception:
                         logger.error(traceback.format_exc())
+                    profiler.step()
 
-                for metric in params.test.metrics:
-                    results[metric] = dataset.evaluate(all_preds, all_refs, metric, output_path)
+                for metric, accumulator in accumulators.items():
+                    if accumulator is not None:
+                        results[metric] = accumulator.compute()
+                    else:
+                        results[metric] = dataset.evaluate(all_preds, all_refs, metric, output_path)
 
                 if self.params.test.output and output_path:
                     path = dataset.write_results_to_file(
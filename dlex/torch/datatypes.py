@@ -2,6 +2,7 @@ from collections import namedtuple
 from dataclasses import dataclass
 from typing import Union, List
 
+import numpy as np
 import torch
 
 
@@ -12,6 +13,24 @@ class BatchItem:
     Y: torch.Tensor
 
 
+def _slice(val, start: int, end: int = None):
+    if isinstance(val, tuple):
+        return tuple(_slice(v, start, end) for v in val)
+    elif isinstance(val, (torch.Tensor, list, np.ndarray)):
+        return val[start:end]
+    else:
+        return val
+
+
+def _to_cpu(val):
+    if isinstance(val, tuple):
+        return tuple(_to_cpu(v) for v in val)
+    elif isinstance(val, torch.Tensor):
+        return val.detach().cpu()
+    else:
+        return val
+
+
 class Batch(dict):
     ids: List[Union[str, int]]
     X: torch.Tensor
@@ -41,6 +60,18 @@ class Batch(dict):
 
         return BatchItem(id=self.ids[i] if self.ids else None, X=X, Y=Y)
 
+    def split(self, num_chunks: int) -> List['Batch']:
+        """Split the batch into (at most) `num_chunks` smaller batches of consecutive samples"""
+        chunk_size = (len(self) + num_chunks - 1) // num_chunks
+        return [
+            Batch(**{key: _slice(val, start, start + chunk_size) for key, val in self.items()})
+            for start in range(0, len(self), chunk_size)]
+
+    def get_items(self, num: int = None) -> List[BatchItem]:
+        """Items of the first `num` samples (all if None). Tensors are moved to host memory once for all items."""
+        head = Batch(**{key: _to_cpu(_slice(val, 0, num)) for key, val in self.items()})
+        return [head.item(i) for i in range(len(head))]
+
     @property
     def batch_size(self):
         return len(self)
@@ -0,0 +1,83 @@
+"""Evaluation on a background thread while training continues"""
+import copy
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import nullcontext
+from typing import Callable, List, Tuple, Any
+
+import torch
+
+from dlex.torch.models.base import ModelWrapper
+
+
+class AsyncEvaluator:
+    """Evaluate snapshots of a model on a background thread.
+
+    A copy of the model is created on the same device(s) at the first evaluation. Each evaluation loads a host
+    snapshot of the training state (weights and EMA shadows) into the copy and runs on a separate CUDA stream,
+    so that training is not blocked. At most `max_pending` evaluations are queued: when the limit is reached,
+    `submit` waits for the oldest one to finish.
+
+    :param evaluate_fn: function evaluating a model wrapper
+    :param max_pending:
+    """
+
+    def __init__(self, evaluate_fn: Callable[[ModelWrapper], Any], max_pending: int = 1):
+        self.evaluate_fn = evaluate_fn
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="evaluation")
+        self._pending: List[Tuple[Any, dict, Future]] = []
+        self._model: ModelWrapper = None
+
+    def _create_model(self, model: ModelWrapper) -> ModelWrapper:
+        # dataset and params are shared with the training model
+        memo = {id(model.model.dataset): model.model.dataset, id(model.params): model.params}
+        eval_model = ModelWrapper(copy.deepcopy(model.model, memo), model.gpus)
+        eval_model.checkpoint_writer.close()
+        return eval_model
+
+    def _run(self, state: dict, current_epoch: int):
+        model = self._model
+        use_cuda = bool(model.gpus) and torch.cuda.is_available()
+        if use_cuda:
+            torch.cuda.set_device(torch.device(model.gpus[0]))
+        stream = torch.cuda.Stream() if use_cuda else None
+        with torch.cuda.stream(stream) if stream is not None else nullcontext():
+            model.load_state(state)
+            model.current_epoch = current_epoch
+            ret = self.evaluate_fn(model)
+        if stream is not None:
+            stream.synchronize()
+        return ret
+
+    def submit(self, model: ModelWrapper, info=None):
+        """Start evaluating the current state of a model
+
+        :param model: training model
+        :param info: returned with the results
+        """
+        if self._model is None:
+            self._model = self._create_model(model)
+        if len(self._pending) >= self.max_pending:
+            self._pending[-self.max_pending][2].result()
+        # the full snapshot is returned with the results (eg. to save the best checkpoint)
+        state = model.snapshot()
+        eval_state = {key: val for key, val in state.items() if key != 'optimizers'}
+        future = self._executor.submit(self._run, eval_state, model.current_epoch)
+        self._pending.append((info, state, future))
+
+    def poll(self) -> List[Tuple[Any, dict, Any]]:
+        """Return (info, state, results) of finished evaluations, in submission order"""
+        finished = []
+        while self._pending and self._pending[0][2].done():
+            info, state, future = self._pending.pop(0)
+            finished.append((info, state, future.result()))
+        return finished
+
+    def wait(self) -> List[Tuple[Any, dict, Any]]:
+        """Wait for all pending evaluations and return their results"""
+        for _, _, future in self._pending:
+            future.result()
+        return self.poll()
+
+    def close(self):
+        self._executor.shutdown()
@@ -49,7 +49,7 @@ def main():
         logger.info("Cuda available: %s", torch.cuda.get_device_name(0))
         model.cuda()
 
-    model.load_checkpoint(args.load)
+    model.load_checkpoint(args.load, load_optimizers=False)
     init_dirs(params)
 
     while True:
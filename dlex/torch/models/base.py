@@ -1,5 +1,6 @@
 import abc
 import os
+from contextlib import contextmanager
 from dataclasses import dataclass
 from typing import List, NamedTuple, Dict, Tuple, Union
 
@@ -7,9 +8,13 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from dlex.configs import ModuleConfigs, AttrDict, Params
+from dlex.configs import ModuleConfigs, AttrDict, Params, compile_config
 from dlex.datasets.torch import Dataset
 from dlex.torch import Batch
+from dlex.torch.utils.activation_checkpointing import enable_activation_checkpointing, \
+    get_activation_memory_saved
+from dlex.torch.utils.checkpoint import CheckpointWriter, load_checkpoint_file
+from dlex.torch.utils.instrumentation import StepTimer
 from dlex.torch.utils.model_utils import get_optimizer, get_lr_scheduler, ExponentialMovingAverage
 from dlex.utils.logging import logger
 
@@ -114,61 +119,104 @@ class ModelWrapper:
         self._metrics = {}
 
         if self.params.train.ema_decay_rate:
-            self.ema = ExponentialMovingAverage(self.params.train.ema_decay_rate)
-            for name, param in model.named_parameters():
-                if param.requires_grad:
-                    self.ema.register(name, param.data)
+            self.ema = ExponentialMovingAverage(
+                model.parameters(),
+                self.params.train.ema_decay_rate,
+                self.params.train.ema_update_every)
         else:
             self.ema = None
 
+        self.checkpoint_writer = CheckpointWriter(
+            keep_last=self.params.train.keep_checkpoints,
+            asynchronous=self.params.train.async_checkpoint)
+        self.timer = StepTimer(enabled=False)
+
+        if self.params.model.get('checkpoint_activations'):
+            blocks = enable_activation_checkpointing(model, self.params.model.checkpoint_activations)
+            logger.info("Activation checkpointing: %d blocks", len(blocks))
+            self._activation_memory_reported = False
+        else:
+            self._activation_memory_reported = True
+
     def reset_counter(self):
         self._num_samples = 0
         self.epoch_loss_total = 0.
         self.epoch_loss_count = 0
         self._metrics = {}
 
-    def training_step(self, batch):
+    def training_step(self, batch, num_micro_batches: int = 1):
+        """Run forward, backward and optimizer steps on a batch
+
+        :param batch:
+        :param num_micro_batches: if larger than 1, the batch is split into micro-batches whose gradients are
+            accumulated before the optimizer step. The result is equivalent to a single step on the full batch
+            for losses averaged over samples.
+        :return: the loss
+        """
         self.module.train(True)
-        self.module.zero_grad()
+        for optimizer in self.optimizers:
+            # flattened parameters keep their gradients as views of a shared buffer
+            optimizer.zero_grad(set_to_none=not self.params.train.optimizer.get('flatten'))
         if batch is None or (isinstance(batch, Batch) and len(batch.Y) == 0):
             raise Exception("Empty batch.")
 
-        output = self.module.forward(batch)
-        loss = self.model.get_loss(batch, output)
-        metrics = self.model.get_metrics(batch, output)
-        for metric, (total, num) in metrics.items():
-            if metric not in self._metrics:
-                self._metrics[metric] = (total, num)
-            else:
-                _total, _num = self._metrics[metric]
-                self._metrics[metric] = (total + _total, num + _num)
-
-        if np.isnan(loss.item()):
-            raise Exception("NaN loss.")
-
-        loss.backward()
-        # clip grad norm
-        if self.params.train.max_grad_norm is not None and self.params.train.max_grad_norm > 0:
-            # params = itertools.chain.from_iterable([group['params'] for group in optimizer.param_groups])
-            nn.utils.clip_grad_norm_(self.model.parameters(), self.params.train.max_grad_norm)
-
-        for optimizer in self.optimizers:
-            optimizer.step()
-
-        if self.ema is not None:
-            for name, param in self.model.named_parameters():
-                if param.requires_grad:
-                    param.data = self.ema(name, param.data)
+        if num_micro_batches > 1 and isinstance(batch, Batch):
+            micro_batches = batch.split(num_micro_batches)
+        else:
+            micro_batches = [batch]
+
+        total_loss = 0.
+        step_metrics = {}
+        for micro_batch in micro_batches:
+            weight = len(micro_batch) / len(batch) if len(micro_batches) > 1 else 1.
+            with self.timer.time("forward"):
+                output = self.module.forward(micro_batch)
+                loss = self.model.get_loss(micro_batch, output)
+                metrics = self.model.get_metrics(micro_batch, output)
+            for metric, (total, num) in metrics.items():
+                _total, _num = step_metrics.get(metric, (0, 0))
+                step_metrics[metric] = (total + _total, num + _num)
+
+            if np.isnan(loss.item()):
+                raise Exception("NaN loss.")
+
+            with self.timer.time("backward"):
+                (loss * weight if weight != 1. else loss).backward()
+            total_loss += loss.detach().item() * weight
+            del output, loss
+
+        for metric, (total, num) in step_metrics.items():
+            _total, _num = self._metrics.get(metric, (0, 0))
+            self._metrics[metric] = (total + _total, num + _num)
+
+        with self.timer.time("optimizer"):
+            # clip grad norm
+            if self.params.train.max_grad_norm is not None and self.params.train.max_grad_norm > 0:
+                nn.utils.clip_grad_norm_(
+                    [p for optimizer in self.optimizers for group in optimizer.param_groups for p in group['params']],
+                    self.params.train.max_grad_norm)
+
+            for optimizer in self.optimizers:
+                optimizer.step()
+
+            if self.ema is not None:
+                self.ema.update()
 
         # log_dict = self.train_log(batch, output, verbose=self.params.verbose)
         # if len(log_dict) > 0:
         #     logger.info(log_dict)
 
         # update accumulative loss
-        self.epoch_loss_total += loss.detach().item()
+        self.epoch_loss_total += total_loss
         self.epoch_loss_count += 1
 
-        return loss.detach().item()
+        if not self._activation_memory_reported:
+            logger.info(
+                "Activation checkpointing: %.1f MiB of activations recomputed in backward",
+                get_activation_memory_saved(self.model) / 2 ** 20)
+            self._activation_memory_reported = True
+
+        return total_loss
 
     def get_metrics(self) -> Dict[str, float]:
         return {metric: total / num for metric, (total, num) in self._metrics.items()}
@@ -181,7 +229,7 @@ class ModelWrapper:
     @property
     def optimizers(self) -> List[torch.optim.Optimizer]:
         if self._optimizers is None:
-            self._optimizers = [get_optimizer(self.params.train.optimizer, self.model.parameters())]
+            self._optimizers = [get_optimizer(self.params.train.optimizer, self.model)]
             if self.params.train.lr_scheduler:
                 self._lr_schedulers = [get_lr_scheduler(
                     self.params.train.lr_scheduler,
@@ -222,13 +270,21 @@ class ModelWrapper:
     def write_summary(self, summary_writer, batch, output):
         pass
 
+    @contextmanager
+    def average_parameters(self):
+        """Swap in the EMA weights (if enabled) for the duration of the context"""
+        if self.ema is None:
+            yield
+        else:
+            with self.ema.average_parameters():
+                yield
+
     @property
     def epoch_loss(self):
         return self.epoch_loss_total / self.epoch_loss_count if self.epoch_loss_count > 0 else None
 
-    def save_checkpoint(self, tag):
-        """Save current training state"""
-        os.makedirs(self.params.checkpoint_dir, exist_ok=True)
+    def get_state(self) -> dict:
+        """Training state saved in checkpoints. Tensors are not copied."""
         state = {
             'training_id': self.params.training_id,
             'global_step': self.global_step,
@@ -237,26 +293,65 @@ class ModelWrapper:
             'model': self.model.state_dict(),
             'optimizers': [optimizer.state_dict() for optimizer in self.optimizers]
         }
+        if self.ema is not None:
+            state['ema'] = self.ema.state_dict()
+        return state
+
+    def snapshot(self) -> dict:
+        """Copy of the training state in host memory, which is not affected by further training steps"""
+        def _copy(obj):
+            if isinstance(obj, torch.Tensor):
+                return obj.detach().to('cpu', copy=True)
+            elif isinstance(obj, dict):
+                return obj.__class__((k, _copy(v)) for k, v in obj.items())
+            elif isinstance(obj, (list, tuple)):
+                return obj.__class__(_copy(v) for v in obj)
+            else:
+                return obj
+        return _copy(self.get_state())
+
+    def save_checkpoint(self, tag, state: dict = None):
+        """Save training state. The file is written in the background if `train.async_checkpoint` is set.
+
+        :param tag:
+        :param state: state to save (eg. a snapshot). Default: current state
+        """
         fn = os.path.join(self.params.checkpoint_dir, tag + ".pt")
-        torch.save(state, fn)
-        logger.debug("Checkpoint saved to %s", fn)
+        self.checkpoint_writer.save(state or self.get_state(), fn, protected=tag in ["latest", "best"])
+
+    def wait_for_checkpoints(self):
+        """Block until all checkpoints have been written to disk"""
+        self.checkpoint_writer.wait()
+
+    def load_state(self, state: dict):
+        """Restore training state (eg. returned by `get_state` or `snapshot`). Optimizers are restored if present."""
+        self.global_step = state['global_step']
+        self.epoch_loss_count = state['epoch_loss_count']
+        self.epoch_loss_total = state['epoch_loss_total']
+        self.model.load_state_dict(state['model'])
+        if self.ema is not None and 'ema' in state:
+            self.ema.load_state_dict(state['ema'])
+        if 'optimizers' in state:
+            for i, optimizer in enumerate(self.optimizers):
+                optimizer.load_state_dict(state['optimizers'][i])
 
     def load_checkpoint(self, tag, load_optimizers=True):
-        """Load from saved state"""
+        """Load from saved state
+
+        :param tag:
+        :param load_optimizers: if False, optimizer states are not read from disk (eg. for evaluation)
+        """
+        self.checkpoint_writer.wait()
         file_name = os.path.join(self.params.checkpoint_dir, tag + ".pt")
         logger.info("Load checkpoint from %s" % file_name)
         if os.path.exists(file_name):
-            checkpoint = torch.load(file_name, map_location='cpu')
+            keys = ['training_id', 'global_step', 'epoch_loss_total', 'epoch_loss_count', 'model', 'ema']
+            if load_optimizers:
+                keys.append('optimizers')
+            checkpoint = load_checkpoint_file(file_name, keys)
             self.params.training_id = checkpoint['training_id']
             logger.info(checkpoint['training_id'])
-            self.global_step = checkpoint['global_step']
-            self.epoch_loss_count = checkpoint['epoch_loss_count']
-            self.epoch_loss_total = checkpoint['epoch_loss_total']
-            self.model.load_state_dict(checkpoint['model'])
-            if load_optimizers:
-                for i, optimizer in enumerate(self.optimizers):
-                    optimizer.load_state_dict(checkpoint['optimizers'][i])
-
+            self.load_state(checkpoint)
             return self.params.training_id
         else:
             raise Exception("Checkpoint not found: %s" % file_name)
@@ -297,7 +392,7 @@ def default_params(default):
     def wrap_fn(cls):
         class wrap_cls(cls):
             def __init__(self, params, dataset):
-                params.model.extend_default_keys(default)
+                params.model = compile_config(params.model, "model", defaults=default)
                 super().__init__(params, dataset)
         return wrap_cls
     return wrap_fn
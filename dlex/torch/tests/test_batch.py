@@ -0,0 +1,31 @@
+import torch
+
+from dlex.torch import Batch
+
+
+def test_split():
+    batch = Batch(
+        X=(torch.arange(10).view(5, 2), torch.arange(5)),
+        X_len=[2, 2, 1, 1, 1],
+        Y=torch.arange(5))
+    chunks = batch.split(2)
+    assert [len(chunk) for chunk in chunks] == [3, 2]
+    assert chunks[1].X[0].tolist() == [[6, 7], [8, 9]]
+    assert chunks[1].X[1].tolist() == [3, 4]
+    assert chunks[1].X_len == [1, 1]
+    assert chunks[0].ids is None
+
+
+def test_split_more_chunks_than_samples():
+    batch = Batch(X=torch.zeros(2, 3), Y=torch.zeros(2), ids=["a", "b"])
+    chunks = batch.split(4)
+    assert [chunk.ids for chunk in chunks] == [["a"], ["b"]]
+
+
+def test_get_items():
+    batch = Batch(X=(torch.arange(6).view(3, 2), torch.arange(3)), Y=torch.tensor([7, 8, 9]), ids=[1, 2, 3])
+    items = batch.get_items(2)
+    assert [item.id for item in items] == [1, 2]
+    assert items[1].X[0].tolist() == [2, 3]
+    assert [item.Y.item() for item in items] == [7, 8]
+    assert len(batch.get_items()) == 3
@@ -0,0 +1,120 @@
+"""Recompute activations of selected blocks during backward instead of keeping them in memory"""
+from typing import Dict, List, Union
+
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+BLOCK_TYPES = ["rnn", "transformer", "linear"]
+
+
+class CheckpointedBlock:
+    """Mixin running the forward pass of a module through `torch.utils.checkpoint` during training.
+
+    Only the inputs of the block are kept for backward. Its intermediate activations are recomputed, with the same
+    random state (dropout) and autocast state as the original forward pass, so the block can be used with mixed
+    precision and gradient accumulation.
+    """
+    saved_bytes: int = None  # size of the activations not kept in memory, measured at the first training call
+
+    def forward(self, *args, **kwargs):
+        if not (self.training and torch.is_grad_enabled()):
+            return super().forward(*args, **kwargs)
+        if self.saved_bytes is None:
+            self.saved_bytes = _measure_saved_bytes(self, *args, **kwargs)
+        return checkpoint(super().forward, *args, use_reentrant=False, **kwargs)
+
+
+_checkpointed_classes: Dict[type, type] = {}
+
+
+def _tensors(obj):
+    if isinstance(obj, torch.Tensor):
+        yield obj
+    elif isinstance(obj, (list, tuple)):
+        for val in obj:
+            yield from _tensors(val)
+    elif isinstance(obj, dict):
+        for val in obj.values():
+            yield from _tensors(val)
+
+
+def _measure_saved_bytes(module: nn.Module, *args, **kwargs) -> int:
+    """Size of the tensors saved for backward by a module, excluding its inputs and parameters"""
+    seen = {t.data_ptr() for t in _tensors([args, kwargs])}
+    seen.update(p.data_ptr() for p in module.parameters())
+    total = 0
+
+    def pack(tensor):
+        nonlocal total
+        if tensor.data_ptr() not in seen:
+            seen.add(tensor.data_ptr())
+            total += tensor.numel() * tensor.element_size()
+        return tensor
+
+    devices = [torch.cuda.current_device()] if torch.cuda.is_available() and torch.cuda.is_initialized() else []
+    with torch.random.fork_rng(devices=devices), torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        super(CheckpointedBlock, module).forward(*args, **kwargs)
+    return total
+
+
+def checkpoint_module(module: nn.Module):
+    """Recompute the activations of a module during backward. Parameters and state dict keys are unchanged."""
+    if isinstance(module, CheckpointedBlock):
+        return
+    cls = module.__class__
+    if cls not in _checkpointed_classes:
+        _checkpointed_classes[cls] = type("Checkpointed" + cls.__name__, (CheckpointedBlock, cls), {})
+    module.__class__ = _checkpointed_classes[cls]
+
+
+def get_block_stacks(model: nn.Module, block_types: List[str] = None) -> List[List[nn.Module]]:
+    """Find the stacks of layers that can be checkpointed.
+
+    - rnn: layers in the `_rnns` stack of `EncoderRNN` (or its multi-layer `_rnn`)
+    - transformer: layers of `nn.TransformerEncoder` and `nn.TransformerDecoder`
+    - linear: blocks of `MultiLinear`
+    """
+    from dlex.torch.models.attention.encoder import EncoderRNN
+    from dlex.torch.utils.model_utils import MultiLinear
+
+    block_types = block_types or BLOCK_TYPES
+    for block_type in block_types:
+        if block_type not in BLOCK_TYPES:
+            raise ValueError("%s is not a valid block type. Must be one of %s" % (block_type, BLOCK_TYPES))
+
+    stacks = []
+    for module in model.modules():
+        if "rnn" in block_types and isinstance(module, EncoderRNN):
+            stacks.append(list(module._rnns) if hasattr(module, '_rnns') else [module._rnn])
+        elif "transformer" in block_types and isinstance(module, (nn.TransformerEncoder, nn.TransformerDecoder)):
+            stacks.append(list(module.layers))
+        elif "linear" in block_types and isinstance(module, MultiLinear):
+            stacks.append(list(module.layers))
+    return stacks
+
+
+def enable_activation_checkpointing(model: nn.Module, cfg: Union[bool, dict]) -> List[nn.Module]:
+    """Checkpoint blocks of a model according to `model.checkpoint_activations`
+
+    :param model:
+    :param cfg: True to checkpoint every supported block, or a dict with keys
+        - blocks: list of block types to checkpoint (rnn, transformer, linear). Default: all
+        - every: checkpoint one layer out of `every` in each stack, starting from the first one. Default: 1
+    :return: checkpointed modules
+    """
+    if not isinstance(cfg, dict):
+        cfg = {}
+    every = cfg.get('every') or 1
+    modules = []
+    for stack in get_block_stacks(model, cfg.get('blocks')):
+        for i, module in enumerate(stack):
+            if i % every == 0:
+                checkpoint_module(module)
+                modules.append(module)
+    return modules
+
+
+def get_activation_memory_saved(model: nn.Module) -> int:
+    """Number of bytes of activations not kept in memory during the first training step, summed over blocks"""
+    return sum(module.saved_bytes or 0 for module in model.modules() if isinstance(module, CheckpointedBlock))
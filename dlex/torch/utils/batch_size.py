@@ -0,0 +1,149 @@
+"""Search for the batch size with the best training throughput"""
+import copy
+import hashlib
+import json
+import os
+import time
+from typing import List, Dict
+
+import torch
+
+from dlex.configs import ModuleConfigs
+from dlex.torch.utils.model_utils import is_out_of_memory
+from dlex.utils import table2str
+from dlex.utils.logging import logger
+
+
+def _sample_length(sample) -> int:
+    """Length of the longest sequence in a sample (0 if the sample has no sequence)"""
+    if isinstance(sample, dict):
+        values = sample.values()
+    elif hasattr(sample, '__dict__'):
+        values = vars(sample).values()
+    else:
+        values = [sample]
+    lengths = [len(val) for val in values if hasattr(val, '__len__') and not isinstance(val, str)]
+    return max(lengths, default=0)
+
+
+def get_cache_key(params, device: str) -> str:
+    content = json.dumps(dict(
+        model=params.model.to_dict(level=100),
+        dataset=params.dataset.to_dict(level=100),
+        device=device), sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def get_device_name(model) -> str:
+    if model.gpus and torch.cuda.is_available():
+        return ",".join(torch.cuda.get_device_name(torch.device(gpu)) for gpu in model.gpus)
+    return "cpu"
+
+
+def find_batch_size(
+        model,
+        dataset,
+        max_batch_size: int = None,
+        max_memory: float = 0.9,
+        num_steps: int = 3,
+        use_cache: bool = True) -> int:
+    """Find the batch size with the highest number of training samples per second.
+
+    Batch sizes are tried in powers of 2 on the longest samples of the dataset, so that the chosen size also fits
+    the longest batches of variable-length data. The search stops at the first size that runs out of memory or
+    exceeds the memory ceiling. Model and optimizer states are restored afterwards. Results are cached per
+    (model configs, dataset configs, device) in the tmp folder.
+
+    :param model:
+    :type model: ModelWrapper
+    :param dataset: training set
+    :param max_batch_size: largest size to try. Default: size of the dataset
+    :param max_memory: fraction of device memory that can be used (CUDA only)
+    :param num_steps: number of timed steps per size
+    :param use_cache: whether to return and store cached results
+    :return: the chosen batch size
+    """
+    device = get_device_name(model)
+    cache_path = os.path.join(ModuleConfigs.get_tmp_path(), "batch_size_cache.json")
+    cache_key = get_cache_key(model.params, device)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    if use_cache and cache_key in cache:
+        logger.info("Batch size (cached): %d", cache[cache_key]['batch_size'])
+        return cache[cache_key]['batch_size']
+
+    max_batch_size = min(max_batch_size or len(dataset), len(dataset))
+    # only the longest samples are kept in memory
+    lengths = [_sample_length(dataset[i]) for i in range(len(dataset))]
+    indices = sorted(range(len(dataset)), key=lengths.__getitem__, reverse=True)[:max_batch_size]
+    samples = [dataset[i] for i in indices]
+    cuda = torch.cuda.is_available() and bool(model.gpus)
+    memory_limit = max_memory * torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory \
+        if cuda else None
+
+    model_state = copy.deepcopy(model.model.state_dict())
+    optimizer_states = [copy.deepcopy(optimizer.state_dict()) for optimizer in model.optimizers]
+    ema_state = copy.deepcopy(model.ema.state_dict()) if model.ema is not None else None
+
+    trials: List[Dict] = []
+    batch_size = 1
+    while batch_size <= max_batch_size:
+        try:
+            if cuda:
+                torch.cuda.empty_cache()
+                torch.cuda.reset_peak_memory_stats()
+            batch = dataset.collate_fn(samples[:batch_size])
+            model.training_step(batch)  # warm up
+            if cuda:
+                torch.cuda.synchronize()
+            start_time = time.perf_counter()
+            for _ in range(num_steps):
+                model.training_step(batch)
+            if cuda:
+                torch.cuda.synchronize()
+            elapsed = time.perf_counter() - start_time
+        except Exception as e:
+            if not is_out_of_memory(e):
+                raise
+            logger.debug("Batch size %d: out of memory", batch_size)
+            break
+        finally:
+            model.reset_counter()
+
+        memory = torch.cuda.max_memory_allocated() if cuda else None
+        trials.append(dict(
+            batch_size=batch_size,
+            samples_per_sec=batch_size * num_steps / elapsed,
+            memory=memory / 2 ** 20 if memory is not None else None))
+        if memory_limit is not None and memory > memory_limit:
+            trials.pop()
+            break
+        batch_size *= 2
+
+    model.model.load_state_dict(model_state)
+    for optimizer, state in zip(model.optimizers, optimizer_states):
+        optimizer.load_state_dict(state)
+    if ema_state is not None:
+        model.ema.load_state_dict(ema_state)
+    if cuda:
+        torch.cuda.empty_cache()
+
+    if not trials:
+        raise RuntimeError("No batch size fits in memory.")
+    best = max(trials, key=lambda trial: trial['samples_per_sec'])
+    logger.info("Batch size search (%s):\n%s", device, table2str(
+        [["Batch size", "Samples/s", "Memory (MiB)"]] +
+        [[t['batch_size'], "%.1f" % t['samples_per_sec'], "%.0f" % t['memory'] if t['memory'] else "-"]
+         for t in trials]))
+    logger.info("Batch size: %d", best['batch_size'])
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    cache[cache_key] = dict(batch_size=best['batch_size'], device=device, trials=trials)
+    # the cache is replaced at once, so that processes starting meanwhile never read a partial file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, cache_path)
+    return best['batch_size']
@@ -0,0 +1,146 @@
+"""Checkpoint writing and loading"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Iterable
+
+import torch
+
+from dlex.utils.logging import logger
+
+
+class CheckpointWriter:
+    """Write checkpoints in the background.
+
+    The state is first copied to (pinned) host memory, which is the only part the training loop waits for.
+    The copy is then saved to a temporary file on a separate thread and renamed, so an existing checkpoint
+    is never left half-written. Host buffers are reused between checkpoints and at most one write is
+    pending at a time.
+
+    :param keep_last: number of checkpoints to keep, not counting protected ones (eg. latest, best).
+        If None, all checkpoints are kept.
+    :param asynchronous: if False, checkpoints are written on the calling thread
+    """
+
+    def __init__(self, keep_last: int = None, asynchronous: bool = True):
+        self.keep_last = keep_last
+        self.asynchronous = asynchronous
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint") if asynchronous else None
+        self._pending: Future = None
+        self._buffers: Dict[tuple, torch.Tensor] = {}
+        self._history: List[str] = []
+
+        self.num_writes = 0
+        self.total_write_time = 0.
+        self.last_write_time = None
+        self.last_snapshot_time = None
+
+    @property
+    def metrics(self) -> Dict[str, float]:
+        return dict(
+            num_writes=self.num_writes,
+            total_write_time=self.total_write_time,
+            last_write_time=self.last_write_time,
+            last_snapshot_time=self.last_snapshot_time)
+
+    def _snapshot(self, obj, key=()):
+        if isinstance(obj, torch.Tensor):
+            buffer = self._buffers.get(key)
+            if buffer is None or buffer.shape != obj.shape or buffer.dtype != obj.dtype:
+                buffer = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=obj.is_cuda)
+                self._buffers[key] = buffer
+            buffer.copy_(obj.detach(), non_blocking=obj.is_cuda)
+            return buffer
+        elif isinstance(obj, dict):
+            return obj.__class__((k, self._snapshot(v, key + (k,))) for k, v in obj.items())
+        elif isinstance(obj, (list, tuple)):
+            return obj.__class__(self._snapshot(v, key + (i,)) for i, v in enumerate(obj))
+        else:
+            return obj
+
+    def save(self, state: dict, file_name: str, protected: bool = False):
+        """
+        :param state: state to save. Tensors may be on any device and are copied before this method returns.
+        :param file_name:
+        :param protected: if True, the file is not subject to the retention policy
+        """
+        self.wait()
+
+        start_time = time.time()
+        snapshot = self._snapshot(state)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        self.last_snapshot_time = time.time() - start_time
+
+        if self._executor:
+            self._pending = self._executor.submit(self._write, snapshot, file_name, protected)
+        else:
+            self._write(snapshot, file_name, protected)
+
+    def _write(self, state: dict, file_name: str, protected: bool):
+        start_time = time.time()
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        tmp_file_name = file_name + ".tmp"
+        try:
+            with open(tmp_file_name, "wb") as f:
+                torch.save(state, f)
+                # the data must be on disk before the rename, or a crash may leave an empty checkpoint
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file_name, file_name)
+        except Exception as e:
+            logger.error("Error saving checkpoint to %s: %s", file_name, str(e))
+            if os.path.exists(tmp_file_name):
+                os.remove(tmp_file_name)
+            raise
+
+        self.last_write_time = time.time() - start_time
+        self.total_write_time += self.last_write_time
+        self.num_writes += 1
+        logger.debug("Checkpoint saved to %s (%.2fs)", file_name, self.last_write_time)
+
+        if not protected:
+            if file_name in self._history:
+                self._history.remove(file_name)
+            self._history.append(file_name)
+            if self.keep_last is not None:
+                while len(self._history) > self.keep_last:
+                    old_file_name = self._history.pop(0)
+                    if os.path.exists(old_file_name):
+                        os.remove(old_file_name)
+                        logger.debug("Checkpoint removed: %s", old_file_name)
+
+    def wait(self):
+        """Block until the pending checkpoint has been written. An error raised while writing it is raised here."""
+        if self._pending is not None:
+            try:
+                self._pending.result()
+            finally:
+                self._pending = None
+
+    def close(self):
+        """Wait for the pending checkpoint and stop the writing thread. Later checkpoints are written synchronously."""
+        try:
+            self.wait()
+        finally:
+            if self._executor:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def load_checkpoint_file(file_name: str, keys: Iterable[str] = None) -> dict:
+    """Load a checkpoint lazily.
+
+    Tensors are memory-mapped from the file, so only the data of the tensors that are actually used (eg. model
+    weights but not optimizer states) is read from disk. Files in the legacy format are loaded entirely.
+
+    :param file_name:
+    :param keys: top-level entries to return. If None, all entries are returned.
+    """
+    try:
+        state = torch.load(file_name, map_location='cpu', mmap=True)
+    except (TypeError, RuntimeError):  # mmap is not supported by this version or file format
+        state = torch.load(file_name, map_location='cpu')
+    if keys is not None:
+        state = {key: state[key] for key in keys if key in state}
+    return state
@@ -0,0 +1,215 @@
+"""Timing, throughput and profiling of training steps"""
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterable, Dict
+
+import torch
+
+from dlex.utils.logging import background_writer
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def _append_line(path: str, line: str):
+    with open(path, "a") as f:
+        f.write(line + "\n")
+
+
+def get_num_tokens(batch) -> int:
+    """Number of target tokens in a batch of sequences, or None if the batch does not contain sequences"""
+    if isinstance(batch, dict) and batch.get('Y_len') is not None:
+        return int(sum(batch['Y_len']))
+    return None
+
+
+def get_peak_memory() -> float:
+    """Peak memory (MiB) of the current device since the last reset, or peak RSS of the process on CPU"""
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        return torch.cuda.max_memory_allocated() / 2 ** 20
+    elif resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+    return None
+
+
+class StepTimer:
+    """Accumulate time spent in each part of training steps and report averages every few steps.
+
+    Sections are timed on the host. If `synchronize` is not set, time of asynchronous CUDA kernels is attributed
+    to the section that waits for them.
+
+    :param log_path: path of a JSON lines file to append aggregated records to
+    :param summary_writer: tensorboard writer
+    :param report: the `timing` property of the report is set to the latest record
+    :param aggregate_every: number of steps between two records
+    :param enabled: if False, nothing is measured
+    :param synchronize: wait for CUDA kernels at the boundaries of each section
+    """
+
+    def __init__(
+            self,
+            log_path: str = None,
+            summary_writer=None,
+            report=None,
+            aggregate_every: int = 100,
+            enabled: bool = True,
+            synchronize: bool = False):
+        self.log_path = log_path
+        self.summary_writer = summary_writer
+        self.report = report
+        self.aggregate_every = aggregate_every
+        self.enabled = enabled
+        self.synchronize = synchronize and torch.cuda.is_available()
+        self.last_record = None
+        self._reset()
+
+    def _reset(self):
+        self._totals = defaultdict(float)
+        self._num_steps = 0
+        self._num_samples = 0
+        self._num_tokens = 0
+        self._start_time = time.perf_counter()
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.reset_peak_memory_stats()
+
+    @contextmanager
+    def time(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        if self.synchronize:
+            torch.cuda.synchronize()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.synchronize:
+                torch.cuda.synchronize()
+            self._totals[name] += time.perf_counter() - start_time
+
+    def add(self, name: str, seconds: float):
+        if self.enabled:
+            self._totals[name] += seconds
+
+    def iterate(self, iterable: Iterable, name: str = "data"):
+        """Iterate and record the time spent waiting for each item"""
+        iterator = iter(iterable)
+        while True:
+            start_time = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            if self.enabled:
+                self._totals[name] += time.perf_counter() - start_time
+            yield item
+
+    def step(self, num_samples: int, num_tokens: int = None, global_step: int = None):
+        if not self.enabled:
+            return
+        self._num_steps += 1
+        self._num_samples += num_samples
+        self._num_tokens += num_tokens or 0
+        if self.aggregate_every and self._num_steps >= self.aggregate_every:
+            self.flush(global_step)
+
+    def flush(self, global_step: int = None) -> Dict:
+        """Write the record aggregated since the last flush"""
+        if not self.enabled or self._num_steps == 0:
+            return None
+        elapsed = time.perf_counter() - self._start_time
+        record = dict(
+            step=global_step,
+            num_steps=self._num_steps,
+            elapsed=elapsed,
+            time={name: total / self._num_steps for name, total in self._totals.items()},
+            samples_per_sec=self._num_samples / elapsed,
+            tokens_per_sec=self._num_tokens / elapsed if self._num_tokens else None,
+            peak_memory=get_peak_memory())
+
+        if self.summary_writer is not None:
+            for name, val in record['time'].items():
+                self.summary_writer.add_scalar(f"timing/{name}", val, global_step)
+            for key in ['samples_per_sec', 'tokens_per_sec', 'peak_memory']:
+                if record[key] is not None:
+                    self.summary_writer.add_scalar(f"timing/{key}", record[key], global_step)
+        if self.log_path:
+            background_writer.submit(_append_line, self.log_path, json.dumps(record))
+        if self.report is not None:
+            self.report.timing = record
+
+        self.last_record = record
+        self._reset()
+        return record
+
+
+class NullProfiler:
+    """Profiler that does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def step(self):
+        pass
+
+
+def get_profiler(cfg, output_dir: str, name: str):
+    """Create a `torch.profiler.profile` from `train.profile` configs.
+
+    Accepted keys: wait, warmup, active, repeat (schedule in number of steps), activities (cpu, cuda),
+    record_shapes, profile_memory, with_stack, with_flops, sort_by, row_limit.
+    Each collected trace is exported to `output_dir` as a Chrome trace (`<name>_<step>.json`, can be opened in
+    chrome://tracing or Perfetto) and an operator summary table (`<name>_<step>.txt`), grouped by call stack if
+    `with_stack` is set.
+
+    :param cfg: profile configs. If None, a profiler that does nothing is returned.
+    :param output_dir:
+    :param name: prefix of exported files
+    """
+    if not cfg:
+        return NullProfiler()
+    from torch.profiler import profile, schedule, ProfilerActivity
+
+    if cfg.get('activities'):
+        accepted = {a.lower(): activity for a, activity in ProfilerActivity.__members__.items()}
+        for a in cfg['activities']:
+            if str(a).lower() not in accepted:
+                raise ValueError(
+                    f"Unknown profiler activity '{a}'. Accepted values: {', '.join(accepted)}")
+        activities = [accepted[str(a).lower()] for a in cfg['activities']]
+    else:
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+    with_stack = cfg.get('with_stack', True)
+    sort_by = cfg.get('sort_by') or (
+        "self_cuda_time_total" if ProfilerActivity.CUDA in activities else "self_cpu_time_total")
+
+    def on_trace_ready(prof):
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"{name}_{prof.step_num}")
+        prof.export_chrome_trace(path + ".json")
+        with open(path + ".txt", "w") as f:
+            f.write(prof.key_averages(group_by_stack_n=5 if with_stack else 0).table(
+                sort_by=sort_by, row_limit=cfg.get('row_limit', 50)))
+
+    return profile(
+        activities=activities,
+        schedule=schedule(
+            wait=cfg.get('wait', 1),
+            warmup=cfg.get('warmup', 1),
+            active=cfg.get('active', 3),
+            repeat=cfg.get('repeat', 1)),
+        on_trace_ready=on_trace_ready,
+        record_shapes=cfg.get('record_shapes', False),
+        profile_memory=cfg.get('profile_memory', False),
+        with_stack=with_stack,
+        with_flops=cfg.get('with_flops', False))
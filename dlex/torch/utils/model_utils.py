@@ -1,6 +1,10 @@
 """Model utils"""
+from collections import OrderedDict
+from contextlib import contextmanager
 from typing import List, Union
 import importlib
+import inspect
+import re
 
 import torch
 import torch.nn as nn
@@ -25,14 +29,83 @@ def get_loss_fn(params):
     return getattr(i, params.loss)
 
 
+NORM_LAYERS = (nn.LayerNorm, nn.GroupNorm, nn.modules.batchnorm._BatchNorm)
+OPTIMIZER_OPTIONS = ['name', 'foreach', 'fused', 'flatten', 'freeze', 'no_decay_bias_and_norm', 'param_groups']
+
+
+def get_param_groups(cfg, model: nn.Module) -> List[dict]:
+    """Split trainable parameters of a model into optimizer parameter groups.
+
+    :param cfg: optimizer configs (see `get_optimizer`)
+    :param model:
+    :return: list of parameter groups
+    """
+    freeze = [re.compile(pattern) for pattern in cfg.get('freeze') or []]
+    group_options = [dict(group) for group in cfg.get('param_groups') or []]
+    group_patterns = [re.compile(options.pop('params')) for options in group_options]
+
+    no_decay = set()
+    if cfg.get('no_decay_bias_and_norm'):
+        for module in model.modules():
+            for name, param in module.named_parameters(recurse=False):
+                if name == 'bias' or isinstance(module, NORM_LAYERS):
+                    no_decay.add(id(param))
+
+    groups = OrderedDict()
+    for name, param in model.named_parameters():
+        if any(pattern.search(name) for pattern in freeze):
+            param.requires_grad = False
+        if not param.requires_grad:
+            continue
+        group_idx = next((i for i, pattern in enumerate(group_patterns) if pattern.search(name)), None)
+        groups.setdefault((group_idx, id(param) in no_decay), []).append(param)
+
+    param_groups = []
+    for (group_idx, skip_decay), params in groups.items():
+        group = dict(params=params, **(group_options[group_idx] if group_idx is not None else {}))
+        if skip_decay:
+            group['weight_decay'] = 0.
+        param_groups.append(group)
+    return param_groups
+
+
+def flatten_parameters(params: List[nn.Parameter]) -> nn.Parameter:
+    """Move parameters and their gradients into a single contiguous buffer.
+
+    The original parameters become views of the returned parameter, so the model is unchanged while the
+    optimizer and gradient clipping only see one tensor. Gradients must be zeroed in place (`set_to_none=False`)
+    to keep the views valid.
+    """
+    if len({(p.device, p.dtype) for p in params}) > 1:
+        raise ValueError("Parameters on different devices or with different types can not be flattened.")
+    flat = nn.Parameter(torch.cat([p.detach().reshape(-1) for p in params]))
+    flat.grad = torch.zeros_like(flat)
+    sizes = [p.numel() for p in params]
+    for p, data, grad in zip(params, flat.data.split(sizes), flat.grad.split(sizes)):
+        p.data = data.view_as(p)
+        p.grad = grad.view_as(p)
+    return flat
+
+
 def get_optimizer(cfg, model_parameters):
-    """Return the optimizer object by its type."""
-    op_params = cfg.to_dict()
-    del op_params['name']
+    """Return the optimizer object by its type.
+
+    :param cfg: optimizer configs. Other than the arguments of the optimizer class, the following keys are accepted:
+        - foreach (default: true): use the multi-tensor implementation if the optimizer supports it
+        - fused: use the fused implementation (CUDA only)
+        - no_decay_bias_and_norm: do not apply weight decay to biases and weights of normalization layers
+        - freeze: list of regular expressions. Matched parameters are frozen.
+        - param_groups: list of parameter groups, each with a regular expression `params` to match parameter names
+          and the options to override (eg. `lr`, `weight_decay`)
+        - flatten: keep parameters and gradients of each group in one contiguous buffer
+    :param model_parameters: a module or an iterable of parameters. Parameter groups and freezing require a module.
+    """
+    op_params = {key: val for key, val in cfg.to_dict().items() if key not in OPTIMIZER_OPTIONS}
 
     optimizer_cls = {
         'sgd': torch.optim.SGD,
         'adam': torch.optim.Adam,
+        'adamw': torch.optim.AdamW,
         'adagrad': torch.optim.Adagrad,
         'adadelta': torch.optim.Adadelta
     }
@@ -42,7 +115,23 @@ def get_optimizer(cfg, model_parameters):
         module_name, class_name = cfg.name.rsplit('.', 1)
         i = importlib.import_module(module_name)
         optimizer = getattr(i, class_name)
-    return optimizer(model_parameters, **op_params)
+
+    arguments = inspect.signature(optimizer).parameters
+    if cfg.get('fused') and 'fused' in arguments:
+        op_params['fused'] = True
+    elif 'foreach' in arguments:
+        op_params['foreach'] = cfg.get('foreach', True)
+
+    if isinstance(model_parameters, nn.Module):
+        param_groups = get_param_groups(cfg, model_parameters)
+    else:
+        param_groups = [dict(params=[p for p in model_parameters if p.requires_grad])]
+
+    if cfg.get('flatten'):
+        for group in param_groups:
+            group['params'] = [flatten_parameters(group['params'])]
+
+    return optimizer(param_groups, **op_params)
 
 
 def get_lr_scheduler(cfg, optimizer):
@@ -89,6 +178,11 @@ def get_activation_fn(fn):
         raise ValueError("%s is not a valid activation function" % fn)
 
 
+def is_out_of_memory(e: Exception) -> bool:
+    """Whether an exception is raised because the device runs out of memory"""
+    return isinstance(e, RuntimeError) and "out of memory" in str(e)
+
+
 class MultiLinear(nn.Module):
     def __init__(
             self,
@@ -184,17 +278,93 @@ class RNN(nn.Module):
             return c, h
 
 
-class ExponentialMovingAverage(nn.Module):
-    def __init__(self, mu):
-        super().__init__()
-        self.mu = mu
-        self.shadow = {}
+def _foreach_lerp_(tensors: List[torch.Tensor], ends: List[torch.Tensor], weight: float):
+    """In-place tensors += weight * (ends - tensors) over lists of tensors"""
+    if hasattr(torch, "_foreach_lerp_"):
+        torch._foreach_lerp_(tensors, ends, weight)
+    else:
+        torch._foreach_mul_(tensors, 1. - weight)
+        torch._foreach_add_(tensors, ends, alpha=weight)
 
-    def register(self, name, val):
-        self.shadow[name] = val.clone()
 
-    def forward(self, name, x):
-        assert name in self.shadow
-        new_average = (1.0 - self.mu) * x + self.mu * self.shadow[name]
-        self.shadow[name] = new_average.clone()
-        return new_average
\ No newline at end of file
+def _foreach_copy_(tensors: List[torch.Tensor], sources: List[torch.Tensor]):
+    if hasattr(torch, "_foreach_copy_"):
+        torch._foreach_copy_(tensors, sources)
+    else:
+        for t, s in zip(tensors, sources):
+            t.copy_(s)
+
+
+class ExponentialMovingAverage:
+    """Exponential moving average of trainable parameters.
+
+    Shadow weights are stored in one flat buffer per (device, dtype) and updated in place with
+    multi-tensor ops. The live weights are never modified except when explicitly swapped.
+
+    :param parameters: model parameters. Only parameters that require grad are tracked.
+    :param decay: decay rate of the average
+    :param update_every: number of calls to `update` between two actual updates. The decay is compounded
+        accordingly so that the averaging horizon does not depend on this value.
+    """
+
+    def __init__(self, parameters, decay: float, update_every: int = 1):
+        self.decay = decay
+        self.update_every = update_every or 1
+        self.num_updates = 0
+
+        groups = OrderedDict()
+        for p in parameters:
+            if p.requires_grad:
+                groups.setdefault((p.device, p.dtype), []).append(p)
+
+        self._params = []
+        self._shadows = []
+        self._flat_shadows = []
+        for params in groups.values():
+            flat = torch.cat([p.detach().reshape(-1) for p in params])
+            self._params.append(params)
+            self._flat_shadows.append(flat)
+            self._shadows.append([v.view_as(p) for v, p in zip(flat.split([p.numel() for p in params]), params)])
+        self._flat_backups = None
+
+    @torch.no_grad()
+    def update(self):
+        self.num_updates += 1
+        if self.num_updates % self.update_every != 0:
+            return
+        weight = 1. - self.decay ** self.update_every
+        for params, shadows in zip(self._params, self._shadows):
+            _foreach_lerp_(shadows, params, weight)
+
+    @torch.no_grad()
+    def swap(self):
+        """Exchange live and shadow weights in place. Calling it twice restores the original state."""
+        if self._flat_backups is None:
+            self._flat_backups = [torch.empty_like(flat) for flat in self._flat_shadows]
+        for params, shadows, flat, backup in zip(
+                self._params, self._shadows, self._flat_shadows, self._flat_backups):
+            backup.copy_(flat)
+            _foreach_copy_(shadows, params)
+            _foreach_copy_(params, [v.view_as(p) for v, p in zip(backup.split([p.numel() for p in params]), params)])
+
+    @contextmanager
+    def average_parameters(self):
+        """Use the averaged weights inside the context"""
+        self.swap()
+        try:
+            yield
+        finally:
+            self.swap()
+
+    def state_dict(self):
+        return dict(
+            decay=self.decay,
+            update_every=self.update_every,
+            num_updates=self.num_updates,
+            shadows=[flat.cpu() for flat in self._flat_shadows])
+
+    @torch.no_grad()
+    def load_state_dict(self, state_dict):
+        self.num_updates = state_dict['num_updates']
+        for flat, saved in zip(self._flat_shadows, state_dict['shadows']):
+            flat.copy_(saved)
@@ -0,0 +1,72 @@
+"""Tensorboard writer running on the background writer thread"""
+import time
+from typing import Dict, Tuple
+
+import torch
+from torch.utils.tensorboard import SummaryWriter
+
+from dlex.utils.logging import background_writer
+
+
+def _detach(val):
+    return val.detach() if isinstance(val, torch.Tensor) else val
+
+
+class AsyncSummaryWriter:
+    """Same interface as `SummaryWriter`. Calls are queued and executed on the background writer thread, which
+    flushes the event file at regular intervals. Tensors are converted there, so adding a scalar on the GPU does not
+    wait for the device.
+
+    Scalars added with `throttle=True` (eg. per-step losses) are rate limited: at most one value per tag is written
+    every `scalar_interval` seconds. The last value of each tag is always written when the writer is closed.
+
+    :param log_dir:
+    :param scalar_interval: minimum number of seconds between two throttled values of a tag
+    """
+
+    def __init__(self, log_dir: str = None, scalar_interval: float = 1., **kwargs):
+        self.scalar_interval = scalar_interval
+        self.writer = SummaryWriter(log_dir, **kwargs)
+        self._last_scalar_time: Dict[str, float] = {}
+        self._skipped_scalars: Dict[str, Tuple] = {}
+        background_writer.add_flushable(self.writer)
+
+    def add_scalar(self, tag, scalar_value, global_step=None, walltime=None, throttle: bool = False):
+        walltime = walltime or time.time()
+        if throttle and self.scalar_interval:
+            if walltime - self._last_scalar_time.get(tag, -self.scalar_interval) < self.scalar_interval:
+                self._skipped_scalars[tag] = (_detach(scalar_value), global_step, walltime)
+                return
+            self._last_scalar_time[tag] = walltime
+        self._skipped_scalars.pop(tag, None)
+        background_writer.submit(self._add_scalar, tag, _detach(scalar_value), global_step, walltime)
+
+    def _add_scalar(self, tag, scalar_value, global_step, walltime):
+        if isinstance(scalar_value, torch.Tensor):
+            scalar_value = scalar_value.item()
+        self.writer.add_scalar(tag, scalar_value, global_step, walltime)
+
+    def __getattr__(self, name):
+        method = getattr(self.writer, name)
+        if not name.startswith("add_"):
+            return method
+
+        def _submit(*args, **kwargs):
+            args = [_detach(arg) for arg in args]
+            kwargs = {key: _detach(val) for key, val in kwargs.items()}
+            background_writer.submit(method, *args, **kwargs)
+        return _submit
+
+    def flush(self):
+        background_writer.flush()
+
+    def close(self):
+        for tag, (scalar_value, global_step, walltime) in self._skipped_scalars.items():
+            background_writer.submit(self._add_scalar, tag, scalar_value, global_step, walltime)
+        self._skipped_scalars.clear()
+        background_writer.submit(self._close)
+        background_writer.flush()
+
+    def _close(self):
+        background_writer.remove_flushable(self.writer)
+        self.writer.close()
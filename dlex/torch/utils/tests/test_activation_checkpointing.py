@@ -0,0 +1,56 @@
+import copy
+
+import torch
+import torch.nn as nn
+
+from dlex.torch.models.attention.encoder import EncoderRNN
+from dlex.torch.utils.activation_checkpointing import enable_activation_checkpointing, \
+    get_activation_memory_saved, CheckpointedBlock
+from dlex.torch.utils.model_utils import MultiLinear
+
+
+def _grads(model, loss_fn):
+    model.zero_grad()
+    loss_fn(model).backward()
+    return [p.grad.clone() for p in model.parameters()]
+
+
+def test_multi_linear():
+    torch.manual_seed(0)
+    model = MultiLinear([4, 8, 8, 2], dropout=0.5)
+    checkpointed = copy.deepcopy(model)
+    modules = enable_activation_checkpointing(checkpointed, dict(every=2))
+    assert len(modules) == 2
+    assert checkpointed.state_dict().keys() == model.state_dict().keys()
+
+    X = torch.randn(3, 4)
+    torch.manual_seed(1)
+    expected = _grads(model, lambda m: m(X).sum())
+    torch.manual_seed(1)
+    actual = _grads(checkpointed, lambda m: m(X).sum())
+    for g1, g2 in zip(expected, actual):
+        assert torch.allclose(g1, g2)
+    assert get_activation_memory_saved(checkpointed) > 0
+
+
+def test_encoder_rnn():
+    torch.manual_seed(0)
+    model = EncoderRNN(3, "lstm", True, 2, [2, 1], 8, 4, 0.)
+    checkpointed = copy.deepcopy(model)
+    assert len(enable_activation_checkpointing(checkpointed, dict(blocks=["rnn"]))) == 2
+
+    X = torch.randn(2, 6, 3)
+    loss_fn = lambda m: m(X, [6, 4]).encoder_outputs.sum()
+    for g1, g2 in zip(_grads(model, loss_fn), _grads(checkpointed, loss_fn)):
+        assert torch.allclose(g1, g2, atol=1e-6)
+
+
+def test_transformer():
+    model = nn.Transformer(d_model=8, nhead=2, num_encoder_layers=2, num_decoder_layers=1, dim_feedforward=16)
+    modules = enable_activation_checkpointing(model, True)
+    assert len(modules) == 3
+    assert all(isinstance(module, CheckpointedBlock) for module in modules)
+    assert not enable_activation_checkpointing(model, dict(blocks=["linear"]))
+
+    model(torch.randn(5, 2, 8), torch.randn(4, 2, 8)).sum().backward()
+    assert all(p.grad is not None for p in model.parameters())
@@ -0,0 +1,72 @@
+import os
+from types import SimpleNamespace
+
+import torch
+
+from dlex.configs import AttrDict
+
+
+class _Dataset:
+    def __init__(self, num_samples: int):
+        self.data = [dict(X=torch.randn(i % 7 + 1)) for i in range(num_samples)]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, i):
+        return self.data[i]
+
+    def collate_fn(self, batch):
+        return torch.nn.utils.rnn.pad_sequence([sample['X'] for sample in batch], batch_first=True)
+
+
+class _Model:
+    """Model wrapper running out of memory on batches of more than 8 samples"""
+
+    def __init__(self):
+        torch.manual_seed(0)
+        self.model = torch.nn.Linear(7, 1)
+        self.optimizers = [torch.optim.Adam(self.model.parameters(), lr=0.1)]
+        self.ema = None
+        self.gpus = []
+        self.params = SimpleNamespace(model=AttrDict(name="linear"), dataset=AttrDict(name="sequences"))
+        self.batch_sizes = []
+        self.widths = []
+
+    def training_step(self, batch):
+        self.batch_sizes.append(len(batch))
+        self.widths.append(batch.shape[1])
+        if len(batch) > 8:
+            raise RuntimeError("CUDA out of memory.")
+        X = torch.nn.functional.pad(batch, (0, 7 - batch.shape[1]))
+        self.optimizers[0].zero_grad()
+        self.model(X).sum().backward()
+        self.optimizers[0].step()
+
+    def reset_counter(self):
+        pass
+
+
+def test_find_batch_size(tmpdir, monkeypatch):
+    from dlex.torch.utils.batch_size import find_batch_size
+    monkeypatch.setenv("DLEX_TMP_PATH", str(tmpdir))
+    model = _Model()
+    model_state = {key: val.clone() for key, val in model.model.state_dict().items()}
+
+    batch_size = find_batch_size(model, _Dataset(20), num_steps=1)
+    assert batch_size in [1, 2, 4, 8]
+    assert sorted(set(model.batch_sizes)) == [1, 2, 4, 8, 16]
+    # the longest samples are used
+    assert model.batch_sizes[0] == 1 and model.widths[0] == 7
+    # model and optimizer states are restored
+    for key, val in model.model.state_dict().items():
+        assert torch.equal(val, model_state[key])
+    assert not model.optimizers[0].state_dict()['state']
+    assert os.listdir(os.path.join(str(tmpdir), "dlex")) == ["batch_size_cache.json"]
+
+    # the cached size is returned without searching
+    model.batch_sizes = []
+    assert find_batch_size(model, _Dataset(20)) == batch_size
+    assert model.batch_sizes == []
+    assert find_batch_size(model, _Dataset(20), max_batch_size=4, num_steps=1, use_cache=False) in [1, 2, 4]
+    assert sorted(set(model.batch_sizes)) == [1, 2, 4]
@@ -0,0 +1,52 @@
+import os
+
+import torch
+
+
+def test_checkpoint_writer(tmpdir):
+    from dlex.torch.utils.checkpoint import CheckpointWriter
+    writer = CheckpointWriter(keep_last=2)
+    weight = torch.zeros(3)
+    for i in range(4):
+        weight.fill_(i)
+        writer.save(dict(step=i, model=dict(weight=weight)), os.path.join(tmpdir, f"epoch-{i}.pt"))
+        # the snapshot is taken synchronously, later updates don't leak into the file
+        weight.fill_(-1)
+    writer.save(dict(step=3), os.path.join(tmpdir, "best.pt"), protected=True)
+    writer.close()
+
+    assert sorted(os.listdir(tmpdir)) == ["best.pt", "epoch-2.pt", "epoch-3.pt"]
+    state = torch.load(os.path.join(tmpdir, "epoch-3.pt"))
+    assert state['step'] == 3
+    assert torch.equal(state['model']['weight'], torch.full((3,), 3.))
+    assert writer.num_writes == 5
+
+
+def test_load_checkpoint_file(tmpdir):
+    from dlex.torch.utils.checkpoint import load_checkpoint_file
+    file_name = os.path.join(tmpdir, "latest.pt")
+    torch.save(dict(model=dict(weight=torch.ones(2)), optimizers=[dict(state=torch.zeros(2))]), file_name)
+
+    state = load_checkpoint_file(file_name, ['model', 'ema'])
+    assert list(state.keys()) == ['model']
+    assert torch.equal(state['model']['weight'], torch.ones(2))
+    assert 'optimizers' in load_checkpoint_file(file_name)
+
+
+def test_checkpoint_writer_error(tmpdir):
+    import pytest
+    from dlex.torch.utils.checkpoint import CheckpointWriter
+    writer = CheckpointWriter()
+    # the parent of the checkpoint is a file
+    open(os.path.join(tmpdir, "file"), "w").close()
+    writer.save(dict(step=0), os.path.join(tmpdir, "file", "latest.pt"))
+    with pytest.raises(OSError):
+        writer.wait()
+    # the error is raised once
+    writer.wait()
+
+    writer.close()
+    assert writer._executor is None
+    writer.save(dict(step=1), os.path.join(tmpdir, "latest.pt"))
+    assert torch.load(os.path.join(tmpdir, "latest.pt"))['step'] == 1
+    assert not os.path.exists(os.path.join(tmpdir, "latest.pt.tmp"))
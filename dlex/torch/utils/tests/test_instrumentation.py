@@ -0,0 +1,51 @@
+import json
+import os
+
+
+def test_step_timer(tmpdir):
+    from dlex.torch.utils.instrumentation import StepTimer
+    from dlex.utils.logging import background_writer
+    log_path = os.path.join(tmpdir, "timing.jsonl")
+    timer = StepTimer(log_path=log_path, aggregate_every=2)
+    for step, batch in enumerate(timer.iterate(range(5))):
+        with timer.time("forward"):
+            pass
+        timer.step(num_samples=10, num_tokens=20, global_step=step)
+    timer.flush(5)
+    background_writer.flush()
+
+    with open(log_path) as f:
+        records = [json.loads(line) for line in f]
+    assert [r['num_steps'] for r in records] == [2, 2, 1]
+    assert set(records[0]['time']) == {"data", "forward"}
+    assert records[0]['samples_per_sec'] > 0 and records[0]['tokens_per_sec'] == 2 * records[0]['samples_per_sec']
+
+
+def test_step_timer_disabled():
+    from dlex.torch.utils.instrumentation import StepTimer
+    timer = StepTimer(enabled=False)
+    with timer.time("forward"):
+        pass
+    timer.step(10)
+    assert timer.flush() is None
+
+
+def test_profiler(tmpdir):
+    import torch
+    from dlex.torch.utils.instrumentation import get_profiler
+    output_dir = os.path.join(tmpdir, "profile")
+    cfg = dict(wait=1, warmup=1, active=2, activities=["cpu"])
+    with get_profiler(cfg, output_dir, "train") as profiler:
+        for _ in range(5):
+            torch.ones(16, 16) @ torch.ones(16, 16)
+            profiler.step()
+    assert sorted(os.listdir(output_dir)) == ["train_4.json", "train_4.txt"]
+    with open(os.path.join(output_dir, "train_4.json")) as f:
+        assert json.load(f)['traceEvents']
+
+
+def test_profiler_unknown_activity(tmpdir):
+    import pytest
+    from dlex.torch.utils.instrumentation import get_profiler
+    with pytest.raises(ValueError, match="cpu, .*cuda"):
+        get_profiler(dict(activities=["cpu", "gpu"]), str(tmpdir), "train")
@@ -0,0 +1,82 @@
+import torch
+
+
+def test_exponential_moving_average():
+    from dlex.torch.utils.model_utils import ExponentialMovingAverage
+    model = torch.nn.Linear(3, 2)
+    ema = ExponentialMovingAverage(model.parameters(), 0.5)
+    initial = [p.detach().clone() for p in model.parameters()]
+
+    with torch.no_grad():
+        for p in model.parameters():
+            p.add_(2.)
+    ema.update()
+
+    # live weights are left untouched
+    for p, p0 in zip(model.parameters(), initial):
+        assert torch.allclose(p, p0 + 2.)
+
+    with ema.average_parameters():
+        for p, p0 in zip(model.parameters(), initial):
+            assert torch.allclose(p, p0 + 1.)
+    for p, p0 in zip(model.parameters(), initial):
+        assert torch.allclose(p, p0 + 2.)
+
+    state = ema.state_dict()
+    other = ExponentialMovingAverage(torch.nn.Linear(3, 2).parameters(), 0.5)
+    other.load_state_dict(state)
+    assert all(torch.equal(a, b) for a, b in zip(other.state_dict()['shadows'], state['shadows']))
+
+
+def test_exponential_moving_average_update_every():
+    from dlex.torch.utils.model_utils import ExponentialMovingAverage
+    model = torch.nn.Linear(1, 1, bias=False)
+    with torch.no_grad():
+        model.weight.fill_(0.)
+    ema = ExponentialMovingAverage(model.parameters(), 0.5, update_every=2)
+    with torch.no_grad():
+        model.weight.fill_(1.)
+    ema.update()
+    assert ema.state_dict()['shadows'][0].item() == 0.
+    ema.update()
+    assert ema.state_dict()['shadows'][0].item() == 0.75
+
+
+def test_get_optimizer_param_groups():
+    from dlex.configs import AttrDict
+    from dlex.torch.utils.model_utils import get_optimizer
+    model = torch.nn.Sequential(torch.nn.Embedding(10, 4), torch.nn.Linear(4, 4), torch.nn.LayerNorm(4))
+    optimizer = get_optimizer(AttrDict(
+        name="adam", lr=0.1, weight_decay=0.01,
+        no_decay_bias_and_norm=True,
+        freeze=[r"^2\.bias$"],
+        param_groups=[dict(params=r"^0\.", lr=0.01)]), model)
+
+    assert not model[2].bias.requires_grad
+    group = next(g for g in optimizer.param_groups if g['params'][0] is model[0].weight)
+    assert group['lr'] == 0.01 and group['weight_decay'] == 0.01
+    assert sum(len(g['params']) for g in optimizer.param_groups) == 4
+    no_decay = [p for g in optimizer.param_groups if g['weight_decay'] == 0. for p in g['params']]
+    assert {id(p) for p in no_decay} == {id(model[1].bias), id(model[2].weight)}
+    assert all(g['foreach'] for g in optimizer.param_groups)
+
+
+def test_get_optimizer_flatten():
+    from dlex.configs import AttrDict
+    from dlex.torch.utils.model_utils import get_optimizer
+
+    def train(flatten):
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Linear(4, 1))
+        optimizer = get_optimizer(AttrDict(name="sgd", lr=0.1, flatten=flatten), model)
+        for _ in range(3):
+            optimizer.zero_grad(set_to_none=not flatten)
+            model(torch.ones(2, 3)).sum().backward()
+            optimizer.step()
+        return model, optimizer
+
+    model, optimizer = train(True)
+    assert len(optimizer.param_groups[0]['params']) == 1
+    reference, _ = train(False)
+    for p, q in zip(model.parameters(), reference.parameters()):
+        assert torch.allclose(p, q)
@@ -0,0 +1,16 @@
+import torch
+
+
+def test_async_summary_writer(tmpdir):
+    from dlex.torch.utils.summary import AsyncSummaryWriter
+
+    writer = AsyncSummaryWriter(str(tmpdir), scalar_interval=10)
+    scalars = []
+    writer.writer.add_scalar = lambda tag, val, step, walltime: scalars.append((tag, val, step))
+    for step in range(5):
+        writer.add_scalar("loss", torch.tensor(float(step)), step, walltime=100 + step, throttle=True)
+        writer.add_scalar("lr", 0.1, step, walltime=100 + step)
+    writer.close()
+
+    assert [s for s in scalars if s[0] == "loss"] == [("loss", 0., 0), ("loss", 4., 4)]
+    assert len([s for s in scalars if s[0] == "lr"]) == 5
@@ -2,46 +2,76 @@ import curses
 import logging
 import multiprocessing
 import os
+import queue
 import shutil
 import sys
 import threading
+import time
 import traceback
 from collections import defaultdict
 from datetime import datetime
 from functools import partial
-from multiprocessing import Queue
-from time import sleep
-from typing import Dict, Tuple, List, Union
+from typing import Dict, Tuple, List, Union, Iterator
 
 from dlex.datatypes import ModelReport
 from dlex.utils import logger, table2str, get_unused_gpus
 from dlex.utils.curses import CursesManager
+from dlex.utils.early_termination import SuccessiveHalving
+from dlex.utils.experiment_store import ExperimentStore
+from dlex.utils.logging import background_writer
+from dlex.utils.run_registry import RunRegistry, get_run_key, get_default_code_version, RUNNING
+from dlex.utils.scheduler import Scheduler, Job, Resources, Allocation, get_available_cores
 from dlex.utils.tmux import TmuxManager
 
-from .configs import Configs, Environment
+from .configs import Configs, Environment, ModuleConfigs, Params
 
 LOG_WINDOWS_HEIGHT = 10
 
-manager = multiprocessing.Manager()
+# created by `main`, so that importing the module (or running with --help) does not start a server process
+manager = None
 all_reports: Dict[int, Union[ModelReport, None]] = {}
-report_queue = manager.Queue()
+report_queue = None
+report_lock = threading.Lock()
+reports_changed = threading.Event()
 short_report = None
 long_report = None
-
-
-def launch_training(params, training_idx):
-    backend = configs.backend
+scheduler: Scheduler = None
+early_terminations: Dict[str, SuccessiveHalving] = {}
+registry = RunRegistry(ModuleConfigs.get_registry_path())
+# written by the launcher only, with the reports received from the training processes
+experiment_store = ExperimentStore(ModuleConfigs.get_experiment_store_path())
+stored_reports = set()  # indices of the reports changed since they were last written to the experiment store
+
+
+def launch_training(params, training_idx, allocation: Allocation = None):
+    if allocation is not None:
+        params.gpu = allocation.devices
+    try:
+        if params.run_key:
+            registry.start(params.run_key, params)
+        report = _launch_training(params, training_idx)
+        if params.run_key and report is not None:
+            registry.finish(params.run_key, report.results, report.terminated_epoch)
+        return report
+    finally:
+        # pending logs are written before the launcher receives the results
+        background_writer.flush()
+
+
+def _launch_training(params, training_idx):
+    # configs of the run, as the run may be launched by a worker process of `dlex.worker`
+    backend = params.configs.backend
 
     if backend is None:
         raise ValueError("No backend specified. Please add it in config file.")
 
     if backend == "sklearn":
         from dlex.sklearn.train import train
-        train(params, configs.args)
+        train(params, params.configs.args)
         # runpy.run_module("dlex.sklearn.train", run_name=__name__)
     elif backend == "pytorch" or backend == "torch":
         from dlex.torch import PytorchBackend
-        be = PytorchBackend(params, training_idx, report_queue)
+        be = PytorchBackend(params, training_idx, report_queue, early_terminations.get(params.env_name))
         return be.run_train()
     elif backend == "tensorflow_v1" or backend == "tf_v1":
         from dlex.tf.instance_v1 import TensorflowV1Backend
@@ -66,6 +96,94 @@ def launch_training(params, training_idx):
     #        os.system(configs.args.notify_cmd % msg)
 
 
+def check_registry(params: Params, training_idx: int, code_version) -> bool:
+    """Look up a run in the run registry. Results of finished runs are added to the report. Interrupted runs are
+    resumed from their latest checkpoint.
+
+    :return: True if the run needs to be trained
+    """
+    params.run_key = get_run_key(params, code_version)
+    record = None if configs.args.rerun else registry.get(params.run_key)
+    if record is None:
+        return True
+    if record['status'] == RUNNING:
+        if not params.train.cross_validation and os.path.exists(os.path.join(params.checkpoint_dir, "latest.pt")):
+            params.resume_tag = "latest"
+            logger.info("Run %s (%s) was interrupted and will be resumed.", training_idx, params.run_key)
+        return True
+
+    report = ModelReport(training_idx)
+    report.params = params
+    report.status = record['status']
+    report.results = record['results']
+    report.terminated_epoch = record.get('terminated_epoch')
+    report.cached = True
+    with report_lock:
+        all_reports[training_idx] = report
+        reports_changed.set()
+    logger.info(
+        "Run %s (%s) is already finished. Its results are loaded from the registry.", training_idx, params.run_key)
+    return False
+
+
+def load_shared_dataset(params: Params):
+    """Prepare and load the dataset of a run in the launcher, once for all the runs using the same dataset"""
+    if params.configs.backend not in ["pytorch", "torch"] or params.train.cross_validation:
+        return
+    from dlex.datasets.shared import shared_datasets
+
+    args = params.configs.args
+    splits = [params.train.train_set, params.train.valid_set] + list(params.test.test_sets or [])
+    try:
+        shared_datasets.load(
+            params, [split for split in splits if split],
+            prepare=not args.no_prepare, download=args.download, preprocess=args.preprocess)
+    except Exception as e:
+        logger.warning("Dataset cannot be loaded by the launcher (%s). It is loaded by each run.", str(e))
+
+
+def _iter_jobs(env: Environment, resources: Resources, code_version) -> Iterator[Job]:
+    """Jobs of the runs of an environment, created when the scheduler takes them"""
+    for idx in range(len(env.configs_list)):
+        params = env.configs_list[idx]
+        if not check_registry(params, idx, code_version):
+            continue
+        load_shared_dataset(params)
+        yield Job(
+            launch_training,
+            args=(params, idx),
+            name=f"{env.name}-{idx}",
+            resources=resources,
+            priority=env.priority,
+            max_retries=configs.args.max_retries,
+            callback=partial(update_results, env_name=env.name, training_idx=idx),
+            error_callback=_error_callback)
+
+
+def run_on_worker_pool(address: str, code_version):
+    """Run the runs on the workers of `dlex.worker` and wait for their results"""
+    from dlex.worker import WorkerClient, DONE
+
+    def _jobs():
+        for env in configs.environments:
+            if env.early_termination:
+                logger.warning("Early termination of %s is not supported on worker pools.", env.name)
+            for idx in range(len(env.configs_list)):
+                params = env.configs_list[idx]
+                if check_registry(params, idx, code_version):
+                    yield (env.name, idx), "train", params, idx
+
+    client = WorkerClient(address)
+    try:
+        for status, (env_name, idx), result in client.run(_jobs()):
+            if status == DONE:
+                update_results(result, env_name=env_name, training_idx=idx)
+            else:
+                logger.error("Run %s-%d failed: %s", env_name, idx, result)
+    finally:
+        client.close()
+
+
 def _error_callback(e: Exception):
     logger.error(str(e))
     logger.error(traceback.format_exc())
@@ -117,7 +235,26 @@ def _long_report(s):
 
 
 def write_report():
+    with report_lock:
+        return _write_report()
+
+
+def _store_reports():
+    for training_idx in sorted(stored_reports):
+        report = all_reports.get(training_idx)
+        if report is None or report.params is None or report.cached:
+            continue
+        try:
+            experiment_store.record(report)
+        except Exception as e:
+            logger.warning("Run %d cannot be written to the experiment store (%s).", training_idx, str(e))
+    stored_reports.clear()
+
+
+def _write_report():
     global short_report, long_report
+    reports_changed.clear()
+    _store_reports()
     short_report = ""
     long_report = ""
 
@@ -139,9 +276,6 @@ def write_report():
     _long_report(f"- Test: {str(configs.yaml_params.get('test'))}")
 
     for env in configs.environments:
-        for training_idx in all_reports:
-            all_reports[training_idx] = ModelReport.load(configs.log_dir, training_idx)
-
         _short_report(f"\n## {env.title or env.name}")
         metrics = _gather_metrics(all_reports)
         reduce = {name for name, vals in zip(env.variable_names, env.variable_values) if len(vals) <= 1}
@@ -204,8 +338,8 @@ def get_training_idx(v_vals):
 
 
 def _exit():
-    pool.terminate()
-    pool.join()
+    if scheduler is not None:
+        scheduler.terminate()
     if configs.args.gui:
         tmux.close_all_panes()
     sys.exit()
@@ -255,7 +389,10 @@ def _on_key_pressed(c):
 
 
 def main(scr=None, *args):
+    global manager, report_queue
     args = configs.args
+    manager = multiprocessing.Manager()
+    report_queue = manager.Queue()
     # tmux.split_window(f"tail --retry -f {configs.log_dir}/info.log")
     if scr:
         # _on_key_pressed("i")
@@ -266,46 +403,45 @@ def main(scr=None, *args):
 
     def _refresh_display():
         while True:
-            write_report()
-            sleep(5)
+            try:
+                consume_report_updates(timeout=5)
+            except (EOFError, OSError):  # manager process stopped at exit
+                return
+            if reports_changed.is_set():
+                write_report()
     _add_thread("refresh_display", _refresh_display)
 
-    if args.num_processes >= 1:
+    for env in configs.environments:
+        if env.early_termination:
+            # rung results are shared by training processes
+            early_terminations[env.name] = SuccessiveHalving.from_config(
+                env.early_termination, env.configs_list[0].train.num_epochs,
+                store=manager.dict(), lock=manager.Lock())
+
+    code_version = get_default_code_version()
+    if args.worker_pool is not None:
+        run_on_worker_pool(args.worker_pool, code_version)
+    elif args.num_processes >= 1:
+        global scheduler
         gpu = args.gpu or get_unused_gpus(args)
-        results = []
-        callbacks = []
-        process_args = []
-
-        for env in configs.environments:
-            for idx, (variable_values, params) in enumerate(zip(env.variables_list, env.configs_list)):
-                params.gpu = [gpu[idx % len(gpu)]]
-                callback = partial(update_results, env_name=env.name, training_idx=idx)
-                callbacks.append(callback)
-                process_args.append((env.name, params, idx))
-                all_reports[idx] = None
-
-        for pargs, callback in zip(process_args, callbacks):
-            env_name, params, idx = pargs
-            process_names.put(f"{env_name}-{idx}")
-            r = pool.apply_async(
-                launch_training,
-                args=(params, idx),
-                callback=callback,
-                error_callback=_error_callback)
-            # sleep(10)
-            results.append(r)
-
-        # pool.close()
-
-        def _update_results():
-            while not all(res.ready() for res in results):
-                report = report_queue.get()
-                env_name, _, training_idx = process_args[report.training_idx]
-                update_results(report, env_name, training_idx)
-                refresh_display()
-        _add_thread("update_results", _update_results)
+        scheduler = Scheduler(max_jobs=args.num_processes, devices=gpu)
+        default_cores = max(len(get_available_cores()) // args.num_processes, 1)
+
+        # runs of environments with higher priority are taken first
+        for env in sorted(configs.environments, key=lambda e: -e.priority):
+            resources = Resources(cores=default_cores, devices=1 if gpu else 0)
+            for key, val in (env.resources or {}).items():
+                setattr(resources, key, val)
+            scheduler.submit_all(_iter_jobs(env, resources, code_version))
+
+        _add_thread("scheduler", scheduler.run)
+        if not scr:
+            try:
+                threads["scheduler"].join()
+            except KeyboardInterrupt:
+                _exit()
 
-        while True:
+        while scr:
             try:
                 c = scr.getkey()
                 if c:
@@ -316,20 +452,21 @@ def main(scr=None, *args):
                 pass
             # if c == "m":
             #     build_menu(tmux, scr)
-
-        # for r in results:
-        #     r.get()
-        # pool.join()
     else:
         gpu = args.gpu or get_unused_gpus(args)
         training_idx = 0
         for env in configs.environments:
             for variable_values, params in zip(env.variables_list, env.configs_list):
                 training_idx += 1
+                if not check_registry(params, training_idx, code_version):
+                    continue
+                load_shared_dataset(params)
                 params.gpu = gpu
                 launch_training(params, training_idx)
+                consume_report_updates(timeout=0)
                 write_report()
 
+    consume_report_updates(timeout=0)
     _, report = write_report()
 
     if args.notify:
@@ -375,11 +512,33 @@ def refresh_display():
         curses.refresh(clear=True)
 
 
+def consume_report_updates(timeout: float):
+    """Apply the report updates sent by training processes during `timeout` seconds (or those already received)"""
+    deadline = time.time() + timeout
+    while True:
+        # the lock is not held while waiting, so that reports can be written meanwhile
+        try:
+            training_idx, update = report_queue.get(timeout=min(max(deadline - time.time(), 0), 0.5))
+        except queue.Empty:
+            update = None
+        else:
+            with report_lock:
+                if all_reports.get(training_idx) is None:
+                    all_reports[training_idx] = ModelReport(training_idx)
+                all_reports[training_idx].apply_update(update)
+                stored_reports.add(training_idx)
+                reports_changed.set()
+        if update is None and time.time() >= deadline:
+            return
+
+
 def update_results(report: ModelReport, env_name: str, training_idx: int):
     logger.debug("Results updated (env: %s, process id: %d)", env_name, training_idx)
     logger.debug(report.current_test_results)
-    # all_reports[env_name][training_idx] = report
-    write_report()
+    with report_lock:
+        all_reports[training_idx] = report
+        stored_reports.add(training_idx)
+        reports_changed.set()
 
 
 def signal_handler(signal, frame):
@@ -393,14 +552,6 @@ if __name__ == "__main__":
     tmux = TmuxManager()
     curses = CursesManager()
     configs = Configs(mode="train")
-    process_names = Queue()
-    if configs.args.num_processes:
-        def initialize(names):
-            multiprocessing.current_process().name = str(names.get())
-        pool = multiprocessing.Pool(
-            processes=configs.args.num_processes,
-            initializer=initialize,
-            initargs=(process_names,))
     threads = {}
     if configs.args.gui:
         curses.wrapper(main)
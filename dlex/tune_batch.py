@@ -0,0 +1,29 @@
+"""Find the training batch size with the best throughput for each configuration"""
+from dlex.utils import logger, get_unused_gpus
+
+from .configs import Configs
+
+
+def main():
+    configs = Configs(mode="train")
+    args = configs.args
+    if configs.backend not in ["pytorch", "torch"]:
+        raise ValueError("Batch size search is only supported for the pytorch backend.")
+
+    from dlex.torch import PytorchBackend
+    from dlex.torch.utils.batch_size import find_batch_size
+
+    gpu = args.gpu or get_unused_gpus(args)
+    for env in configs.environments:
+        for variable_values, params in zip(env.variables_list, env.configs_list):
+            params.gpu = gpu
+            be = PytorchBackend(params)
+            model, datasets = be.load_model("train")
+            search_cfg = dict(params.train.batch_size_search or {})
+            search_cfg['use_cache'] = False
+            batch_size = find_batch_size(model, datasets.train_set, **search_cfg)
+            logger.info("[%s] %s: batch size = %d", env.name, str(variable_values), batch_size)
+
+
+if __name__ == "__main__":
+    main()
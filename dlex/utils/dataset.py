@@ -10,7 +10,16 @@ class Datasets:
             builder,
             train_set: str,
             valid_set: str,
-            test_sets: List[str]):
+            test_sets: List[str],
+            loaded: Dict[str, Any] = None):
+        """
+        :param backend:
+        :param builder:
+        :param train_set:
+        :param valid_set:
+        :param test_sets:
+        :param loaded: datasets already loaded, by name (eg. shared by training processes)
+        """
         self.backend = backend
         self.builder = builder  # type: dlex.datasets.DatasetBuilder
         self._train = None
@@ -19,6 +28,12 @@ class Datasets:
         self._train_set = train_set
         self._valid_set = valid_set
         self._test_sets = test_sets
+        self._loaded = loaded or {}
+
+    def _get_dataset(self, name: str):
+        if name in self._loaded:
+            return self._loaded[name]
+        return self.wrapper_fn(name)
 
     @property
     def wrapper_fn(self):
@@ -30,17 +45,17 @@ class Datasets:
     @property
     def train_set(self):
         if self._train_set and not self._train:
-            self._train = self.wrapper_fn(self._train_set)
+            self._train = self._get_dataset(self._train_set)
         return self._train
 
     @property
     def valid_set(self):
         if self._valid_set and not self._valid:
-            self._valid = self.wrapper_fn(self._valid_set)
+            self._valid = self._get_dataset(self._valid_set)
         return self._valid
 
     @property
     def test_sets(self) -> Dict[str, Any]:
         if self._test_sets and not self._tests:
-            self._tests = {ts: self.wrapper_fn(ts) for ts in self._test_sets}
+            self._tests = {ts: self._get_dataset(ts) for ts in self._test_sets}
         return self._tests
\ No newline at end of file
@@ -0,0 +1,86 @@
+"""Stop unpromising runs of a sweep early"""
+import math
+import threading
+from typing import List, Callable
+
+
+class SuccessiveHalving:
+    """Asynchronous successive halving (ASHA).
+
+    Runs are compared at a few epochs (rungs). When a run reaches a rung, it continues only if its result is among
+    the best `1 / reduction_factor` of the results recorded at this rung so far, including its own. The first runs
+    to reach a rung always continue, so decisions never wait for other runs.
+
+    :param rungs: epochs at which runs are compared
+    :param reduction_factor:
+    :param metric: metric to compare. Default: first metric of `test.metrics`
+    :param store: dictionary of rung results shared by training processes (eg. created by a `multiprocessing.Manager`)
+    :param lock: lock shared by training processes
+    """
+
+    def __init__(
+            self,
+            rungs: List[int],
+            reduction_factor: float = 3,
+            metric: str = None,
+            store: dict = None,
+            lock=None):
+        if reduction_factor <= 1:
+            raise ValueError("reduction_factor must be greater than 1")
+        self.rungs = sorted(rungs)
+        self.reduction_factor = reduction_factor
+        self.metric = metric
+        self.store = store if store is not None else {}
+        self.lock = lock or threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg: dict, num_epochs: int, store: dict = None, lock=None) -> 'SuccessiveHalving':
+        """
+        :param cfg: `early_termination` entry of an environment, with keys
+            - type: asha
+            - rungs: list of epochs. Default: `min_epochs * reduction_factor ^ k`, for all k such that the epoch is
+              lower than `num_epochs`
+            - min_epochs: first rung. Default: 1
+            - reduction_factor: Default: 3
+            - metric
+        :param num_epochs: number of training epochs
+        :param store:
+        :param lock:
+        """
+        if cfg.get('type', 'asha') not in ['asha', 'successive_halving']:
+            raise ValueError("%s is not a valid early termination type" % cfg['type'])
+        reduction_factor = cfg.get('reduction_factor', 3)
+        rungs = cfg.get('rungs')
+        if rungs is None:
+            rungs = []
+            epoch = cfg.get('min_epochs', 1)
+            while epoch < num_epochs:
+                rungs.append(int(epoch))
+                epoch *= reduction_factor
+        return cls(rungs, reduction_factor, cfg.get('metric'), store, lock)
+
+    def should_stop(
+            self,
+            training_idx: int,
+            epoch: int,
+            metric: str,
+            result: float,
+            is_better_result: Callable[[str, float, float], bool]) -> bool:
+        """Record the result of a run and decide whether it should stop
+
+        :param training_idx:
+        :param epoch: current epoch. Nothing is recorded if it is not a rung.
+        :param metric:
+        :param result:
+        :param is_better_result: function comparing two results of `metric`
+        :return: True if the run should be terminated
+        """
+        if epoch not in self.rungs:
+            return False
+        with self.lock:
+            # values of a managed dict are copies, so the rung is written back
+            rung_results = dict(self.store.get(epoch, {}))
+            rung_results[training_idx] = result
+            self.store[epoch] = rung_results
+        num_better = sum(is_better_result(metric, result, other) for other in rung_results.values())
+        return num_better >= math.ceil(len(rung_results) / self.reduction_factor)
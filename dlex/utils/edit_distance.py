@@ -0,0 +1,121 @@
+"""Edit distance between batches of sequences, with substitution, insertion and deletion counts"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Sequence
+
+import numpy as np
+
+# columns of the arrays returned by `batch_edit_distance` and `corpus_edit_distance`
+SUBSTITUTIONS, INSERTIONS, DELETIONS, REF_LENGTH = range(4)
+
+
+def _to_ids(sequences: List[Sequence], vocab: dict) -> List[List[int]]:
+    return [[vocab.setdefault(token, len(vocab)) for token in seq] for seq in sequences]
+
+
+def _pad(sequences: List[List[int]], pad_value: int) -> np.ndarray:
+    padded = np.full([len(sequences), max((len(s) for s in sequences), default=0)], pad_value, dtype=np.int64)
+    for i, seq in enumerate(sequences):
+        padded[i, :len(seq)] = seq
+    return padded
+
+
+def batch_edit_distance(preds: List[Sequence], refs: List[Sequence]) -> np.ndarray:
+    """Levenshtein alignment of each prediction with its reference.
+
+    The dynamic programming table is filled one reference position at a time for the whole padded batch. Within a
+    row, chains of insertions are resolved with a cumulative minimum, so each row is a few vectorized operations.
+    Counts are those of an optimal alignment, preferring substitutions (or matches) over deletions and insertions.
+
+    :param preds: predicted sequences (of any hashable tokens)
+    :param refs: reference sequences
+    :return: integer array of shape (batch size, 4) with numbers of substitutions, insertions and deletions, and
+        reference lengths. The edit distance is the sum of the first three columns.
+    """
+    assert len(preds) == len(refs)
+    batch_size = len(refs)
+    if batch_size == 0:
+        return np.zeros([0, 4], dtype=np.int64)
+    vocab = {}
+    preds, refs = _to_ids(preds, vocab), _to_ids(refs, vocab)
+    pred_lens = np.array([len(p) for p in preds])
+    ref_lens = np.array([len(r) for r in refs])
+    pred_ids, ref_ids = _pad(preds, -1), _pad(refs, -2)
+    num_cols = pred_ids.shape[1] + 1
+    cols = np.arange(num_cols)
+    rows = np.arange(batch_size)
+
+    # state of each cell: distance and counts of substitutions, insertions, deletions
+    dist = np.broadcast_to(cols, (batch_size, num_cols)).copy()
+    sub = np.zeros_like(dist)
+    ins = dist.copy()
+    dele = np.zeros_like(dist)
+
+    result = np.zeros([batch_size, 4], dtype=np.int64)
+    result[:, REF_LENGTH] = ref_lens
+    done = ref_lens == 0
+    result[done, INSERTIONS] = pred_lens[done]
+
+    for i in range(ref_ids.shape[1]):
+        # best of deletion (from above) and substitution or match (from the upper-left cell)
+        cost = (pred_ids != ref_ids[:, i:i + 1]).astype(np.int64)
+        diag = dist[:, :-1] + cost
+        up = dist[:, 1:] + 1
+        use_diag = diag <= up
+        t_dist = np.concatenate([dist[:, :1] + 1, np.where(use_diag, diag, up)], axis=1)
+        t_sub = np.concatenate([sub[:, :1], np.where(use_diag, sub[:, :-1] + cost, sub[:, 1:])], axis=1)
+        t_ins = np.concatenate([ins[:, :1], np.where(use_diag, ins[:, :-1], ins[:, 1:])], axis=1)
+        t_del = np.concatenate([dele[:, :1] + 1, np.where(use_diag, dele[:, :-1], dele[:, 1:] + 1)], axis=1)
+
+        # insertions (from the left): cell j comes from the cell k <= j minimizing t_dist[k] + (j - k)
+        shifted = t_dist - cols
+        running_min = np.minimum.accumulate(shifted, axis=1)
+        source = np.maximum.accumulate(np.where(shifted == running_min, cols, -1), axis=1)
+        dist = running_min + cols
+        sub = np.take_along_axis(t_sub, source, axis=1)
+        ins = np.take_along_axis(t_ins, source, axis=1) + cols - source
+        dele = np.take_along_axis(t_del, source, axis=1)
+
+        finished = ref_lens == i + 1
+        if finished.any():
+            b, j = rows[finished], pred_lens[finished]
+            result[b, SUBSTITUTIONS] = sub[b, j]
+            result[b, INSERTIONS] = ins[b, j]
+            result[b, DELETIONS] = dele[b, j]
+    return result
+
+
+def _batch_edit_distance(args):
+    return batch_edit_distance(*args)
+
+
+def corpus_edit_distance(
+        preds: List[Sequence],
+        refs: List[Sequence],
+        chunk_size: int = 1024,
+        num_workers: int = None) -> np.ndarray:
+    """Edit distance of a large number of sequence pairs.
+
+    Pairs are sorted by length to limit padding and processed in chunks, in a process pool if there is more than
+    one chunk.
+
+    :param preds:
+    :param refs:
+    :param chunk_size: number of pairs per chunk
+    :param num_workers: number of processes. Default: number of CPUs. Use 0 or 1 to run in the current process.
+    :return: same as `batch_edit_distance`, in the original order
+    """
+    order = sorted(range(len(refs)), key=lambda i: (len(refs[i]), len(preds[i])))
+    chunks = [order[start:start + chunk_size] for start in range(0, len(order), chunk_size)]
+    args = [([preds[i] for i in chunk], [refs[i] for i in chunk]) for chunk in chunks]
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    if len(chunks) > 1 and num_workers > 1:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(chunks))) as executor:
+            results = list(executor.map(_batch_edit_distance, args))
+    else:
+        results = [_batch_edit_distance(a) for a in args]
+
+    counts = np.zeros([len(refs), 4], dtype=np.int64)
+    for chunk, res in zip(chunks, results):
+        counts[chunk] = res
+    return counts
@@ -0,0 +1,226 @@
+"""Store of runs, their params, per-epoch metrics and checkpoints in a SQLite database, which can be queried across
+all the sweeps of a project (see `python -m dlex.query`)"""
+import dataclasses
+import glob
+import json
+import os
+import re
+import sqlite3
+import time
+from typing import Any, Dict, List
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    run_key TEXT,
+    config_path TEXT,
+    env_name TEXT,
+    training_idx INTEGER,
+    variables TEXT,
+    log_dir TEXT,
+    checkpoint_dir TEXT,
+    status TEXT,
+    results TEXT,
+    started_at REAL,
+    updated_at REAL,
+    UNIQUE (log_dir, env_name, training_idx)
+);
+CREATE TABLE IF NOT EXISTS params (
+    run_id INTEGER REFERENCES runs (run_id),
+    name TEXT,
+    value TEXT,
+    PRIMARY KEY (run_id, name)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER REFERENCES runs (run_id),
+    split TEXT,
+    metric TEXT,
+    epoch INTEGER,
+    value REAL,
+    PRIMARY KEY (run_id, split, metric, epoch)
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    run_id INTEGER REFERENCES runs (run_id),
+    tag TEXT,
+    path TEXT,
+    epoch INTEGER,
+    saved_at REAL,
+    PRIMARY KEY (run_id, tag)
+);
+CREATE INDEX IF NOT EXISTS runs_run_key ON runs (run_key);
+CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+CREATE INDEX IF NOT EXISTS params_name_value ON params (name, value);
+CREATE INDEX IF NOT EXISTS metrics_metric_value ON metrics (split, metric, value);
+"""
+
+
+def to_param_value(val) -> str:
+    """Text stored for a param value: strings as they are, other values in JSON"""
+    if isinstance(val, str):
+        return val
+    return json.dumps(val, sort_keys=True, default=str)
+
+
+def flatten_params(params) -> Dict[str, str]:
+    """Model, dataset, train and test configurations of a run, with nested keys joined by dots
+    (eg. `model.attention.type`)"""
+    def _flatten(prefix: str, obj, ret: dict):
+        if isinstance(obj, dict):
+            for key, val in obj.items():
+                if not str(key).startswith('_'):
+                    _flatten(f"{prefix}.{key}", val, ret)
+        else:
+            ret[prefix] = to_param_value(obj)
+        return ret
+
+    ret = {}
+    _flatten("model", params.model.to_dict(level=100) if params.model else {}, ret)
+    _flatten("dataset", params.dataset.to_dict(level=100), ret)
+    _flatten("train", dataclasses.asdict(params.train), ret)
+    _flatten("test", dataclasses.asdict(params.test), ret)
+    ret['random_seed'] = to_param_value(params.random_seed)
+    return ret
+
+
+def _to_float(val):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_epoch_metrics(report) -> List[tuple]:
+    """(split, metric, epoch, value) of the losses and evaluations of a report"""
+    rows = []
+    for epoch, loss in enumerate(report.epoch_losses or [], 1):
+        rows.append(("train", "loss", epoch, _to_float(loss)))
+    for epoch, results in (report.valid_results or {}).items():
+        for metric, val in (results or {}).items():
+            rows.append(("valid", metric, epoch, _to_float(val)))
+    for epoch, test_results in (report.test_results or {}).items():
+        for split, results in (test_results or {}).items():
+            for metric, val in (results or {}).items():
+                rows.append((split, metric, epoch, _to_float(val)))
+    return [row for row in rows if row[3] is not None]
+
+
+def _get_checkpoints(checkpoint_dir: str) -> List[tuple]:
+    """(tag, path, epoch, saved_at) of the checkpoint files of a run"""
+    rows = []
+    for path in glob.glob(os.path.join(checkpoint_dir, "*.pt")):
+        tag = os.path.splitext(os.path.basename(path))[0]
+        match = re.fullmatch(r"epoch-(\d+)", tag)
+        try:
+            rows.append((tag, path, int(match.group(1)) if match else None, os.path.getmtime(path)))
+        except OSError:  # removed meanwhile
+            pass
+    return rows
+
+
+class ExperimentStore:
+    """Runs recorded in a SQLite database. The database is opened at the first access.
+
+    Runs are written by the launcher, which receives the reports of all its training processes, so that processes of
+    a sweep do not contend for the database.
+
+    :param path: path of the database file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # the connection is used by the threads of the launcher, one at a time
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def record(self, report) -> int:
+        """Insert or update a run from its report
+
+        :return: id of the run
+        """
+        params = report.params
+        now = time.time()
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT run_id FROM runs WHERE log_dir = ? AND env_name = ? AND training_idx = ?",
+                (params.log_dir, params.env_name, report.training_idx)).fetchone()
+            if row is None:
+                run_id = self.conn.execute(
+                    "INSERT INTO runs (run_key, config_path, env_name, training_idx, variables, log_dir, "
+                    "checkpoint_dir, started_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (params.run_key, params.configs.config_path, params.env_name, report.training_idx,
+                     json.dumps(dict(params._variables or {}), default=str), params.log_dir,
+                     params.checkpoint_dir, now)).lastrowid
+                self.conn.executemany(
+                    "INSERT INTO params (run_id, name, value) VALUES (?, ?, ?)",
+                    [(run_id, name, val) for name, val in flatten_params(params).items()])
+            else:
+                run_id = row[0]
+
+            self.conn.execute(
+                "UPDATE runs SET status = ?, results = ?, updated_at = ? WHERE run_id = ?",
+                (report.status or "running", json.dumps(report.results, default=_to_float), now, run_id))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metrics (run_id, split, metric, epoch, value) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, *row) for row in _get_epoch_metrics(report)])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO checkpoints (run_id, tag, path, epoch, saved_at) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, *row) for row in _get_checkpoints(params.checkpoint_dir)])
+        return run_id
+
+    def query(
+            self,
+            split: str,
+            metric: str,
+            where: Dict[str, Any] = None,
+            lowest: bool = False,
+            limit: int = 10,
+            since: float = None,
+            config_name: str = None) -> List[dict]:
+        """Best runs, ranked by the best value of a metric over their epochs
+
+        :param split: train, valid or the name of a test set
+        :param metric:
+        :param where: values of params (eg. `{"model.attention.type": "bahdanau"}`)
+        :param lowest: rank by the lowest value (eg. for a loss)
+        :param limit: maximum number of runs
+        :param since: only runs started after this timestamp
+        :param config_name: only runs of a configuration file (name without extension)
+        :return: runs with their best value and the epoch at which it was reached
+        """
+        # with MIN / MAX, SQLite returns `epoch` of the row holding the extremum
+        sql = \
+            f"SELECT runs.*, {'MIN' if lowest else 'MAX'}(metrics.value) AS value, metrics.epoch AS epoch " \
+            "FROM runs JOIN metrics ON metrics.run_id = runs.run_id " \
+            "WHERE metrics.split = ? AND metrics.metric = ?"
+        args = [split, metric]
+        for name, val in (where or {}).items():
+            sql += " AND runs.run_id IN (SELECT run_id FROM params WHERE name = ? AND value = ?)"
+            args += [name, to_param_value(val)]
+        if since is not None:
+            sql += " AND runs.started_at >= ?"
+            args.append(since)
+        if config_name is not None:
+            sql += " AND (runs.config_path LIKE ? OR runs.config_path LIKE ?)"
+            args += [f"%/{config_name}.%", f"{config_name}.%"]
+        sql += f" GROUP BY runs.run_id ORDER BY value {'ASC' if lowest else 'DESC'} LIMIT ?"
+        args.append(limit)
+
+        cursor = self.conn.execute(sql, args)
+        names = [col[0] for col in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def get_params(self, run_id: int) -> Dict[str, str]:
+        return dict(self.conn.execute("SELECT name, value FROM params WHERE run_id = ?", (run_id,)).fetchall())
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,11 +1,14 @@
+import atexit
 import json
 import logging
+import multiprocessing.util
 import os
+import queue
 import re
-from typing import List
-
-import numpy as np
-from tqdm import tqdm
+import threading
+import time
+import traceback
+from typing import List, Callable
 
 
 import warnings
@@ -35,6 +38,8 @@ class TqdmLoggingHandler(logging.Handler):
             if record.processName != "MainProcess":
                 s += f"({record.processName}) "
             s += msg
+            # imported here to keep `import dlex` fast
+            from tqdm import tqdm
             tqdm.write(s)
             self.flush()
         except (KeyboardInterrupt, SystemExit):
@@ -43,7 +48,17 @@ class TqdmLoggingHandler(logging.Handler):
             self.handleError(record)
 
 
-class DebugFileHandler(logging.FileHandler):
+class BufferedFileHandler(logging.FileHandler):
+    """File handler whose stream is flushed by the background writer rather than after each record"""
+
+    def flush(self):
+        pass
+
+    def flush_buffer(self):
+        logging.FileHandler.flush(self)
+
+
+class DebugFileHandler(BufferedFileHandler):
     def __init__(self, filename, mode='a', encoding=None, delay=False):
         logging.FileHandler.__init__(self, filename, mode, encoding, delay)
 
@@ -53,7 +68,7 @@ class DebugFileHandler(logging.FileHandler):
         logging.FileHandler.emit(self, record)
 
 
-class ErrorFileHandler(logging.FileHandler):
+class ErrorFileHandler(BufferedFileHandler):
     def __init__(self, filename, mode='a', encoding=None, delay=False):
         logging.FileHandler.__init__(self, filename, mode, encoding, delay)
 
@@ -63,6 +78,147 @@ class ErrorFileHandler(logging.FileHandler):
         logging.FileHandler.emit(self, record)
 
 
+_STOP = object()
+
+
+class BackgroundWriter:
+    """Thread writing log records and summary events in batches, so that the training thread only enqueues them.
+
+    Items queued since the previous iteration are processed together and outputs (log files, tensorboard writers)
+    are flushed every `flush_interval` seconds, or immediately after an error record. The thread is started at the
+    first item, and again in forked processes (eg. workers of a multiprocessing pool), where pending items are
+    written before exiting.
+
+    :param flush_interval: maximum number of seconds between two flushes
+    """
+
+    def __init__(self, flush_interval: float = 1.):
+        self.flush_interval = flush_interval
+        self.handlers: List[logging.Handler] = []
+        self._flushables = []
+        self._queue = queue.SimpleQueue()
+        self._thread: threading.Thread = None
+        self._lock = threading.Lock()
+
+    def add_handler(self, handler: logging.Handler):
+        """Handle log records from `QueueLoggingHandler` with `handler` on the writer thread"""
+        self.handlers.append(handler)
+
+    def add_flushable(self, obj):
+        """Call `obj.flush()` at every flush of the writer thread"""
+        self._flushables.append(obj)
+
+    def remove_flushable(self, obj):
+        if obj in self._flushables:
+            self._flushables.remove(obj)
+
+    def put_record(self, record: logging.LogRecord):
+        self._start()
+        self._queue.put(record)
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """Call `fn(*args, **kwargs)` on the writer thread"""
+        self._start()
+        self._queue.put((fn, args, kwargs))
+
+    def flush(self, timeout: float = None):
+        """Wait until all items queued so far are written"""
+        if self._thread is None or not self._thread.is_alive() or threading.current_thread() is self._thread:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """Write pending items and stop the thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="dlex-writer", daemon=True)
+                    self._thread.start()
+
+    def _after_fork(self):
+        # the thread of the parent process does not exist in the child
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        multiprocessing.util.Finalize(None, self.close, exitpriority=100)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        stop = False
+        while not stop:
+            items = []
+            try:
+                items.append(self._queue.get(timeout=max(last_flush + self.flush_interval - time.monotonic(), 0)))
+                while True:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            flush_requests = []
+            should_flush = False
+            for item in items:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    flush_requests.append(item)
+                elif isinstance(item, logging.LogRecord):
+                    self._handle(item)
+                    should_flush = should_flush or item.levelno >= logging.ERROR
+                else:
+                    fn, args, kwargs = item
+                    try:
+                        fn(*args, **kwargs)
+                    except Exception:
+                        traceback.print_exc()
+
+            if stop or flush_requests or should_flush or time.monotonic() - last_flush >= self.flush_interval:
+                self._flush()
+                last_flush = time.monotonic()
+            for event in flush_requests:
+                event.set()
+
+    def _handle(self, record: logging.LogRecord):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _flush(self):
+        for obj in self.handlers + self._flushables:
+            try:
+                if isinstance(obj, BufferedFileHandler):
+                    obj.flush_buffer()
+                else:
+                    obj.flush()
+            except Exception:
+                traceback.print_exc()
+
+
+background_writer = BackgroundWriter()
+# buffers are written before forking, otherwise they would be written by both processes
+os.register_at_fork(before=background_writer.flush, after_in_child=background_writer._after_fork)
+atexit.register(background_writer.close)
+
+
+class QueueLoggingHandler(logging.Handler):
+    """Pass log records to the background writer"""
+
+    def emit(self, record):
+        # arguments are merged now as they might be modified before the record is written
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        background_writer.put_record(record)
+
+
 log_format = '%(asctime)s - %(levelname)s - %(message)s'
 bold_seq = '\033[1m'
 #colorlog.basicConfig(format=(
@@ -114,23 +270,27 @@ def set_log_dir(configs):
     # TODO: symlink doesn't work correctly
     # os.symlink(params.log_dir, sym_path, True)
 
-    log_info_handler = logging.FileHandler(os.path.join(configs.log_dir, "info.log"))
+    # records are written by the background writer
+    log_info_handler = BufferedFileHandler(os.path.join(configs.log_dir, "info.log"))
     log_info_handler.setLevel(logging.INFO)
     log_info_handler.setFormatter(formatter)
-    logger.addHandler(log_info_handler)
+    background_writer.add_handler(log_info_handler)
 
     log_debug_handler = DebugFileHandler(os.path.join(configs.log_dir, "debug.log"))
     log_debug_handler.setLevel(logging.DEBUG)
     log_debug_handler.setFormatter(formatter)
-    logger.addHandler(log_debug_handler)
+    background_writer.add_handler(log_debug_handler)
 
     log_error_handler = ErrorFileHandler(os.path.join(configs.log_dir, "error.log"))
     log_error_handler.setLevel(logging.ERROR)
     log_error_handler.setFormatter(formatter)
-    logger.addHandler(log_error_handler)
+    background_writer.add_handler(log_error_handler)
 
     if not configs.args.gui:
-        logger.addHandler(TqdmLoggingHandler())
+        background_writer.add_handler(TqdmLoggingHandler())
+
+    if not any(isinstance(handler, QueueLoggingHandler) for handler in logger.handlers):
+        logger.addHandler(QueueLoggingHandler())
 
 
     # log_epoch_info_handler = logging.FileHandler(
@@ -145,6 +305,7 @@ def set_log_dir(configs):
 
 
 def beautify(obj):
+    import numpy as np
     if type(obj) is np.ndarray:
         return "[%s]" % ('\t'.join(["%.4f" % x for x in obj]))
 
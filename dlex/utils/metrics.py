@@ -1,4 +1,11 @@
 """Evaluation metrics"""
+import math
+from typing import Dict, Type
+
+import numpy as np
+
+from dlex.utils.edit_distance import batch_edit_distance, SUBSTITUTIONS, INSERTIONS, DELETIONS, REF_LENGTH
+
 
 def ser(predicted, ground_truth, pass_ids):
     """Segment error rate.
@@ -28,3 +35,462 @@ def ser(predicted, ground_truth, pass_ids):
     if is_correct:
         correct += 1
     return correct, count
+
+
+def _to_numpy(x) -> np.ndarray:
+    if hasattr(x, 'detach'):  # torch tensor
+        return x.detach().cpu().numpy()
+    return np.asarray(x)
+
+
+def _as_array(x):
+    """Keep tensors on their device, convert other sequences to NumPy arrays"""
+    return x if hasattr(x, 'detach') else np.asarray(x)
+
+
+def _add_counts(total, counts):
+    """Add two count vectors of possibly different lengths"""
+    if total is None:
+        return counts
+    if len(counts) > len(total):
+        total, counts = counts, total
+    total[:len(counts)] += counts
+    return total
+
+
+def _bincount(x, minlength: int = 0):
+    return x.bincount(minlength=minlength) if hasattr(x, 'bincount') else np.bincount(x, minlength=minlength)
+
+
+def _is_class_ids(x) -> bool:
+    """Whether labels are non-negative integers, which can be counted with `bincount`"""
+    if hasattr(x, 'detach'):  # torch tensor
+        return not x.is_floating_point() and not x.is_complex() and (x.numel() == 0 or bool(x.min() >= 0))
+    return x.dtype.kind in "iub" and (x.size == 0 or x.min() >= 0)
+
+
+class Metric:
+    """Accumulator of a metric over batches.
+
+    `update` is called with the predictions and references of each batch, and `compute` returns the metric over all
+    batches seen so far. Only sufficient statistics are kept, so memory does not depend on the number of samples.
+    Predictions and references can be lists, NumPy arrays or tensors; tensors are accumulated on their device.
+    Accumulators of the same metric (eg. from several processes) can be combined with `merge`.
+    """
+
+    def update(self, preds, refs):
+        raise NotImplementedError
+
+    def compute(self) -> float:
+        raise NotImplementedError
+
+    def merge(self, other: 'Metric') -> 'Metric':
+        """Add the statistics of another accumulator of the same metric to this one"""
+        raise NotImplementedError
+
+
+class Accuracy(Metric):
+    """Percentage of correct predictions"""
+
+    def __init__(self):
+        self.correct = 0
+        self.total = 0
+
+    def update(self, preds, refs):
+        preds, refs = _as_array(preds), _as_array(refs)
+        self.correct += (preds == refs).sum()
+        self.total += len(refs)
+
+    def compute(self) -> float:
+        return float(self.correct) / self.total * 100 if self.total else 0.
+
+    def merge(self, other: 'Accuracy') -> 'Accuracy':
+        self.correct = float(self.correct) + float(other.correct)
+        self.total += other.total
+        return self
+
+
+class ErrorRate(Accuracy):
+    """Percentage of wrong predictions"""
+
+    def compute(self) -> float:
+        return 100 - super().compute()
+
+
+AVERAGES = ["binary", "macro", "micro"]
+
+
+class ClassificationCounts(Metric):
+    """Per-class counts of true positives, predictions and references, from which precision, recall and F1 are computed.
+
+    Labels that are not non-negative integers (eg. strings, or -1 / 1) are mapped to class indices through a
+    vocabulary built from the labels seen so far.
+
+    :param average: `binary` (score of class `pos_label`), `macro` (unweighted mean over classes) or `micro`. As in
+        sklearn, `binary` raises an error if more than two classes are seen.
+    :param pos_label:
+    """
+
+    def __init__(self, average: str = "binary", pos_label=1):
+        if average not in AVERAGES:
+            raise ValueError("%s is not a valid average" % average)
+        self.average = average
+        self.pos_label = pos_label
+        self.labels: dict = None
+        self.true_positives = None
+        self.pred_counts = None
+        self.ref_counts = None
+
+    def _get_labels(self) -> dict:
+        """Vocabulary of labels. Classes counted without vocabulary so far are their own labels."""
+        if self.labels is None:
+            num_classes = max(len(c) for c in [self.pred_counts, self.ref_counts]) if self.pred_counts is not None \
+                else 0
+            self.labels = {i: i for i in range(num_classes)}
+            # encoded labels are NumPy arrays
+            for name in ['true_positives', 'pred_counts', 'ref_counts']:
+                if getattr(self, name) is not None:
+                    setattr(self, name, _to_numpy(getattr(self, name)).copy())
+        return self.labels
+
+    def _encode(self, x):
+        if self.labels is None and _is_class_ids(x):
+            return x
+        labels = self._get_labels()
+        return np.array([labels.setdefault(label, len(labels)) for label in _to_numpy(x).reshape(-1).tolist()],
+                        dtype=np.int64)
+
+    def update(self, preds, refs):
+        preds, refs = _as_array(preds), _as_array(refs)
+        # both are encoded with the same vocabulary (if any)
+        if self.labels is None and not (_is_class_ids(preds) and _is_class_ids(refs)):
+            self._get_labels()
+        preds, refs = self._encode(preds), self._encode(refs)
+        self.true_positives = _add_counts(self.true_positives, _bincount(preds[preds == refs]))
+        self.pred_counts = _add_counts(self.pred_counts, _bincount(preds))
+        self.ref_counts = _add_counts(self.ref_counts, _bincount(refs))
+
+    def merge(self, other: 'ClassificationCounts') -> 'ClassificationCounts':
+        if other.pred_counts is None:
+            return self
+        if self.labels is None and other.labels is None:
+            for name in ['true_positives', 'pred_counts', 'ref_counts']:
+                total, counts = getattr(self, name), getattr(other, name)
+                setattr(self, name, _add_counts(
+                    _to_numpy(total).copy() if total is not None else None, _to_numpy(counts)))
+            return self
+
+        # counts of the other accumulator are moved to the classes of its labels in this vocabulary
+        labels = self._get_labels()
+        index = np.array([labels.setdefault(label, len(labels)) for label in other._get_labels()], dtype=np.int64)
+        for name in ['true_positives', 'pred_counts', 'ref_counts']:
+            total, counts = getattr(self, name), _to_numpy(getattr(other, name))
+            moved = np.zeros(len(labels), dtype=counts.dtype)
+            np.add.at(moved, index[:len(counts)], counts)
+            setattr(self, name, _add_counts(moved, _to_numpy(total)) if total is not None else moved)
+        return self
+
+    def _counts(self):
+        if self.labels is not None:
+            pos_label = self.labels.get(self.pos_label)
+            num_classes = len(self.labels)
+        else:
+            pos_label = self.pos_label
+            num_classes = max(len(self.pred_counts), len(self.ref_counts), self.pos_label + 1)
+        counts = np.zeros([3, num_classes])
+        for i, c in enumerate([self.true_positives, self.pred_counts, self.ref_counts]):
+            c = _to_numpy(c)
+            counts[i, :len(c)] = c
+        tp, num_preds, num_refs = counts
+        if self.average == "binary":
+            if np.count_nonzero(num_preds + num_refs) > 2:
+                raise ValueError(
+                    "Labels are multiclass but the average is binary. Choose another average (eg. f1_macro).")
+            if pos_label is None:  # never seen
+                return 0., 0., 0.
+            return tp[pos_label], num_preds[pos_label], num_refs[pos_label]
+        elif self.average == "micro":
+            return tp.sum(), num_preds.sum(), num_refs.sum()
+        else:
+            # classes that never appear are not counted
+            present = (num_preds + num_refs) > 0
+            return tp[present], num_preds[present], num_refs[present]
+
+    @staticmethod
+    def _divide(a, b):
+        return np.divide(a, b, out=np.zeros_like(a, dtype=float), where=b > 0)
+
+    def _score(self, scores) -> float:
+        return float(np.mean(scores)) * 100 if np.size(scores) else 0.
+
+
+class Precision(ClassificationCounts):
+    def compute(self) -> float:
+        if self.pred_counts is None:
+            return 0.
+        tp, num_preds, _ = self._counts()
+        return self._score(self._divide(np.asarray(tp, dtype=float), np.asarray(num_preds)))
+
+
+class Recall(ClassificationCounts):
+    def compute(self) -> float:
+        if self.pred_counts is None:
+            return 0.
+        tp, _, num_refs = self._counts()
+        return self._score(self._divide(np.asarray(tp, dtype=float), np.asarray(num_refs)))
+
+
+class F1(ClassificationCounts):
+    def compute(self) -> float:
+        if self.pred_counts is None:
+            return 0.
+        tp, num_preds, num_refs = self._counts()
+        tp = np.asarray(tp, dtype=float)
+        return self._score(self._divide(2 * tp, np.asarray(num_preds + num_refs)))
+
+
+class MeanSquaredError(Metric):
+    def __init__(self):
+        self.sum_squared_errors = 0.
+        self.total = 0
+
+    def update(self, preds, refs):
+        preds, refs = _as_array(preds), _as_array(refs)
+        diff = preds - refs
+        self.sum_squared_errors += (diff * diff).sum()
+        self.total += len(refs)
+
+    def compute(self) -> float:
+        return float(self.sum_squared_errors) / self.total if self.total else 0.
+
+    def merge(self, other: 'MeanSquaredError') -> 'MeanSquaredError':
+        self.sum_squared_errors = float(self.sum_squared_errors) + float(other.sum_squared_errors)
+        self.total += other.total
+        return self
+
+
+class WordErrorRate(Metric):
+    """Total edit distance between predicted and reference sequences divided by the total reference length.
+    Numbers of substitutions, insertions and deletions are also accumulated."""
+
+    def __init__(self):
+        self.counts = np.zeros(4, dtype=np.int64)
+
+    def _tokenize(self, seq):
+        return list(seq)
+
+    def update(self, preds, refs):
+        self.counts += batch_edit_distance(
+            [self._tokenize(p) for p in preds],
+            [self._tokenize(r) for r in refs]).sum(0)
+
+    @property
+    def substitutions(self) -> int:
+        return int(self.counts[SUBSTITUTIONS])
+
+    @property
+    def insertions(self) -> int:
+        return int(self.counts[INSERTIONS])
+
+    @property
+    def deletions(self) -> int:
+        return int(self.counts[DELETIONS])
+
+    @property
+    def errors(self) -> int:
+        return self.substitutions + self.insertions + self.deletions
+
+    @property
+    def total(self) -> int:
+        return int(self.counts[REF_LENGTH])
+
+    def compute(self) -> float:
+        return self.errors / self.total if self.total else 0.
+
+    def merge(self, other: 'WordErrorRate') -> 'WordErrorRate':
+        self.counts += other.counts
+        return self
+
+
+class CharacterErrorRate(WordErrorRate):
+    """Error rate on characters of strings (or of lists of string tokens, joined with spaces)"""
+
+    def _tokenize(self, seq):
+        return list(seq if isinstance(seq, str) else " ".join(seq))
+
+
+_HASH_MULTIPLIER = np.uint64(0x100000001B3)
+_SENTENCE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _flatten(sequences, vocab: dict):
+    """Concatenate sequences into an array of (non-zero) token ids and the array of their sentence indices"""
+    arrays = []
+    for seq in sequences:
+        arr = _to_numpy(seq).reshape(-1)
+        if arr.dtype.kind not in "iub":
+            arr = np.array([vocab.setdefault(token, len(vocab)) for token in arr.tolist()], dtype=np.int64)
+        arrays.append(arr.astype(np.uint64))
+    lengths = [len(arr) for arr in arrays]
+    tokens = np.concatenate(arrays) + np.uint64(1) if arrays else np.zeros(0, dtype=np.uint64)
+    return tokens, np.repeat(np.arange(len(arrays), dtype=np.uint64), lengths)
+
+
+def ngram_statistics(preds, refs, max_order: int) -> np.ndarray:
+    """Clipped n-gram matches between each prediction and its reference, summed over a batch.
+
+    N-grams are hashed with rolling windows over the concatenated token ids and combined with their sentence index,
+    so that each order is counted for the whole batch with a few array operations. Hash collisions are possible
+    but very unlikely.
+
+    :param preds: sequences of token ids (or of any hashable tokens)
+    :param refs: one reference sequence per prediction
+    :return: array of shape (max_order, 3) containing numbers of matches, predicted n-grams and reference n-grams
+    """
+    vocab = {}
+    stats = np.zeros([max_order, 3], dtype=np.int64)
+    pred_tokens, pred_sents = _flatten(preds, vocab)
+    ref_tokens, ref_sents = _flatten(refs, vocab)
+    pred_hashes, ref_hashes = pred_tokens, ref_tokens
+    for n in range(1, max_order + 1):
+        if n > 1:
+            pred_hashes = pred_hashes[:-1] * _HASH_MULTIPLIER + pred_tokens[n - 1:]
+            ref_hashes = ref_hashes[:-1] * _HASH_MULTIPLIER + ref_tokens[n - 1:]
+        keys = []
+        for hashes, sents in [(pred_hashes, pred_sents), (ref_hashes, ref_sents)]:
+            # windows that do not cross sentence boundaries
+            valid = sents[:len(hashes)] == sents[n - 1:]
+            keys.append(np.unique(hashes[valid] ^ (sents[:len(hashes)][valid] * _SENTENCE_MULTIPLIER),
+                                  return_counts=True))
+        (pred_keys, pred_counts), (ref_keys, ref_counts) = keys
+        _, pred_idx, ref_idx = np.intersect1d(pred_keys, ref_keys, assume_unique=True, return_indices=True)
+        stats[n - 1] = [
+            np.minimum(pred_counts[pred_idx], ref_counts[ref_idx]).sum(),
+            pred_counts.sum(),
+            ref_counts.sum()]
+    return stats
+
+
+class BLEU(Metric):
+    """Corpus BLEU with one reference per sample and uniform weights. Without smoothing, the score is the same as
+    nltk `corpus_bleu`.
+
+    :param max_order: maximum n-gram order
+    :param smooth: one of
+        - none: the score is 0 if there is no match for an order
+        - floor: orders without match get `smooth_value` (default: 0.1) matches
+        - add-k: add `smooth_value` (default: 1) to matches and totals of orders larger than 1
+        - exp: orders without match get a precision of 1 / (2^k * total) for the k-th such order
+    :param smooth_value:
+    """
+
+    def __init__(self, max_order: int = 4, smooth: str = "none", smooth_value: float = None):
+        if smooth not in ["none", "floor", "add-k", "exp"]:
+            raise ValueError("%s is not a valid smoothing method" % smooth)
+        self.max_order = max_order
+        self.smooth = smooth
+        self.smooth_value = smooth_value
+        self.stats = np.zeros([max_order, 3], dtype=np.int64)
+        self.pred_length = 0
+        self.ref_length = 0
+
+    def update(self, preds, refs):
+        stats = ngram_statistics(preds, refs, self.max_order)
+        self.pred_length += int(stats[0, 1])
+        self.ref_length += int(stats[0, 2])
+        # as in nltk, each prediction counts at least one n-gram of each order
+        lengths = np.array([len(pred) for pred in preds], dtype=np.int64)
+        stats[:, 1] = [np.maximum(lengths - n + 1, 1).sum() for n in range(1, self.max_order + 1)]
+        self.stats += stats
+
+    def compute(self) -> float:
+        if self.pred_length == 0:
+            return 0.
+        log_precision = 0.
+        num_zero_matches = 0
+        for n, (matches, total, _) in enumerate(self.stats.tolist(), 1):
+            if self.smooth == "add-k" and n > 1:
+                k = 1 if self.smooth_value is None else self.smooth_value
+                matches, total = matches + k, total + k
+            if total == 0:
+                return 0.
+            if matches == 0:
+                if self.smooth == "floor":
+                    matches = 0.1 if self.smooth_value is None else self.smooth_value
+                elif self.smooth == "exp":
+                    num_zero_matches += 1
+                    matches = 1 / 2 ** num_zero_matches
+                else:
+                    return 0.
+            log_precision += math.log(matches / total) / self.max_order
+        brevity_penalty = 1. if self.pred_length > self.ref_length else \
+            math.exp(1 - self.ref_length / self.pred_length)
+        return brevity_penalty * math.exp(log_precision)
+
+    def merge(self, other: 'BLEU') -> 'BLEU':
+        self.stats += other.stats
+        self.pred_length += other.pred_length
+        self.ref_length += other.ref_length
+        return self
+
+
+class ChrF(Metric):
+    """Character n-gram F-score of strings (or lists of string tokens, joined with spaces). Whitespaces are ignored.
+
+    :param max_order: maximum character n-gram order
+    :param beta: weight of recall
+    """
+
+    def __init__(self, max_order: int = 6, beta: float = 2.):
+        self.max_order = max_order
+        self.beta = beta
+        self.stats = np.zeros([max_order, 3], dtype=np.int64)
+
+    def update(self, preds, refs):
+        def _chars(seq):
+            text = seq if isinstance(seq, str) else " ".join(seq)
+            return np.frombuffer("".join(text.split()).encode("utf-32-le"), dtype=np.uint32)
+
+        self.stats += ngram_statistics([_chars(p) for p in preds], [_chars(r) for r in refs], self.max_order)
+
+    def compute(self) -> float:
+        precisions, recalls = [], []
+        for matches, pred_total, ref_total in self.stats.tolist():
+            if pred_total > 0 and ref_total > 0:
+                precisions.append(matches / pred_total)
+                recalls.append(matches / ref_total)
+        if not precisions:
+            return 0.
+        precision, recall = np.mean(precisions), np.mean(recalls)
+        if precision + recall == 0:
+            return 0.
+        beta2 = self.beta ** 2
+        return float((1 + beta2) * precision * recall / (beta2 * precision + recall)) * 100
+
+    def merge(self, other: 'ChrF') -> 'ChrF':
+        self.stats += other.stats
+        return self
+
+
+METRICS: Dict[str, Type[Metric]] = dict(
+    acc=Accuracy,
+    err=ErrorRate,
+    precision=Precision,
+    recall=Recall,
+    f1=F1,
+    mse=MeanSquaredError,
+    wer=WordErrorRate,
+    cer=CharacterErrorRate,
+    bleu=BLEU,
+    chrf=ChrF)
+
+
+def get_metric(name: str, **kwargs) -> Metric:
+    """Create an accumulator for a metric (one of acc, err, precision, recall, f1, mse, wer, cer, bleu, chrf).
+    Precision, recall and F1 can be given with their average (eg. f1_macro, precision_micro)."""
+    base_name, _, average = name.rpartition("_")
+    if base_name in ["precision", "recall", "f1"] and average in AVERAGES:
+        return METRICS[base_name](average=average, **kwargs)
+    if name not in METRICS:
+        raise ValueError(f"Metric {name} is not defined")
+    return METRICS[name](**kwargs)
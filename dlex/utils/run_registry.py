@@ -0,0 +1,142 @@
+"""Registry of training runs, indexed by a hash of their configuration and code version"""
+import dataclasses
+import hashlib
+import json
+import os
+import subprocess
+import time
+from functools import lru_cache
+
+RUNNING = "running"
+FINISHED = "finished"
+TERMINATED = "terminated"
+
+
+@lru_cache()
+def get_code_version(path: str) -> str:
+    """Commit of the git repository containing `path`, followed by a hash of the uncommitted changes if any
+
+    :return: None if `path` is not in a git repository
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=path, capture_output=True, check=True, text=True).stdout.strip()
+        diff = subprocess.run(["git", "diff", "HEAD"], cwd=path, capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    if diff:
+        commit += "+" + hashlib.sha1(diff).hexdigest()[:12]
+    return commit
+
+
+def get_default_code_version() -> dict:
+    """Versions of the project (current working directory) and of dlex"""
+    return dict(
+        project=get_code_version(os.getcwd()),
+        dlex=get_code_version(os.path.dirname(os.path.abspath(__file__))))
+
+
+def get_run_key(params, code_version=None) -> str:
+    """Hash of the model, dataset, train and test configurations of a run, and of the code version.
+    Keys are independent of the order of the configuration entries.
+
+    :param params:
+    :param code_version: any JSON serializable value identifying the code
+    """
+    content = json.dumps(dict(
+        model=params.model.to_dict(level=100) if params.model else None,
+        dataset=params.dataset.to_dict(level=100) if params.dataset else None,
+        train=dataclasses.asdict(params.train),
+        test=dataclasses.asdict(params.test),
+        random_seed=params.random_seed,
+        code=code_version), sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def get_config_key(params) -> str:
+    """Hash of the configurations which define the weights of a run: model, dataset, optimizer, learning rate
+    scheduler, batch size and random seed. It names the checkpoint folder of the run, so that checkpoints are found by
+    evaluations, by runs with more epochs or other logging settings, and by runs of a newer version of the code."""
+    content = json.dumps(dict(
+        model=params.model.to_dict(level=100) if params.model else None,
+        dataset=params.dataset.to_dict(level=100) if params.dataset else None,
+        optimizer=params.train.optimizer,
+        lr_scheduler=params.train.lr_scheduler,
+        batch_size=params.train.batch_size,
+        random_seed=params.random_seed), sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def _to_json(val):
+    if hasattr(val, 'item'):  # numpy or torch scalar
+        return val.item()
+    return str(val)
+
+
+class RunRegistry:
+    """Records of runs stored as one JSON file per run key. Records are replaced atomically, so training processes
+    can write to the same registry.
+
+    A record has the keys
+        - status: running, finished or terminated (stopped by early termination)
+        - results: results of the run, when it is done
+        - terminated_epoch
+        - config_path, env_name, variables, log_dir, checkpoint_dir
+        - started_at, finished_at: timestamps
+
+    :param path: folder of the registry
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def get_record_path(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key: str) -> dict:
+        """:return: record of the run, or None if it has never been started"""
+        try:
+            with open(self.get_record_path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:  # corrupted record
+            return None
+
+    def put(self, key: str, record: dict):
+        os.makedirs(self.path, exist_ok=True)
+        path = self.get_record_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(record, f, indent=2, default=_to_json)
+        os.replace(tmp_path, path)
+
+    def is_done(self, key: str) -> bool:
+        record = self.get(key)
+        return record is not None and record['status'] in [FINISHED, TERMINATED]
+
+    def start(self, key: str, params):
+        """Record a run as running"""
+        self.put(key, dict(
+            status=RUNNING,
+            config_path=params.configs.config_path,
+            env_name=params.env_name,
+            variables=dict(params._variables or {}),
+            log_dir=params.log_dir,
+            checkpoint_dir=params.checkpoint_dir,
+            started_at=time.time()))
+
+    def finish(self, key: str, results, terminated_epoch: int = None):
+        """Record the results of a run
+
+        :param key:
+        :param results:
+        :param terminated_epoch: epoch at which the run is stopped by early termination, if it is
+        """
+        record = self.get(key) or {}
+        record.update(
+            status=FINISHED if terminated_epoch is None else TERMINATED,
+            results=results,
+            terminated_epoch=terminated_epoch,
+            finished_at=time.time())
+        self.put(key, record)
@@ -0,0 +1,283 @@
+"""Run jobs in separate processes according to the CPU cores, memory and devices they need"""
+import heapq
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+from dlex.utils.logging import logger
+
+
+@dataclass
+class Resources:
+    """Resources needed by a job
+
+    :param cores: number of CPU cores. The job is pinned to these cores and its number of threads is set accordingly.
+    :param memory: host memory (MiB). Only used to decide when the job can start.
+    :param devices: number of GPUs
+    """
+    cores: int = 1
+    memory: float = 0
+    devices: int = 0
+
+
+@dataclass
+class Allocation:
+    """Cores and devices assigned to a running job"""
+    cores: List[int]
+    memory: float
+    devices: List[Any]
+
+
+@dataclass
+class Job:
+    """
+    :param fn: function called in the job process as `fn(*args, allocation=allocation)`. It must return a
+        picklable result.
+    :param args:
+    :param name: name of the job process
+    :param resources:
+    :param priority: jobs with higher priority are started first
+    :param max_retries: number of times the job is started again after a failure
+    :param callback: called in the launcher with the result of the job
+    :param error_callback: called in the launcher with the exception of the last failed attempt
+    """
+    fn: Callable
+    args: tuple = ()
+    name: str = None
+    resources: Resources = field(default_factory=Resources)
+    priority: int = 0
+    max_retries: int = 0
+    callback: Callable[[Any], None] = None
+    error_callback: Callable[[Exception], None] = None
+    num_attempts: int = 0
+
+
+def get_available_memory() -> float:
+    """Physical memory (MiB) of the host"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2 ** 20
+    except (ValueError, OSError, AttributeError):
+        return float('inf')
+
+
+def get_available_cores() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _set_num_threads(num_threads: int):
+    # read by torch (and numpy) when they are imported
+    for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        os.environ[var] = str(num_threads)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(num_threads)
+
+
+def _run_job(job: Job, allocation: Allocation, conn):
+    multiprocessing.current_process().name = job.name
+    if allocation.cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, allocation.cores)
+    _set_num_threads(max(len(allocation.cores), 1))
+    try:
+        result = job.fn(*job.args, allocation=allocation)
+    except BaseException as e:
+        message = traceback.format_exc()
+        try:
+            conn.send((False, e, message))
+        except Exception:  # the exception cannot be pickled
+            conn.send((False, RuntimeError(str(e)), message))
+    else:
+        conn.send((True, result, None))
+    finally:
+        conn.close()
+
+
+class Scheduler:
+    """Start jobs when the resources they need are free, in order of priority.
+
+    Each job runs in its own process, pinned to the cores it is allocated. Jobs that fail (exception or abnormal
+    exit of the process) are queued again until they reach their maximum number of retries. Lower priority jobs
+    are started before higher priority ones only if the latter do not fit in the free resources.
+
+    Job processes are forked from the launcher, so job functions and arguments do not need to be picklable.
+
+    :param max_jobs: maximum number of jobs running at the same time
+    :param cores: ids of the CPU cores to allocate. Default: cores available to the current process
+    :param memory: host memory (MiB) to allocate. Default: physical memory
+    :param devices: ids of the GPUs to allocate
+    :param max_pending: maximum number of jobs taken from the iterables passed to `submit_all` and waiting to be
+        started. Default: twice the maximum number of jobs
+    """
+
+    def __init__(
+            self,
+            max_jobs: int = None,
+            cores: List[int] = None,
+            memory: float = None,
+            devices: List[Any] = None,
+            max_pending: int = None):
+        self.max_jobs = max_jobs
+        self.max_pending = max_pending or (2 * max_jobs if max_jobs else 1)
+        self.free_cores = list(cores if cores is not None else get_available_cores())
+        self.free_memory = memory if memory is not None else get_available_memory()
+        self.free_devices = list(devices or [])
+        self._total = Resources(len(self.free_cores), self.free_memory, len(self.free_devices))
+        self._pending = []
+        self._sources: List[Iterator[Job]] = []
+        self._running: Dict[Any, tuple] = {}  # process sentinel -> (job, allocation, process, connection)
+        self._results: Dict[Any, tuple] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._context = multiprocessing.get_context("fork")
+
+    def submit_all(self, jobs: Iterable[Job]):
+        """Submit jobs lazily: a job is taken from the iterable when there is room for it in the pending jobs, so
+        iterating over a large number of jobs does not build all of them upfront."""
+        with self._lock:
+            self._sources.append(iter(jobs))
+
+    def _take_jobs(self):
+        while self._sources and len(self._pending) < self.max_pending:
+            try:
+                job = next(self._sources[0])
+            except StopIteration:
+                with self._lock:
+                    self._sources.pop(0)
+                continue
+            self.submit(job)
+
+    def submit(self, job: Job):
+        res = job.resources
+        if res.cores > self._total.cores or res.memory > self._total.memory or res.devices > self._total.devices:
+            raise ValueError(
+                f"Job {job.name} needs more resources ({res}) than available ({self._total}).")
+        with self._lock:
+            heapq.heappush(self._pending, (-job.priority, next(self._counter), job))
+
+    @property
+    def num_pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def num_running(self) -> int:
+        return len(self._running)
+
+    def _fits(self, res: Resources) -> bool:
+        return res.cores <= len(self.free_cores) and res.memory <= self.free_memory and \
+            res.devices <= len(self.free_devices)
+
+    def _start_jobs(self):
+        with self._lock:
+            skipped = []
+            while self._pending and (self.max_jobs is None or len(self._running) < self.max_jobs):
+                item = heapq.heappop(self._pending)
+                job = item[2]
+                if not self._fits(job.resources):
+                    skipped.append(item)
+                    continue
+                res = job.resources
+                allocation = Allocation(
+                    cores=self.free_cores[:res.cores],
+                    memory=res.memory,
+                    devices=self.free_devices[:res.devices])
+                del self.free_cores[:res.cores]
+                del self.free_devices[:res.devices]
+                self.free_memory -= res.memory
+
+                job.num_attempts += 1
+                receiver, sender = self._context.Pipe(duplex=False)
+                process = self._context.Process(target=_run_job, args=(job, allocation, sender), name=job.name)
+                process.start()
+                sender.close()
+                self._running[process.sentinel] = (job, allocation, process, receiver)
+                logger.debug(
+                    "Job %s started (cores: %s, devices: %s, attempt %d)",
+                    job.name, allocation.cores, allocation.devices, job.num_attempts)
+            for item in skipped:
+                heapq.heappush(self._pending, item)
+
+    def _receive(self, sentinel):
+        try:
+            self._results[sentinel] = self._running[sentinel][3].recv()
+        except EOFError:
+            pass
+
+    def _release(self, allocation: Allocation):
+        self.free_cores = sorted(self.free_cores + allocation.cores)
+        self.free_devices = self.free_devices + allocation.devices
+        self.free_memory += allocation.memory
+
+    def _finish(self, sentinel):
+        job, allocation, process, receiver = self._running.pop(sentinel)
+        process.join()
+        exitcode = process.exitcode
+        process.close()
+        self._release(allocation)
+        if sentinel in self._results:
+            success, result, message = self._results.pop(sentinel)
+        else:
+            success, result, message = False, RuntimeError(
+                f"Job {job.name} exited with code {exitcode}"), None
+        receiver.close()
+
+        if success:
+            if job.callback:
+                job.callback(result)
+            return
+        logger.error("Job %s failed (attempt %d): %s", job.name, job.num_attempts, message or str(result))
+        if job.num_attempts <= job.max_retries:
+            with self._lock:
+                heapq.heappush(self._pending, (-job.priority, next(self._counter), job))
+        elif job.error_callback:
+            job.error_callback(result)
+
+    def run(self, timeout: float = None):
+        """Run until all submitted jobs are finished
+
+        :param timeout: return after `timeout` seconds if jobs are still pending or running
+        :return: True if all jobs are finished
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._closed:
+            self._take_jobs()
+            self._start_jobs()
+            if not self._running:
+                if self._pending:
+                    raise RuntimeError("Pending jobs cannot be started.")
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+            receivers = {entry[3]: sentinel for sentinel, entry in self._running.items()}
+            ready = multiprocessing.connection.wait(list(receivers) + list(self._running), timeout=1)
+            # results are received before the processes exit, as they may not fit in the pipe buffer
+            for obj in ready:
+                if obj in receivers:
+                    self._receive(receivers[obj])
+            for obj in ready:
+                if obj in self._running:
+                    if obj not in self._results and self._running[obj][3].poll():
+                        self._receive(obj)
+                    self._finish(obj)
+        return False
+
+    def terminate(self):
+        """Stop running jobs and drop pending ones"""
+        self._closed = True
+        with self._lock:
+            self._pending.clear()
+            self._sources.clear()
+        for job, allocation, process, receiver in list(self._running.values()):
+            process.terminate()
+            process.join()
+            receiver.close()
+        self._running.clear()
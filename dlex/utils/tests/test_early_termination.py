@@ -0,0 +1,20 @@
+def _is_better_result(metric, best_result, new_result):
+    return new_result > best_result
+
+
+def test_successive_halving():
+    from dlex.utils.early_termination import SuccessiveHalving
+
+    asha = SuccessiveHalving.from_config(dict(type="asha", reduction_factor=2), num_epochs=10)
+    assert asha.rungs == [1, 2, 4, 8]
+    assert not asha.should_stop(0, 3, "acc", 10., _is_better_result)  # not a rung
+
+    # runs continue if they are in the best half of the results reported at the rung
+    assert not asha.should_stop(0, 1, "acc", 50., _is_better_result)
+    assert asha.should_stop(1, 1, "acc", 40., _is_better_result)
+    assert not asha.should_stop(2, 1, "acc", 60., _is_better_result)
+    assert asha.should_stop(3, 1, "acc", 45., _is_better_result)
+    assert not asha.should_stop(0, 2, "acc", 70., _is_better_result)
+    assert asha.store[1] == {0: 50., 1: 40., 2: 60., 3: 45.}
+
+    assert SuccessiveHalving.from_config(dict(min_epochs=2), num_epochs=27).rungs == [2, 6, 18]
@@ -0,0 +1,35 @@
+import random
+
+from dlex.utils.edit_distance import batch_edit_distance, corpus_edit_distance
+
+
+def _edit_distance(s1, s2):
+    prev = list(range(len(s2) + 1))
+    for i, c1 in enumerate(s1, 1):
+        cur = [i]
+        for j, c2 in enumerate(s2, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (c1 != c2)))
+        prev = cur
+    return prev[-1]
+
+
+def test_batch_edit_distance():
+    counts = batch_edit_distance(
+        [["a", "b", "c"], [], ["x"], ["a", "c", "d", "e"]],
+        [["a", "x", "c"], ["a", "b"], [], ["a", "b", "c", "d"]])
+    assert counts.tolist() == [
+        [1, 0, 0, 3],
+        [0, 0, 2, 2],
+        [0, 1, 0, 0],
+        [0, 1, 1, 4]]
+
+
+def test_corpus_edit_distance():
+    rng = random.Random(0)
+    preds = [[rng.randint(0, 3) for _ in range(rng.randint(0, 10))] for _ in range(200)]
+    refs = [[rng.randint(0, 3) for _ in range(rng.randint(0, 10))] for _ in range(200)]
+    counts = corpus_edit_distance(preds, refs, chunk_size=64, num_workers=0)
+    assert counts[:, :3].sum(1).tolist() == [_edit_distance(p, r) for p, r in zip(preds, refs)]
+    assert counts[:, 3].tolist() == [len(r) for r in refs]
+    # an alignment consumes each token of the prediction and the reference exactly once
+    assert ([len(p) for p in preds] - counts[:, 1]).tolist() == (counts[:, 3] - counts[:, 2]).tolist()
@@ -0,0 +1,97 @@
+import os
+import pickle
+
+from dlex.configs import Configs
+from dlex.datatypes import ModelReport
+from dlex.utils.experiment_store import ExperimentStore
+
+YAML = """
+backend: pytorch
+model:
+  name: model
+  attention:
+    type: ~attention
+dataset:
+  name: dataset
+train:
+  num_epochs: 2
+  optimizer:
+    name: adam
+    lr: 0.01
+test:
+  metrics: [bleu]
+env:
+  default:
+    variables:
+      attention: [bahdanau, luong]
+"""
+
+
+def _get_reports(tmpdir):
+    path = os.path.join(str(tmpdir), "nmt.yml")
+    with open(path, "w") as f:
+        f.write(YAML)
+    reports = []
+    for idx, params in enumerate(Configs("train", ["-c", path]).environments[0].configs_list):
+        params.run_key = f"key{idx}"
+        report = ModelReport(idx)
+        report.params = params
+        report.epoch_losses = [1., .5]
+        report.valid_results = {1: dict(bleu=10. + idx), 2: dict(bleu=20. - idx * 15)}
+        report.test_results = {1: dict(test=dict(bleu=9.)), 2: dict(test=dict(bleu=19.))}
+        reports.append(report)
+    return reports
+
+
+def test_experiment_store(tmpdir, monkeypatch):
+    monkeypatch.setenv("DLEX_LOG_DIR", str(tmpdir))
+    monkeypatch.setenv("DLEX_CHECKPOINT_PATH", os.path.join(str(tmpdir), "checkpoints"))
+    store = ExperimentStore(os.path.join(str(tmpdir), "experiments.db"))
+    reports = _get_reports(tmpdir)
+    os.makedirs(reports[0].params.checkpoint_dir)
+    open(os.path.join(reports[0].params.checkpoint_dir, "epoch-02.pt"), "w").close()
+
+    # reports are received from the training processes
+    run_ids = [store.record(pickle.loads(pickle.dumps(report))) for report in reports]
+    reports[0].finish()
+    assert store.record(reports[0]) == run_ids[0]
+    assert store.get_params(run_ids[1])['model.attention.type'] == "luong"
+    assert store.conn.execute("SELECT variables FROM runs WHERE run_id = ?", (run_ids[1],)).fetchone() == (
+        '{"attention": "luong"}',)
+    assert store.get_params(run_ids[1])['train.num_epochs'] == "2"
+    assert store.conn.execute("SELECT run_id FROM runs WHERE run_key = 'key1'").fetchone() == (run_ids[1],)
+
+    runs = store.query("valid", "bleu")
+    assert [(run['run_id'], run['value'], run['epoch']) for run in runs] == [(run_ids[0], 20., 2), (run_ids[1], 11., 1)]
+    assert runs[0]['status'] == "finished" and runs[1]['status'] == "running"
+    runs = store.query("valid", "bleu", where={"model.attention.type": "luong"})
+    assert [run['run_id'] for run in runs] == [run_ids[1]]
+    assert store.query("valid", "bleu", lowest=True, limit=1)[0]['value'] == 5.
+    assert store.query("valid", "bleu", config_name="other") == []
+    assert len(store.query("train", "loss", config_name="nmt")) == 2
+
+    checkpoints = store.conn.execute("SELECT run_id, tag, epoch FROM checkpoints").fetchall()
+    assert checkpoints == [(run_ids[0], "epoch-02", 2)]
+
+    # runs of other environments are in the same log folder, with the same indices
+    report = pickle.loads(pickle.dumps(reports[0]))
+    report.params.env_name = "other"
+    assert store.record(report) not in run_ids
+    assert store.record(report) == store.record(report)
+    assert len(store.conn.execute("SELECT * FROM runs").fetchall()) == 3
+    store.close()
+
+
+def test_query(tmpdir, monkeypatch, capsys):
+    from dlex.query import main
+
+    monkeypatch.setenv("DLEX_LOG_DIR", str(tmpdir))
+    path = os.path.join(str(tmpdir), "experiments.db")
+    store = ExperimentStore(path)
+    for report in _get_reports(tmpdir):
+        store.record(report)
+    store.close()
+
+    main(["valid.bleu", "-n", "1", "--where", "model.attention.type=luong", "--show", "train.optimizer.lr", "--db", path])
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert len(lines) == 3 and "11.0000" in lines[2] and "0.01" in lines[2]
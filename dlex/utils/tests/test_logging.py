@@ -0,0 +1,23 @@
+import logging
+import os
+
+
+def test_background_writer(tmpdir):
+    from dlex.utils.logging import BackgroundWriter, BufferedFileHandler
+
+    writer = BackgroundWriter(flush_interval=60)
+    handler = BufferedFileHandler(os.path.join(tmpdir, "info.log"))
+    handler.setLevel(logging.INFO)
+    writer.add_handler(handler)
+    calls = []
+    for i in range(3):
+        writer.put_record(logging.makeLogRecord(dict(msg="step %d", args=(i,), levelno=logging.INFO)))
+        writer.submit(calls.append, i)
+    writer.put_record(logging.makeLogRecord(dict(msg="debug", levelno=logging.DEBUG)))
+    writer.flush()
+
+    assert calls == [0, 1, 2]
+    with open(os.path.join(tmpdir, "info.log")) as f:
+        assert f.read().splitlines() == ["step 0", "step 1", "step 2"]
+    writer.close()
+    handler.close()
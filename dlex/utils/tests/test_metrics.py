@@ -8,3 +8,109 @@ def test_ser():
         [1, 2, 0, 3, 0, 1, 2, 0, 0, 3, 0],
         [2, 2, 0, 3, 0, 1, 3, 0, 0, 3, 0], [1, 2, 3]
     ) == 4 / 6
+
+
+def test_classification_metrics():
+    import numpy as np
+    import sklearn.metrics
+    from dlex.utils.metrics import get_metric
+
+    rng = np.random.RandomState(0)
+    pred, ref = rng.randint(0, 4, 100), rng.randint(0, 4, 100)
+    for name, kwargs, expected in [
+        ("acc", {}, sklearn.metrics.accuracy_score(ref, pred) * 100),
+        ("err", {}, 100 - sklearn.metrics.accuracy_score(ref, pred) * 100),
+        ("f1", dict(average="macro"), sklearn.metrics.f1_score(ref, pred, average="macro") * 100),
+        ("precision", dict(average="macro"), sklearn.metrics.precision_score(ref, pred, average="macro") * 100),
+        ("f1_micro", {}, sklearn.metrics.f1_score(ref, pred, average="micro") * 100),
+        ("recall", dict(average="micro"), sklearn.metrics.recall_score(ref, pred, average="micro") * 100),
+        ("mse", {}, sklearn.metrics.mean_squared_error(ref, pred)),
+    ]:
+        metric, other = get_metric(name, **kwargs), get_metric(name, **kwargs)
+        metric.update(pred[:30], ref[:30])
+        other.update(pred[30:], ref[30:])
+        assert abs(metric.merge(other).compute() - expected) < 1e-9, name
+
+
+
+def test_classification_labels():
+    import numpy as np
+    import pytest
+    import sklearn.metrics
+    import torch
+    from dlex.utils.metrics import get_metric
+
+    # labels that are not class indices
+    rng = np.random.RandomState(0)
+    pred, ref = rng.choice([-1, 1], 50), rng.choice([-1, 1], 50)
+    metric = get_metric("precision")
+    metric.update(pred, ref)
+    assert abs(metric.compute() - sklearn.metrics.precision_score(ref, pred) * 100) < 1e-9
+
+    pred, ref = rng.choice(["a", "b", "c"], 50), rng.choice(["a", "b", "c"], 50)
+    metric, other = get_metric("f1_macro"), get_metric("f1_macro")
+    metric.update(pred[:20], ref[:20])
+    other.update(pred[20:], ref[20:])
+    assert abs(metric.merge(other).compute() - sklearn.metrics.f1_score(ref, pred, average="macro") * 100) < 1e-9
+
+    # class indices followed by other labels
+    metric = get_metric("recall_macro")
+    metric.update(torch.tensor([0, 1]), torch.tensor([1, 1]))
+    metric.update(np.array([-1, 1]), np.array([-1, 0]))
+    expected = sklearn.metrics.recall_score([1, 1, -1, 0], [0, 1, -1, 1], average="macro") * 100
+    assert abs(metric.compute() - expected) < 1e-9
+
+    # as in sklearn, binary scores are not defined for multiclass labels
+    metric = get_metric("f1")
+    metric.update([0, 1, 2], [0, 1, 1])
+    with pytest.raises(ValueError):
+        metric.compute()
+
+
+def test_sequence_metrics():
+    from dlex.utils.metrics import get_metric
+
+    wer = get_metric("wer")
+    wer.update([[1, 2, 3], [4]], [[1, 3], [4, 5]])
+    assert wer.compute() == 2 / 4
+
+    bleu = get_metric("bleu")
+    bleu.update([[1, 2, 3, 4, 5]], [[1, 2, 3, 4, 5]])
+    assert bleu.compute() == 1.
+    bleu.update([[6]], [[7, 8]])
+    assert 0 < bleu.compute() < 1
+
+
+def test_bleu():
+    import numpy as np
+    from nltk.translate.bleu_score import corpus_bleu, SmoothingFunction
+    from dlex.utils.metrics import BLEU
+
+    rng = np.random.RandomState(0)
+    preds = [rng.randint(0, 10, rng.randint(1, 20)) for _ in range(200)]
+    refs = [rng.randint(0, 10, rng.randint(1, 20)) for _ in range(200)]
+    bleu, other = BLEU(), BLEU()
+    bleu.update(preds[:50], refs[:50])
+    other.update(preds[50:], refs[50:])
+    expected = corpus_bleu([[list(ref)] for ref in refs], [list(pred) for pred in preds])
+    assert abs(bleu.merge(other).compute() - expected) < 1e-9
+
+    pred, ref = "a b c x".split(), "a b d e c".split()
+    smoothing = SmoothingFunction()
+    for smooth, method in [("floor", smoothing.method1), ("add-k", smoothing.method2), ("exp", smoothing.method3)]:
+        bleu = BLEU(smooth=smooth)
+        bleu.update([pred], [ref])
+        assert abs(bleu.compute() - corpus_bleu([[ref]], [pred], smoothing_function=method)) < 1e-9, smooth
+    bleu = BLEU()
+    bleu.update([pred], [ref])
+    assert bleu.compute() == 0.
+
+
+def test_chrf():
+    from dlex.utils.metrics import get_metric
+
+    chrf = get_metric("chrf")
+    chrf.update(["the cat sat"], ["the cat sat"])
+    assert chrf.compute() == 100.
+    chrf.update([["a", "dog"]], ["the cat"])
+    assert 0 < chrf.compute() < 100
@@ -0,0 +1,81 @@
+import os
+
+from dlex.configs import Configs
+from dlex.utils.run_registry import RunRegistry, get_run_key, get_config_key, RUNNING, FINISHED, TERMINATED
+
+YAML = """
+backend: pytorch
+model:
+  name: {model}
+  dim: 16
+dataset:
+  name: dataset
+train:
+  num_epochs: 2
+  optimizer:
+    name: adam
+    lr: ~lr
+test:
+  metrics: [acc]
+env:
+  default:
+    variables:
+      lr: [0.01, 0.02]
+"""
+
+
+def _load_params(tmpdir, model="model", yaml=YAML):
+    path = os.path.join(str(tmpdir), "test.yml")
+    with open(path, "w") as f:
+        f.write(yaml.format(model=model))
+    configs = Configs("train", ["-c", path])
+    return configs.environments[0].configs_list
+
+
+def test_run_key(tmpdir, monkeypatch):
+    monkeypatch.setenv("DLEX_LOG_DIR", str(tmpdir))
+    params = _load_params(tmpdir)
+    keys = [get_run_key(p, code_version="abc") for p in params]
+    assert keys[0] != keys[1]
+    assert keys == [get_run_key(p, code_version="abc") for p in _load_params(tmpdir)]
+    assert keys[0] != get_run_key(params[0], code_version="def")
+    assert keys[0] != get_run_key(_load_params(tmpdir, model="other_model")[0], code_version="abc")
+
+
+def test_config_key(tmpdir, monkeypatch):
+    monkeypatch.setenv("DLEX_LOG_DIR", str(tmpdir))
+    monkeypatch.setenv("DLEX_CHECKPOINT_PATH", os.path.join(str(tmpdir), "checkpoints"))
+    params = _load_params(tmpdir)
+    assert params[0].config_key == get_config_key(params[0]) != params[1].config_key
+    # settings which do not change the weights are not hashed
+    other = _load_params(tmpdir, yaml=YAML.replace("num_epochs: 2", "num_epochs: 5").replace("[acc]", "[acc, f1]"))
+    assert [p.config_key for p in other] == [p.config_key for p in params]
+    assert params[0].checkpoint_dir.endswith(params[0].config_key)
+
+    # checkpoints saved without config key
+    legacy_dir = os.path.dirname(params[0].checkpoint_dir)
+    os.makedirs(legacy_dir)
+    open(os.path.join(legacy_dir, "latest.pt"), "w").close()
+    assert params[0].checkpoint_dir == legacy_dir
+    os.makedirs(os.path.join(legacy_dir, params[0].config_key))
+    assert params[0].checkpoint_dir.endswith(params[0].config_key)
+
+
+def test_run_registry(tmpdir, monkeypatch):
+    monkeypatch.setenv("DLEX_LOG_DIR", str(tmpdir))
+    params = _load_params(tmpdir)
+    registry = RunRegistry(os.path.join(str(tmpdir), "registry"))
+    assert registry.get("key") is None
+
+    registry.start("key", params[0])
+    assert registry.get("key")['status'] == RUNNING and not registry.is_done("key")
+    assert registry.get("key")['variables'] == dict(lr=0.01)
+
+    registry.finish("key", {"test": {"acc": 90.}})
+    record = registry.get("key")
+    assert record['status'] == FINISHED and record['results'] == {"test": {"acc": 90.}}
+    assert registry.is_done("key")
+
+    registry.finish("key", {"test": {"acc": 50.}}, terminated_epoch=1)
+    assert registry.get("key")['status'] == TERMINATED and registry.get("key")['terminated_epoch'] == 1
+    assert os.listdir(registry.path) == ["key.json"]
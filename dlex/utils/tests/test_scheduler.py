@@ -0,0 +1,66 @@
+import os
+
+
+def _record(path, value, allocation=None):
+    with open(path, "a") as f:
+        f.write(f"{value}\n")
+    return value, allocation.devices, os.environ["OMP_NUM_THREADS"]
+
+
+def _fail_once(path, allocation=None):
+    if not os.path.exists(path):
+        open(path, "w").close()
+        raise ValueError("first attempt")
+    return "ok"
+
+
+def test_scheduler(tmpdir):
+    from dlex.utils.scheduler import Scheduler, Job, Resources
+
+    path = os.path.join(tmpdir, "order.txt")
+    scheduler = Scheduler(max_jobs=1, cores=[], devices=["gpu0", "gpu1"])
+    results = []
+    for value, priority in [("low", 0), ("high", 2), ("mid", 1)]:
+        scheduler.submit(Job(
+            _record, args=(path, value), name=value, resources=Resources(cores=0, devices=1),
+            priority=priority, callback=results.append))
+    assert scheduler.run()
+
+    with open(path) as f:
+        assert f.read().split() == ["high", "mid", "low"]
+    assert [r[0] for r in results] == ["high", "mid", "low"]
+    assert all(len(devices) == 1 and num_threads == "1" for _, devices, num_threads in results)
+    assert sorted(scheduler.free_devices) == ["gpu0", "gpu1"]
+
+
+def test_scheduler_retry(tmpdir):
+    from dlex.utils.scheduler import Scheduler, Job, Resources
+
+    scheduler = Scheduler(cores=[])
+    results, errors = [], []
+    for max_retries, name in [(1, "retried"), (0, "failed")]:
+        scheduler.submit(Job(
+            _fail_once, args=(os.path.join(tmpdir, name),), name=name, resources=Resources(cores=0),
+            max_retries=max_retries, callback=results.append, error_callback=errors.append))
+    assert scheduler.run()
+    assert results == ["ok"]
+    assert len(errors) == 1 and isinstance(errors[0], ValueError)
+
+
+def test_scheduler_submit_all(tmpdir):
+    from dlex.utils.scheduler import Scheduler, Job, Resources
+
+    path = os.path.join(tmpdir, "order.txt")
+    scheduler = Scheduler(max_jobs=1, cores=[], max_pending=1)
+    created = []
+
+    def _jobs():
+        for value in ["a", "b", "c"]:
+            created.append(value)
+            yield Job(_record, args=(path, value), name=value, resources=Resources(cores=0))
+
+    scheduler.submit_all(_jobs())
+    assert created == []
+    assert scheduler.run()
+    with open(path) as f:
+        assert f.read().split() == ["a", "b", "c"]
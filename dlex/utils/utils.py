@@ -10,9 +10,6 @@ import zipfile
 from subprocess import call
 from typing import List, Union
 
-import requests
-from tqdm import tqdm
-
 from .logging import logger
 
 urllib_start_time = 0
@@ -42,6 +39,9 @@ def maybe_download(
     Returns:
         Path to resulting file.
     """
+    import requests
+    from tqdm import tqdm
+
     if not os.path.exists(download_dir):
         os.makedirs(download_dir)
     filepath = os.path.join(download_dir, filename or source_url[source_url.rfind("/")+1:])
@@ -0,0 +1,352 @@
+"""Pool of long-lived worker processes running the runs of `dlex.train` and `dlex.evaluate`.
+
+Workers import the backend and initialize the devices once, and keep the datasets they have loaded (by dataset
+configuration), so that the runs of a sweep only pay for their training. Start the pool, then submit configs with
+`--worker-pool`:
+
+    python -m dlex.worker start -n 4 --gpus 0 1
+    python -m dlex.train -c model_configs/demo.yml --worker-pool
+    python -m dlex.worker stop
+
+Modules of the project (models, datasets) are imported once by each worker: restart the pool after changing them.
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import traceback
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, Connection, wait
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from dlex.configs import ModuleConfigs, Params
+from dlex.utils.logging import logger, background_writer, set_log_dir, QueueLoggingHandler, TqdmLoggingHandler
+
+DONE = "done"
+FAILED = "failed"
+
+
+def _warm_up(backend: str):
+    """Import the backend and initialize the devices before the first run"""
+    if backend in ["pytorch", "torch"]:
+        import torch
+        from dlex.torch import PytorchBackend  # noqa: F401
+        # first matrix multiplication loads the BLAS kernels
+        torch.ones(8, 8) @ torch.ones(8, 8)
+        if torch.cuda.is_available():
+            torch.cuda.init()
+    elif backend in ["tensorflow", "tf", "tensorflow_v1", "tf_v1", "tff"]:
+        import tensorflow  # noqa: F401
+
+
+def _run_job(mode: str, params: Params, training_idx: int, cwd: str):
+    """Run a training or an evaluation in a worker process"""
+    # models and datasets are imported from the folder of the client
+    os.chdir(cwd)
+    if cwd not in sys.path:
+        sys.path.insert(0, cwd)
+
+    # logs of the run are written to the log folder of the client
+    background_writer.flush()
+    for handler in background_writer.handlers:
+        handler.close()
+    background_writer.handlers.clear()
+    set_log_dir(params.configs)
+
+    from dlex.train import launch_training, load_shared_dataset
+    # loaded datasets are kept for the next runs with the same dataset configuration
+    load_shared_dataset(params)
+    if mode == "train":
+        return launch_training(params, training_idx)
+    else:
+        from dlex.evaluate import launch_evaluating
+        launch_evaluating(params.configs.backend, params, params.configs)
+        background_writer.flush()
+
+
+def _worker_main(conn: Connection, backend: str, devices: List[str]):
+    _warm_up(backend)
+    conn.send(None)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        job_id, mode, params, training_idx, cwd = job
+        if devices:
+            params.gpu = devices
+        try:
+            conn.send((job_id, DONE, _run_job(mode, params, training_idx, cwd)))
+        except Exception as e:
+            # exceptions may not be picklable
+            logger.error(traceback.format_exc())
+            conn.send((job_id, FAILED, f"{type(e).__name__}: {e}"))
+
+
+def _get_authkey_path(address: str) -> str:
+    """File holding the key that clients of a pool authenticate with"""
+    return address + ".key"
+
+
+class _Worker:
+    def __init__(self, ctx, backend: str, devices: List[str]):
+        self.devices = devices
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, backend, devices), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.job_id = None
+
+
+class WorkerPool:
+    """Daemon dispatching the runs received from clients to warm worker processes.
+
+    :param num_workers: number of worker processes, each running one run at a time
+    :param backend: backend imported by the workers before their first run
+    :param devices: GPUs, assigned to the workers in turn
+    :param address: path of the socket. Default: `ModuleConfigs.get_worker_address()`
+    """
+
+    def __init__(self, num_workers: int, backend: str = "pytorch", devices: List[str] = None, address: str = None):
+        # workers are forked before CUDA is initialized in the daemon (which never initializes it)
+        self._ctx = multiprocessing.get_context("fork")
+        self.backend = backend
+        self.devices = devices or []
+        self.address = address or ModuleConfigs.get_worker_address()
+        self._workers = [self._start_worker(i) for i in range(num_workers)]
+        self._pending = deque()
+        self._jobs: Dict[int, Tuple[Connection, Any]] = {}
+        self._client_locks: Dict[Connection, threading.Lock] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _start_worker(self, i: int) -> _Worker:
+        devices = [self.devices[i % len(self.devices)]] if self.devices else []
+        return _Worker(self._ctx, self.backend, devices)
+
+    def _send(self, conn: Connection, msg):
+        try:
+            with self._client_locks[conn]:
+                conn.send(msg)
+        except (KeyError, OSError):
+            # client disconnected
+            pass
+
+    def status(self) -> dict:
+        with self._lock:
+            return dict(
+                workers=len(self._workers),
+                ready=sum(w.ready for w in self._workers),
+                running=sum(w.job_id is not None for w in self._workers),
+                pending=len(self._pending))
+
+    def _serve_client(self, conn: Connection):
+        self._client_locks[conn] = threading.Lock()
+        try:
+            while True:
+                msg = conn.recv()
+                if msg[0] == "submit":
+                    _, tag, mode, params, training_idx, cwd = msg
+                    with self._lock:
+                        job_id = next(self._counter)
+                        self._jobs[job_id] = (conn, tag)
+                        self._pending.append((job_id, mode, params, training_idx, cwd))
+                elif msg[0] == "status":
+                    self._send(conn, self.status())
+                elif msg[0] == "stop":
+                    self._stopped.set()
+                    self._send(conn, None)
+        except (EOFError, OSError):
+            pass
+        # runs of a client that disconnected are not started
+        with self._lock:
+            cancelled = {job[0] for job in self._pending if self._jobs[job[0]][0] is conn}
+            self._pending = deque(job for job in self._pending if job[0] not in cancelled)
+            for job_id in [job_id for job_id, (c, _) in self._jobs.items() if c is conn]:
+                if job_id in cancelled:
+                    del self._jobs[job_id]
+                else:
+                    # results of running jobs are dropped
+                    self._jobs[job_id] = (None, None)
+            del self._client_locks[conn]
+        conn.close()
+
+    def _accept(self, listener: Listener):
+        while not self._stopped.is_set():
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                logger.warning("Connection with a wrong key refused.")
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def _finish_job(self, job_id: int, status: str, result):
+        with self._lock:
+            conn, tag = self._jobs.pop(job_id)
+        if conn is not None:
+            self._send(conn, (status, tag, result))
+
+    def _dispatch(self):
+        with self._lock:
+            for worker in self._workers:
+                if worker.ready and worker.job_id is None and self._pending:
+                    job = self._pending.popleft()
+                    worker.job_id = job[0]
+                    worker.conn.send(job)
+
+    def _receive(self, worker: _Worker):
+        msg = worker.conn.recv()
+        if msg is None:
+            worker.ready = True
+            return
+        job_id, status, result = msg
+        worker.job_id = None
+        self._finish_job(job_id, status, result)
+
+    def _restart(self, i: int):
+        worker = self._workers[i]
+        worker.process.join()
+        if not worker.ready:
+            raise RuntimeError(f"Worker {i} exited with code {worker.process.exitcode} before its first run.")
+        logger.error("Worker %d exited with code %s. It is restarted.", i, worker.process.exitcode)
+        if worker.job_id is not None:
+            self._finish_job(worker.job_id, FAILED, f"Worker exited with code {worker.process.exitcode}")
+        with self._lock:
+            self._workers[i] = self._start_worker(i)
+
+    def serve(self):
+        """Accept runs until a client sends `stop`"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.address)), exist_ok=True)
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        # runs are unpickled by the workers: only the user can connect, with a key that only the user can read.
+        # Socket and key are created without permissions for others, instead of being restricted afterwards.
+        authkey = os.urandom(32)
+        umask = os.umask(0o077)
+        try:
+            with open(_get_authkey_path(self.address), "wb") as f:
+                f.write(authkey)
+            listener = Listener(self.address, family="AF_UNIX", authkey=authkey)
+        finally:
+            os.umask(umask)
+        threading.Thread(target=self._accept, args=(listener,), daemon=True).start()
+        logger.info("Worker pool listening on %s (%d workers).", self.address, len(self._workers))
+
+        try:
+            while not self._stopped.is_set():
+                self._dispatch()
+                conns = {w.conn: w for w in self._workers}
+                sentinels = {w.process.sentinel: i for i, w in enumerate(self._workers)}
+                for obj in wait(list(conns) + list(sentinels), timeout=0.5):
+                    if obj in conns:
+                        try:
+                            self._receive(conns[obj])
+                        except EOFError:
+                            pass
+                for obj in sentinels:
+                    if not self._workers[sentinels[obj]].process.is_alive():
+                        self._restart(sentinels[obj])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            for path in [self.address, _get_authkey_path(self.address)]:
+                if os.path.exists(path):
+                    os.unlink(path)
+            for worker in self._workers:
+                worker.process.terminate()
+            logger.info("Worker pool stopped.")
+
+
+class WorkerClient:
+    """Connection to a worker pool started with `python -m dlex.worker start`
+
+    :param address: path of the socket. Default: `ModuleConfigs.get_worker_address()`
+    """
+
+    def __init__(self, address: str = None):
+        address = address or ModuleConfigs.get_worker_address()
+        try:
+            with open(_get_authkey_path(address), "rb") as f:
+                authkey = f.read()
+            self._conn = Client(address, family="AF_UNIX", authkey=authkey)
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise ConnectionError(
+                f"No worker pool at {address}. Start one with `python -m dlex.worker start`.") from None
+
+    def status(self) -> dict:
+        self._conn.send(("status",))
+        return self._conn.recv()
+
+    def stop(self):
+        self._conn.send(("stop",))
+        self._conn.recv()
+
+    def run(
+            self,
+            jobs: Iterable[Tuple[Any, str, Params, int]],
+            max_pending: int = None) -> Iterator[Tuple[str, Any, Any]]:
+        """Run jobs on the workers. Jobs are taken from the iterable as runs finish, so that at most `max_pending`
+        runs wait in the pool.
+
+        :param jobs: (tag, mode, params, training_idx), where mode is train or test
+        :param max_pending: Default: twice the number of workers
+        :return: (status, tag, result) of each job, in order of completion. Result is the report of the run if
+            status is `DONE`, or the error message if status is `FAILED`.
+        """
+        if max_pending is None:
+            max_pending = 2 * self.status()['workers']
+        jobs = iter(jobs)
+        num_running = 0
+        while True:
+            for tag, mode, params, training_idx in itertools.islice(jobs, max(max_pending - num_running, 0)):
+                self._conn.send(("submit", tag, mode, params, training_idx, os.getcwd()))
+                num_running += 1
+            if not num_running:
+                return
+            yield self._conn.recv()
+            num_running -= 1
+
+    def close(self):
+        self._conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pool of warm worker processes running dlex runs")
+    parser.add_argument(
+        "command", choices=["start", "stop", "status"],
+        help="start the pool (in the foreground), or stop / show the status of the running pool")
+    parser.add_argument(
+        "--address", default=None,
+        help="path of the socket. Default: $DLEX_WORKER_ADDRESS or workers.sock in the tmp folder")
+    parser.add_argument("-n", "--num-workers", type=int, default=1, dest="num_workers", help="number of workers")
+    parser.add_argument("-b", "--backend", default="pytorch", dest="backend", help="backend imported by the workers")
+    parser.add_argument("-g", "--gpus", nargs='+', default=None, dest="gpus", help="GPUs assigned to the workers")
+    args = parser.parse_args(argv)
+
+    if args.command == "start":
+        # logs of the pool are printed until a run sets its log folder
+        background_writer.add_handler(TqdmLoggingHandler())
+        logger.addHandler(QueueLoggingHandler())
+        WorkerPool(args.num_workers, args.backend, args.gpus, args.address).serve()
+        return
+
+    client = WorkerClient(args.address)
+    if args.command == "stop":
+        client.stop()
+    else:
+        print(", ".join(f"{key}: {val}" for key, val in client.status().items()))
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
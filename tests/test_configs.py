@@ -0,0 +1,56 @@
+import copy
+import pickle
+
+import pytest
+
+import dlex.configs
+from dlex.configs import compile_config, CompiledConfig
+
+
+def test_compile_config():
+    cfg = compile_config(
+        dict(dim=16, rnn=dict(type="lstm"), layers=[1, 2]), "model", defaults=dict(rnn=dict(num_layers=2)))
+    assert cfg.dim == 16 and cfg.rnn.type == "lstm" and cfg.rnn.num_layers == 2 and cfg.layers == [1, 2]
+    assert isinstance(cfg, dict) and isinstance(cfg.rnn, CompiledConfig)
+    assert cfg.get('dim') == 16 and cfg['rnn']['type'] == "lstm"
+    assert cfg.to_dict(level=100) == dict(dim=16, rnn=dict(type="lstm", num_layers=2), layers=[1, 2])
+    assert cfg.dropout is None
+
+    with pytest.raises(AttributeError):
+        cfg.dim = 32
+    with pytest.raises(TypeError):
+        cfg['dim'] = 32
+    assert cfg.replace(dim=32).dim == 32 and cfg.dim == 16
+
+    loaded = pickle.loads(pickle.dumps(cfg))
+    assert loaded == cfg and loaded.rnn.num_layers == 2
+    assert copy.deepcopy(cfg) is cfg
+
+
+def test_unset_param_warned_once(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(dlex.configs.logger, "warning", lambda *args: warnings.append(args))
+    cfg = compile_config(dict(dim=16), "dataset")
+    for _ in range(3):
+        assert cfg.max_source_length is None
+    assert warnings == [("Access to unset param %s", "dataset.max_source_length")]
+
+
+def test_sweep_grid():
+    import itertools
+    from dlex.configs import SweepGrid
+
+    values = [[1, 2, 3], ["a", "b"], [0.1, 0.2]]
+    grid = SweepGrid(values)
+    assert len(grid) == 12
+    assert list(grid) == list(itertools.product(*values))
+    assert list(grid[2:5]) == list(itertools.product(*values))[2:5]
+
+    sampled = grid.sample(5, seed=0)
+    assert len(sampled) == 5 and len(set(sampled)) == 5 and set(sampled) <= set(grid)
+    assert list(sampled) == list(grid.sample(5, seed=0)) == list(grid.sample(5))
+    assert list(grid.sample(5, seed=1)) != list(sampled)
+
+    quasi = grid.sample(6, method="quasi_random")
+    assert len(set(quasi)) == 6 and set(quasi) <= set(grid)
+    assert len(grid.sample(100)) == 12
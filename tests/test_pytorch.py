@@ -164,4 +164,70 @@ def test_classification_model(configs: Configs):
     report = be.run_train()
     assert report.training_idx == 0
     assert 'acc' in report.results
-    assert report.results['acc'] == 100.
\ No newline at end of file
+    assert report.results['acc'] == 100.
+
+ASYNC_EVALUATION_YAML = """backend: pytorch
+model:
+    name: test_pytorch.RegressionModel
+dataset:
+    name: test_pytorch.Dataset
+    num_train: 20
+    num_test: 10
+    num_classes: 5
+train:
+    num_epochs: 3
+    batch_size: 10
+    select_model: best
+    optimizer:
+        name: adam
+        lr: 0.01
+test:
+    metrics: [mse]"""
+
+
+def _train_with_evaluator(yaml_content, monkeypatch, async_evaluation):
+    import shutil
+    import dlex.torch.backend
+    from dlex.torch.evaluator import AsyncEvaluator
+    evaluators = []
+
+    class _AsyncEvaluator(AsyncEvaluator):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            evaluators.append(self)
+
+    monkeypatch.setattr(dlex.torch.backend, "AsyncEvaluator", _AsyncEvaluator)
+    with YamlConfigs(yaml_content, ["--test-set", "test"]) as configs:
+        params = configs.get_default_params()
+        params.train.async_evaluation = async_evaluation
+        shutil.rmtree(params.checkpoint_dir, ignore_errors=True)
+        report = PytorchBackend(params).run_train()
+        return params.checkpoint_dir, report, evaluators
+
+
+def test_async_evaluation(monkeypatch):
+    _, sync_report, evaluators = _train_with_evaluator(ASYNC_EVALUATION_YAML, monkeypatch, False)
+    assert not evaluators
+    checkpoint_dir, report, evaluators = _train_with_evaluator(ASYNC_EVALUATION_YAML, monkeypatch, True)
+
+    # snapshots of each epoch are evaluated as in synchronous evaluation
+    assert sorted(report.test_results) == sorted(sync_report.test_results) == [1, 2, 3]
+    for epoch, results in sync_report.test_results.items():
+        assert np.isclose(report.test_results[epoch]['test']['mse'], results['test']['mse'])
+    assert np.isclose(report.results['test']['mse'], sync_report.results['test']['mse'])
+    assert os.path.exists(os.path.join(checkpoint_dir, "best.pt"))
+
+    # the evaluation thread is stopped at the end of training
+    assert len(evaluators) == 1
+    assert evaluators[0]._executor._shutdown and not evaluators[0]._pending
+
+
+def test_async_evaluation_early_stop(monkeypatch):
+    yaml_content = ASYNC_EVALUATION_YAML.replace("num_epochs: 3", """num_epochs: 20
+    early_stop:
+        num_epochs: 1
+        min_diff: 100""")
+    _, report, evaluators = _train_with_evaluator(yaml_content, monkeypatch, True)
+    assert len(report.epoch_losses) < 20
+    assert len(evaluators) == 1
+    assert evaluators[0]._executor._shutdown and not evaluators[0]._pending
@@ -0,0 +1,47 @@
+import os
+from types import SimpleNamespace
+
+from dlex.datatypes import ModelReport
+
+
+def test_report_event_log(tmpdir):
+    report = ModelReport(3)
+    report.params = SimpleNamespace(log_dir=str(tmpdir))
+    report.epoch_losses = []
+
+    update = report.save()
+    assert update['params'] is report.params and update['current_epoch'] == 0
+
+    report.epoch_losses.append(0.5)
+    report.current_test_results = {"test": {"acc": 90.}}
+    assert report.save() == dict(epoch_losses=[0.5], current_test_results={"test": {"acc": 90.}})
+    assert report.save() == {}
+    report.finish()
+    assert report.save() == dict(status="finished")
+
+    loaded = ModelReport.load(str(tmpdir), 3)
+    assert loaded.epoch_losses == [0.5] and loaded.status == "finished"
+    assert loaded.current_test_results == {"test": {"acc": 90.}}
+    assert os.path.exists(ModelReport.get_event_log_path(str(tmpdir), 3))
+    assert ModelReport.load(str(tmpdir), 4) is None
+
+
+def test_consume_report_updates(monkeypatch):
+    import queue
+    import threading
+    import time
+    import dlex.train
+    updates = queue.Queue()
+    monkeypatch.setattr(dlex.train, "report_queue", updates)
+    monkeypatch.setattr(dlex.train, "all_reports", {})
+    thread = threading.Thread(target=dlex.train.consume_report_updates, args=(2,))
+    thread.start()
+
+    # reports can be written while the launcher waits for updates
+    time.sleep(0.2)
+    assert dlex.train.report_lock.acquire(timeout=0.2)
+    dlex.train.report_lock.release()
+
+    updates.put((1, dict(epoch_losses=[0.5])))
+    thread.join()
+    assert dlex.train.all_reports[1].epoch_losses == [0.5]
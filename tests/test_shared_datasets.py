@@ -0,0 +1,41 @@
+import os
+import pickle
+from dataclasses import dataclass
+
+import numpy as np
+
+from dlex.datasets.shared import share_records
+
+
+@dataclass
+class Record:
+    X: list
+    Y: int
+
+
+def test_share_records(tmpdir):
+    records = [dict(X=[1, 2, 3], Y=0, Z=np.ones(2)), dict(X=[], Y=1, Z=np.zeros(2)), dict(X=[4], Y=2, Z=np.ones(2))]
+    shared = share_records(records, str(tmpdir))
+    assert len(shared) == 3
+    assert shared[0]['X'] == [1, 2, 3] and shared[1]['X'] == [] and shared[2]['Y'] == 2
+    assert isinstance(shared[2]['Y'], int)
+    np.testing.assert_array_equal(shared[1]['Z'], np.zeros(2))
+
+    # slices and shuffles only change the order of the records of a view
+    assert [r['Y'] for r in shared[1:]] == [1, 2]
+    view = shared.view()
+    np.random.seed(0)
+    view.shuffle()
+    assert sorted(r['Y'] for r in view) == [0, 1, 2] and [r['Y'] for r in shared] == [0, 1, 2]
+
+    loaded = pickle.loads(pickle.dumps(view))
+    assert [r['Y'] for r in loaded] == [r['Y'] for r in view]
+
+
+def test_share_records_unsupported(tmpdir):
+    shared = share_records([Record([1, 2], 0), Record([3], 1)], os.path.join(str(tmpdir), "records"))
+    assert shared[1] == Record([3], 1)
+
+    assert share_records([dict(X="text")], str(tmpdir)) is None
+    assert share_records([dict(X=1), dict(Y=1)], str(tmpdir)) is None
+    assert share_records([], str(tmpdir)) is None
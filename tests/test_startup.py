@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+import time
+
+import dlex
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(dlex.__file__)))
+HEAVY_MODULES = ["numpy", "torch", "tensorflow", "sklearn", "requests", "tqdm", "pandas"]
+
+
+def _run(code: str) -> str:
+    return subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+
+
+def test_lazy_imports():
+    for module in ["dlex", "dlex.train", "dlex.evaluate"]:
+        imported = _run(
+            f"import sys, multiprocessing, {module}\n"
+            f"print([m for m in {HEAVY_MODULES} if m in sys.modules], len(multiprocessing.active_children()))")
+        assert imported == "[] 0", f"{module}: {imported}"
+
+
+def test_startup_time():
+    def _launch():
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "dlex.train", "--help"], cwd=ROOT, capture_output=True, check=True)
+        return time.perf_counter() - start
+
+    # best of a few runs, to be less sensitive to the load of the machine
+    assert min(_launch() for _ in range(3)) < 1.
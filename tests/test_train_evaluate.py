@@ -0,0 +1,88 @@
+import glob
+import os
+import subprocess
+import sys
+
+import dlex
+from test_pytorch import RegressionModel
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(dlex.__file__)))
+
+YAML = """
+backend: pytorch
+model:
+  name: test_pytorch.RegressionModel
+dataset:
+  name: test_pytorch.Dataset
+  num_train: 20
+  num_test: 10
+  num_classes: 5
+train:
+  num_epochs: 1
+  batch_size: 10
+  optimizer:
+    name: adam
+    lr: 0.01
+test:
+  metrics: [mse]
+"""
+
+
+class FailingModel(RegressionModel):
+    def get_loss(self, batch, output):
+        raise ValueError("Invalid target")
+
+
+def _write_configs(tmpdir, yaml=YAML) -> str:
+    path = os.path.join(str(tmpdir), "cfg.yml")
+    with open(path, "w") as f:
+        f.write(yaml)
+    return path
+
+
+def _run(tmpdir, module, path, *args):
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([ROOT, os.path.join(ROOT, "tests")]),
+        DLEX_CHECKPOINT_PATH=os.path.join(str(tmpdir), "checkpoints"),
+        DLEX_LOG_DIR=os.path.join(str(tmpdir), "logs"),
+        DLEX_TMP_PATH=os.path.join(str(tmpdir), "tmp"),
+        DLEX_DATASET_PATH=os.path.join(str(tmpdir), "datasets"))
+    return subprocess.run(
+        [sys.executable, "-m", module, "-c", path, *args], cwd=str(tmpdir), env=env,
+        stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=300)
+
+
+def test_evaluate_trained_checkpoint(tmpdir):
+    path = _write_configs(tmpdir)
+    assert _run(tmpdir, "dlex.train", path, "--test-set", "test").returncode == 0
+    # checkpoints are found without the run registry of the launcher
+    ret = _run(tmpdir, "dlex.evaluate", path, "-l", "best", "--set", "test")
+    assert ret.returncode == 0, ret.stderr
+    assert "Loaded checkpoint: best" in ret.stdout + ret.stderr
+
+
+def test_profile_training(tmpdir):
+    profile = """  profile:
+    wait: 0
+    warmup: 1
+    active: 1
+    activities: [cpu]
+    evaluation: false
+"""
+    path = _write_configs(tmpdir, YAML.replace("train:\n", "train:\n" + profile))
+    ret = _run(tmpdir, "dlex.train", path, "--test-set", "test")
+    assert ret.returncode == 0, ret.stderr
+    profile_dirs = glob.glob(os.path.join(str(tmpdir), "logs", "**", "profile"), recursive=True)
+    assert len(profile_dirs) == 1
+    files = sorted(os.listdir(profile_dirs[0]))
+    assert [os.path.splitext(f)[1] for f in files] == [".json", ".txt"]
+    assert files[0].startswith("train_")
+
+
+def test_training_error(tmpdir):
+    path = _write_configs(tmpdir, YAML.replace("test_pytorch.RegressionModel", "test_train_evaluate.FailingModel"))
+    ret = _run(tmpdir, "dlex.train", path, "--test-set", "test")
+    # errors other than out of memory are raised instead of skipping the batch
+    assert ret.returncode not in [0, 2]
+    assert "ValueError: Invalid target" in ret.stderr
@@ -0,0 +1,48 @@
+import os
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+import pytest
+
+import dlex.worker
+from dlex.worker import WorkerPool, WorkerClient, DONE, FAILED
+
+
+def _run_job(mode, params, training_idx, cwd):
+    return mode, 10 // params, os.getpid()
+
+
+def test_worker_pool(tmpdir, monkeypatch):
+    # workers are forked after the job function is replaced
+    monkeypatch.setattr(dlex.worker, "_run_job", _run_job)
+    address = os.path.join(str(tmpdir), "workers.sock")
+    pool = WorkerPool(2, backend="none", address=address)
+    thread = threading.Thread(target=pool.serve)
+    thread.start()
+    while not os.path.exists(address):
+        time.sleep(0.1)
+
+    # only the user can connect, with the key of the pool
+    assert os.stat(address).st_mode & 0o077 == 0
+    assert os.stat(address + ".key").st_mode & 0o077 == 0
+    with pytest.raises(AuthenticationError):
+        Client(address, family="AF_UNIX", authkey=b"wrong key")
+
+    client = WorkerClient(address)
+    results = {tag: (status, result) for status, tag, result in client.run(
+        ((i, "train", i % 3, i) for i in range(6)), max_pending=1)}
+    assert sorted(results) == list(range(6))
+    assert all(results[i][0] == FAILED and "ZeroDivisionError" in results[i][1] for i in [0, 3])
+    assert results[1][0] == DONE and results[1][1][:2] == ("train", 10)
+
+    # processes are kept from a run to the next
+    pids = {result[2] for status, result in results.values() if status == DONE}
+    assert len(pids) <= 2
+    assert client.status() == dict(workers=2, ready=2, running=0, pending=0)
+
+    client.stop()
+    client.close()
+    thread.join()
+    assert not os.path.exists(address) and not os.path.exists(address + ".key")